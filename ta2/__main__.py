@@ -8,38 +8,44 @@ import sys
 import traceback
 from datetime import datetime
 
-import pandas as pd
-import tabulate
-from d3m.container.dataset import Dataset
-from d3m.metadata.base import Context
-from d3m.metadata.pipeline import Pipeline
-from d3m.metadata.problem import Problem
-from d3m.runtime import DEFAULT_SCORING_PIPELINE_PATH, Runtime, score
-
-from ta2.search import PipelineSearcher, get_dataset_details
-from ta2.ta3.client import TA3APIClient
-from ta2.ta3.server import serve
 from ta2.utils import logging_setup
 
+# The heavy dependencies, like d3m and the primitives, are imported only by
+# the modes that need them, so parsing the arguments does not wait for them.
+
 LOGGER = logging.getLogger(__name__)
 
+# Names of the ``ta2.tuning.TUNERS``, which cannot be imported before parsing
+TUNERS = ('forest', 'gp', 'windowed_gp')
+
+# Budgets used to build the leaderboard, as stated in the Leaderboard section of the README.
+# Its rows can only be compared with the benchmark while their templates still exist.
+BENCHMARK_TIMEOUT = 30
+BENCHMARK_BUDGET = 2
+
 
 def load_dataset(root_path, phase, inner_phase=None):
+    from ta2 import cache
+
     inner_phase = inner_phase or phase
     path = os.path.join(root_path, phase, 'dataset_' + inner_phase, 'datasetDoc.json')
     if os.path.exists(path):
-        return Dataset.load(dataset_uri='file://' + os.path.abspath(path))
+        return cache.load_dataset('file://' + os.path.abspath(path))
     else:
         path = os.path.join(root_path, phase, 'dataset_' + phase, 'datasetDoc.json')
-        return Dataset.load(dataset_uri='file://' + os.path.abspath(path))
+        return cache.load_dataset('file://' + os.path.abspath(path))
 
 
 def load_problem(root_path, phase):
+    from d3m.metadata.problem import Problem
+
     path = os.path.join(root_path, phase, 'problem_' + phase, 'problemDoc.json')
     return Problem.load(problem_uri='file://' + os.path.abspath(path))
 
 
 def load_pipeline(pipeline_path):
+    from d3m.metadata.pipeline import Pipeline
+
     with open(pipeline_path, 'r') as pipeline_file:
         if pipeline_path.endswith('.json'):
             return Pipeline.from_json(pipeline_file)
@@ -48,18 +54,28 @@ def load_pipeline(pipeline_path):
 
 
 def search(dataset_root, problem, args):
+    from ta2.search import PipelineSearcher
+
     pps = PipelineSearcher(
         args.input,
         args.output,
         args.static,
         dump=True,
         hard_timeout=args.hard,
+        n_workers=args.workers,
+        fold_workers=args.fold_workers,
+        halving=args.halving,
+        abort_margin=args.abort_margin,
+        tuner=args.tuner,
     )
 
     return pps.search(problem, args.timeout, args.budget, args.template)
 
 
 def score_pipeline(dataset_root, problem, pipeline_path, static=None):
+    from d3m.metadata.base import Context
+    from d3m.runtime import DEFAULT_SCORING_PIPELINE_PATH, Runtime, score
+
     train_dataset = load_dataset(dataset_root, 'TRAIN')
     test_dataset = load_dataset(dataset_root, 'SCORE', 'TEST')
     pipeline = load_pipeline(pipeline_path)
@@ -102,6 +118,8 @@ def box_print(message, strong=False):
 
 
 def get_datasets(args):
+    from ta2.search import get_dataset_details
+
     for dataset_name in args.dataset:
         dataset_root = os.path.join(args.input, dataset_name)
         dataset_path = os.path.join(dataset_root, 'TRAIN', 'dataset_TRAIN', 'datasetDoc.json')
@@ -158,14 +176,20 @@ REPORT_COLUMNS = [
 ]
 
 
-def _ta2_test(args):
-
-    # Cleanup output dir
+def _clean_output(args):
     shutil.rmtree(os.path.join(args.output, 'pipelines_ranked'), ignore_errors=True)
     shutil.rmtree(os.path.join(args.output, 'pipelines_scored'), ignore_errors=True)
     shutil.rmtree(os.path.join(args.output, 'pipelines_searched'), ignore_errors=True)
     shutil.rmtree(os.path.join(args.output, 'predictions'), ignore_errors=True)
 
+
+def _ta2_test(args):
+    import pandas as pd
+    import tabulate
+
+    # Cleanup output dir
+    _clean_output(args)
+
     results = list()
     if args.all:
         args.dataset = os.listdir(args.input)
@@ -215,6 +239,82 @@ def _ta2_test(args):
     ))
 
 
+def _benchmark(args):
+    import pandas as pd
+    import tabulate
+
+    from ta2 import benchmark
+
+    # The timeout argument is shared with the other modes, so its default is set here
+    if args.timeout is None:
+        args.timeout = BENCHMARK_TIMEOUT
+
+    # Start cold, without the pipelines, evaluations and history of past runs
+    _clean_output(args)
+    shutil.rmtree(os.path.join(args.output, 'evaluation_cache'), ignore_errors=True)
+    history_path = os.path.join(args.output, 'search_history.jsonl')
+    if os.path.exists(history_path):
+        os.remove(history_path)
+
+    report_name = args.report or os.path.join(args.output, 'benchmark.csv')
+
+    rows = list()
+    metrics = dict()
+    for matrix_dataset, template in benchmark.load_matrix(args.matrix, args.dataset):
+        args.dataset = [matrix_dataset]
+        args.template = benchmark.get_template_names(template)
+        fallback = bool(template) and not args.template
+        if fallback:
+            LOGGER.warning('Template %s not found. Using the default ones', template)
+
+        for dataset_name, dataset_root, problem in get_datasets(args):
+            benchmark.set_seed(args.seed)
+            try:
+                result = benchmark.run_isolated(process_dataset, dataset_name, dataset_root, problem, args)
+            except Exception as ex:
+                box_print("Error processing dataset {}".format(dataset_name), True)
+                traceback.print_exc()
+                result = {'error': '{}: {}'.format(type(ex).__name__, ex)}
+
+            rows.append(benchmark.get_row(dataset_name, template, problem, result, fallback))
+            metrics[dataset_name] = benchmark.get_metric(problem)
+
+        report = pd.DataFrame(rows, columns=benchmark.BENCHMARK_COLUMNS)
+        report['host'] = socket.gethostname()
+        report.to_csv(report_name, index=False)
+
+    if not rows:
+        print("No matiching datasets found")
+        sys.exit(1)
+
+    print(tabulate.tabulate(
+        report[benchmark.BENCHMARK_COLUMNS],
+        showindex=False,
+        tablefmt='github',
+        headers=benchmark.BENCHMARK_COLUMNS
+    ))
+
+    if args.baseline:
+        baseline = benchmark.normalize_baseline(pd.read_csv(args.baseline), metrics)
+        if benchmark.merge_baseline(report, baseline).empty:
+            box_print("No results could be compared against {}. Their datasets and templates "
+                      "do not match, or their templates were not found".format(args.baseline), True)
+            sys.exit(1)
+
+        regressions = benchmark.compare(report, baseline, args.tolerance)
+        if not regressions.empty:
+            box_print("{} regressions found against {}".format(len(regressions), args.baseline), True)
+            print(tabulate.tabulate(
+                regressions,
+                showindex=False,
+                tablefmt='github',
+                headers=regressions.columns
+            ))
+            sys.exit(1)
+
+        box_print("No regressions found against {}".format(args.baseline))
+
+
 def _ta3_test_dataset(client, dataset, timeout):
     print('### Testing dataset {} ###'.format(dataset))
 
@@ -262,6 +362,8 @@ def _ta3_test_dataset(client, dataset, timeout):
 
 
 def _ta3_test(args):
+    from ta2.ta3.client import TA3APIClient
+
     local_input = args.input
     remote_input = '/input' if args.docker else args.input
     client = TA3APIClient(args.port, local_input, remote_input)
@@ -280,6 +382,8 @@ def _ta3_test(args):
 
 
 def _server(args):
+    from ta2.ta3.server import serve
+
     input_dir = args.input or os.getenv('D3MINPUTDIR', 'input')
     output_dir = args.output or os.getenv('D3MOUTPUTDIR', 'output')
     timeout = args.timeout or os.getenv('D3MTIMEOUT', 600)
@@ -290,7 +394,10 @@ def _server(args):
         # FIXME This is just to be sure that it does not crash
         timeout = 600
 
-    serve(args.port, input_dir, output_dir, args.static, timeout, args.debug)
+    serve(args.port, input_dir, output_dir, args.static, timeout, args.debug,
+          workers=args.workers, fold_workers=args.fold_workers,
+          halving=args.halving, abort_margin=args.abort_margin, tuner=args.tuner,
+          preload=args.preload, preload_static=args.preload_static)
 
 
 def parse_args():
@@ -331,6 +438,18 @@ def parse_args():
                              help='Maximum time allowed for the tuning, in number of seconds')
     search_args.add_argument('-st', '--soft-timeout', action='store_false', dest='hard',
                              help='Use a soft timeout instead of hard.')
+    search_args.add_argument('-w', '--workers', type=int, default=1,
+                             help='Number of pipelines to score in parallel during the search')
+    search_args.add_argument('-fw', '--fold-workers', type=int, default=1,
+                             help='Number of cross validation folds to score in parallel')
+    search_args.add_argument('-H', '--halving', type=int,
+                             help='Score the proposals with successive halving, using this '
+                                  'reduction factor, instead of on all the folds')
+    search_args.add_argument('-am', '--abort-margin', type=float,
+                             help='Stop scoring the folds of a proposal when its normalized score '
+                                  'falls this much below the best one')
+    search_args.add_argument('-tu', '--tuner', default='gp', choices=sorted(TUNERS),
+                             help='Surrogate model used to tune the hyperparameters')
 
     # TA3-TA2 Common Args
     ta3_args = argparse.ArgumentParser(add_help=False)
@@ -361,6 +480,30 @@ def parse_args():
         '-e', '--template', action='append',
         help='Name of the template to Use.')
 
+    # Benchmark Mode
+    benchmark_parser = subparsers.add_parser('benchmark', parents=ta2_parents,
+                                             help='Replay a fixed matrix of datasets and templates.')
+    benchmark_parser.set_defaults(mode=_benchmark)
+    benchmark_parser.add_argument(
+        '-m', '--matrix', default='leaderboard.csv',
+        help='Path to a CSV file with the dataset and template columns to run.')
+    benchmark_parser.add_argument(
+        '-B', '--baseline',
+        help='Path to the CSV file of a previous benchmark to compare the results with.')
+    benchmark_parser.add_argument(
+        '--tolerance', type=float, default=0.1,
+        help='Relative change of the times and absolute change of the normalized scores '
+             'above which a result is considered a regression')
+    benchmark_parser.add_argument(
+        '-r', '--report',
+        help='Path to the CSV file where the results will be dumped.')
+    benchmark_parser.add_argument(
+        '-b', '--budget', type=int, default=BENCHMARK_BUDGET,
+        help='Maximum number of tuning iterations to perform')
+    benchmark_parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Random seed set before searching each dataset')
+
     # TA3 Mode
     ta3_parents = [logging_args, io_args, search_args, ta3_args, dataset_args]
     ta3_parser = subparsers.add_parser('ta3', parents=ta3_parents,
@@ -382,6 +525,14 @@ def parse_args():
         '--debug', action='store_true',
         help='Start the server in sync mode. Needed for debugging.'
     )
+    server_parser.add_argument(
+        '--no-preload', action='store_false', dest='preload',
+        help='Do not import the primitives of the templates before starting the server.'
+    )
+    server_parser.add_argument(
+        '--preload-static', action='store_true',
+        help='Also read the static files of the primitives before starting the server.'
+    )
 
     args = parser.parse_args()
 
@@ -389,7 +540,7 @@ def parse_args():
 
     os.makedirs(args.output, exist_ok=True)
 
-    if args.mode is _ta2_test and not args.logfile:
+    if args.mode in (_ta2_test, _benchmark) and not args.logfile:
         args.logfile = os.path.join(args.output, 'ta2.log')
         if os.path.exists(args.logfile):
             os.remove(args.logfile)
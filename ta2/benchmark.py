@@ -0,0 +1,255 @@
+import multiprocessing
+import os
+import random
+import resource
+
+import numpy as np
+import pandas as pd
+
+from ta2.workers import WorkerCrashed
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+
+BENCHMARK_COLUMNS = [
+    'dataset',
+    'template',
+    'best_template',
+    'cv_score',
+    'test_score',
+    'normalized_cv_score',
+    'normalized_test_score',
+    'elapsed_time',
+    'tuning_iterations',
+    'iterations_per_minute',
+    'peak_rss_mb',
+    'fallback',
+    'error',
+]
+
+# Relative change of the times and absolute change of the normalized scores
+# above which the result is considered a regression
+TOLERANCE = 0.1
+
+# Columns compared with the baseline and whether higher values are better
+COMPARED_COLUMNS = {
+    'normalized_cv_score': True,
+    'normalized_test_score': True,
+    'elapsed_time': False,
+    'iterations_per_minute': True,
+    'peak_rss_mb': False,
+}
+
+
+def load_matrix(matrix_path, datasets=None):
+    """Load the dataset and template pairs to run from a CSV file like ``leaderboard.csv``."""
+    matrix = pd.read_csv(matrix_path)
+    if 'template' not in matrix:
+        matrix['template'] = None
+
+    matrix = matrix[['dataset', 'template']].drop_duplicates()
+    if datasets:
+        matrix = matrix[matrix.dataset.isin(datasets)]
+
+    return [
+        (dataset, template if isinstance(template, str) else None)
+        for dataset, template in matrix.itertuples(index=False)
+    ]
+
+
+def get_template_names(template):
+    """Get the templates to search with, or ``None`` to use the default ones.
+
+    The templates that do not exist anymore are replaced by the default ones.
+    """
+    if template and os.path.exists(os.path.join(TEMPLATES_DIR, template)):
+        return [template]
+
+
+def set_seed(random_seed):
+    random.seed(random_seed)
+    np.random.seed(random_seed)
+
+
+def get_peak_rss():
+    """Get the peak memory used so far by this process or any of its finished children, in MB."""
+    peak_rss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+    # Reported in KB on Linux
+    return peak_rss / 1024
+
+
+def _run_measured(connection, function, args):
+    try:
+        result = function(*args)
+        result['peak_rss_mb'] = get_peak_rss()
+        result = (True, result)
+    except Exception as ex:
+        result = (False, ex)
+
+    try:
+        connection.send(result)
+    except Exception as ex:
+        # The result or the exception could not be pickled
+        connection.send((False, Exception('{}: {}'.format(type(ex).__name__, ex))))
+
+
+def run_isolated(function, *args):
+    """Run the function on a new process and add the peak memory that it used to its result.
+
+    The peak memory of a process can only grow, so each dataset runs on its own process
+    to be measured apart from the ones that ran before it. The process is not a daemon,
+    unlike the ``WorkerPool`` ones, so the search can still start its own workers.
+    """
+    connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_run_measured, args=(child_connection, function, args))
+    process.start()
+    child_connection.close()
+    try:
+        success, value = connection.recv()
+    except EOFError:
+        process.join()
+        raise WorkerCrashed('Worker crashed with exit code {}'.format(process.exitcode))
+
+    finally:
+        connection.close()
+
+    process.join()
+    if not success:
+        raise value
+
+    return value
+
+
+def _normalize(metric, score):
+    if metric is not None and not pd.isnull(score):
+        return metric.normalize(score)
+
+
+def get_metric(problem):
+    """Get the metric that the scores of the problem are normalized with."""
+    if problem is not None:
+        return problem['problem']['performance_metrics'][0]['metric']
+
+
+def get_row(dataset, template, problem, result, fallback=False):
+    """Build the benchmark row of a dataset from the result of ``process_dataset``.
+
+    ``fallback`` tells that the template of the matrix was not found, so the row was
+    searched with the default templates instead.
+    """
+    metric = get_metric(problem)
+    elapsed_time = result.get('elapsed_time')
+    if elapsed_time is not None:
+        elapsed_time = elapsed_time.total_seconds()
+
+    iterations = result.get('tuning_iterations')
+    iterations_per_minute = None
+    if iterations and elapsed_time:
+        iterations_per_minute = iterations / elapsed_time * 60
+
+    return {
+        'dataset': dataset,
+        'template': template,
+        'best_template': result.get('template'),
+        'cv_score': result.get('cv_score'),
+        'test_score': result.get('test_score'),
+        'normalized_cv_score': _normalize(metric, result.get('cv_score')),
+        'normalized_test_score': _normalize(metric, result.get('test_score')),
+        'elapsed_time': elapsed_time,
+        'tuning_iterations': iterations,
+        'iterations_per_minute': iterations_per_minute,
+        'peak_rss_mb': result.get('peak_rss_mb'),
+        'fallback': fallback,
+        'error': result.get('error'),
+    }
+
+
+def _is_regression(value, baseline, higher_is_better, relative, tolerance):
+    margin = abs(baseline) * tolerance if relative else tolerance
+    if higher_is_better:
+        return value < baseline - margin
+
+    return value > baseline + margin
+
+
+def _skip_fallback(results):
+    if 'fallback' not in results:
+        return results
+
+    return results[~results.fallback.fillna(False).astype(bool)]
+
+
+def normalize_baseline(baseline, metrics):
+    """Add the normalized scores to a baseline that only has the raw ones, like ``leaderboard.csv``.
+
+    ``metrics`` maps each dataset to the metric of its problem.
+    """
+    baseline = baseline.copy()
+    for column in ('cv_score', 'test_score'):
+        normalized_column = 'normalized_' + column
+        if column in baseline and normalized_column not in baseline:
+            baseline[normalized_column] = [
+                _normalize(metrics.get(dataset), score)
+                for dataset, score in zip(baseline.dataset, baseline[column])
+            ]
+
+    return baseline
+
+
+def merge_baseline(report, baseline):
+    """Match the rows of the report with the ones of the baseline that can be compared.
+
+    The rows are matched by dataset and template, skipping the ones that fell back
+    to the default templates, since they did not run the same search.
+    """
+    report = _skip_fallback(report)
+    baseline = _skip_fallback(baseline)
+    return report.merge(baseline, on=['dataset', 'template'], how='inner', suffixes=('', '_baseline'))
+
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    """Find the results of the report that are worse than the ones of the baseline.
+
+    The rows are matched by ``merge_baseline``, and only the columns found in both
+    are compared. The normalized scores are compared by their absolute change and the
+    rest by their relative change. New errors are regressions too.
+    """
+    merged = merge_baseline(report, baseline)
+
+    regressions = list()
+    for row in merged.to_dict('records'):
+        for column, higher_is_better in COMPARED_COLUMNS.items():
+            baseline_column = column + '_baseline'
+            if baseline_column not in row:
+                continue
+
+            value = row[column]
+            baseline_value = row[baseline_column]
+            if pd.isnull(value) or pd.isnull(baseline_value):
+                continue
+
+            relative = not column.startswith('normalized_')
+            if _is_regression(value, baseline_value, higher_is_better, relative, tolerance):
+                regressions.append({
+                    'dataset': row['dataset'],
+                    'template': row['template'],
+                    'column': column,
+                    'baseline': baseline_value,
+                    'value': value,
+                })
+
+        baseline_error = row.get('error_baseline')
+        if not pd.isnull(row.get('error')) and pd.isnull(baseline_error):
+            regressions.append({
+                'dataset': row['dataset'],
+                'template': row['template'],
+                'column': 'error',
+                'baseline': baseline_error,
+                'value': row['error'],
+            })
+
+    return pd.DataFrame(regressions, columns=['dataset', 'template', 'column', 'baseline', 'value'])
@@ -0,0 +1,412 @@
+import logging
+import os
+import pickle
+import sys
+import threading
+import types
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import unquote, urlparse
+
+from d3m.container.dataset import Dataset
+
+from ta2.utils import get_digest
+
+LOGGER = logging.getLogger(__name__)
+
+STEP_CACHE_SIZE = int(os.getenv('TA2_STEP_CACHE_SIZE', 1024 ** 3))
+DATASET_CACHE_SIZE = int(os.getenv('TA2_DATASET_CACHE_SIZE', 1024 ** 3))
+SPILL_CACHE_SIZE = int(os.getenv('TA2_SPILL_CACHE_SIZE', 2 * 1024 ** 3))
+
+
+# Objects that are not measured, like the ones shared by the whole process
+_UNMEASURED = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+    logging.Logger,
+)
+
+# Maximum number of objects visited to measure a value
+MAX_MEASURED_OBJECTS = 100000
+
+
+def get_size(value):
+    """Approximate the number of bytes used by a step output, a dataset or any other object.
+
+    The data of the pandas and numpy objects is measured, and the other objects
+    are measured by what their attributes hold, so fitted runtimes can be measured
+    without pickling them. The objects referenced more than once are counted once.
+    """
+    size = 0
+    seen = set()
+    stack = [value]
+    while stack and len(seen) < MAX_MEASURED_OBJECTS:
+        value = stack.pop()
+        if isinstance(value, (list, tuple, dict)) or hasattr(value, '__dict__'):
+            if id(value) in seen:
+                continue
+
+            seen.add(id(value))
+
+        if isinstance(value, (list, tuple)):
+            stack.extend(value)
+
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+
+        elif hasattr(value, 'memory_usage'):
+            size += int(value.memory_usage(index=True, deep=True).sum())
+
+        elif hasattr(value, 'nbytes'):
+            size += int(value.nbytes)
+
+        elif isinstance(value, _UNMEASURED):
+            continue
+
+        else:
+            size += sys.getsizeof(value)
+            if hasattr(value, '__dict__'):
+                stack.append(vars(value))
+
+    return size
+
+
+class StepCache:
+    """In memory LRU cache of step outputs or datasets, bounded by their size in bytes."""
+
+    def __init__(self, max_size=STEP_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, size=None):
+        """Store the value and return the ``(key, value)`` pairs that did not fit anymore.
+
+        This includes the given one if it is bigger than the whole cache.
+        """
+        if size is None:
+            size = get_size(value)
+
+        if size > self.max_size:
+            LOGGER.debug('Not caching %s: %s bytes is above the cache size', key, size)
+            return [(key, value)]
+
+        evicted = list()
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self.size -= old_entry[1]
+
+            self._entries[key] = value, size
+            self.size += size
+
+            while self.size > self.max_size:
+                evicted_key, (evicted_value, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                evicted.append((evicted_key, evicted_value))
+
+        return evicted
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+
+            self.size -= entry[1]
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+class KeyLocks:
+    """Locks by key, forgotten once no thread is holding or waiting for them."""
+
+    def __init__(self):
+        self._locks = dict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, key):
+        with self._lock:
+            lock, users = self._locks.get(key, (None, 0))
+            lock = lock or threading.Lock()
+            self._locks[key] = lock, users + 1
+
+        try:
+            with lock:
+                yield
+
+        finally:
+            with self._lock:
+                users = self._locks[key][1] - 1
+                if users:
+                    self._locks[key] = lock, users
+                else:
+                    del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class SpillCache:
+    """LRU cache bounded by size in bytes that keeps the evicted values pickled on disk.
+
+    Values are pickled into ``spill_dir`` when they are evicted from memory, and they
+    are loaded back from disk the next time they are requested. If ``persistent``,
+    they are also pickled as soon as they are stored, so the next processes can load
+    them too. Values that cannot be pickled are never evicted.
+
+    If ``max_disk_size`` is given, the pickles used least recently are removed from
+    ``spill_dir`` once it grows above that many bytes, so their values are lost.
+    """
+
+    def __init__(self, spill_dir, max_size=SPILL_CACHE_SIZE, persistent=False, max_disk_size=None):
+        self.spill_dir = spill_dir
+        self.persistent = persistent
+        self.max_disk_size = max_disk_size
+        self._memory = StepCache(max_size)
+        self._pinned = dict()
+        self._spilling = dict()
+        self._lock = threading.Lock()
+        self._disk_size = None
+        self._disk_lock = threading.Lock()
+
+    def _get_path(self, key):
+        return os.path.join(self.spill_dir, get_digest(key) + '.pkl')
+
+    def _dump(self, key, value):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = self._get_path(key)
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as pickle_file:
+                pickle.dump(value, pickle_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+
+        except Exception:
+            LOGGER.exception('Could not pickle %s. Keeping it in memory', key)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+            return None
+
+        if self.max_disk_size is not None:
+            self._prune(size)
+
+        return size
+
+    def _prune(self, size):
+        """Remove the pickles used least recently until ``spill_dir`` fits ``max_disk_size``."""
+        with self._disk_lock:
+            # Other processes may be using the same dir, so it is only listed when it
+            # looks full, and the pickles used recently are the ones touched last.
+            if self._disk_size is not None:
+                self._disk_size += size
+                if self._disk_size <= self.max_disk_size:
+                    return
+
+            pickles = list()
+            for entry in os.scandir(self.spill_dir):
+                if entry.name.endswith('.pkl'):
+                    try:
+                        stat = entry.stat()
+                        pickles.append((stat.st_mtime, stat.st_size, entry.path))
+                    except FileNotFoundError:
+                        pass
+
+            disk_size = sum(pickle_size for _, pickle_size, _ in pickles)
+            for _, pickle_size, path in sorted(pickles):
+                if disk_size <= self.max_disk_size:
+                    break
+
+                LOGGER.info('Removing %s from %s', os.path.basename(path), self.spill_dir)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+                disk_size -= pickle_size
+
+            self._disk_size = disk_size
+
+    def _remove(self, key):
+        try:
+            os.remove(self._get_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _store(self, key, value, size):
+        """Keep the value in memory and pickle the ones evicted to make room for it."""
+        with self._lock:
+            evicted = self._memory.set(key, value, size)
+            for evicted_key, evicted_value in evicted:
+                self._spilling[evicted_key] = evicted_value
+
+        for evicted_key, evicted_value in evicted:
+            # The values loaded from disk or stored by a persistent cache are already there
+            pickled = os.path.exists(self._get_path(evicted_key))
+            if not pickled:
+                LOGGER.info('Spilling %s to %s', evicted_key, self.spill_dir)
+                pickled = self._dump(evicted_key, evicted_value) is not None
+
+            with self._lock:
+                deleted = self._spilling.pop(evicted_key, None) is None
+                if not pickled and not deleted:
+                    self._pinned[evicted_key] = evicted_value
+
+            if deleted:
+                # Deleted while it was being pickled
+                self._remove(evicted_key)
+
+    def set(self, key, value):
+        self._pinned.pop(key, None)
+        if self.persistent:
+            size = self._dump(key, value)
+            if size is None:
+                self._pinned[key] = value
+                return
+
+        else:
+            # The value pickled before is stale now
+            self._remove(key)
+            size = get_size(value)
+
+        self._store(key, value, size)
+
+    def get(self, key):
+        value = self._pinned.get(key)
+        if value is not None:
+            return value
+
+        path = self._get_path(key)
+        with self._lock:
+            value = self._memory.get(key)
+            if value is None:
+                value = self._spilling.get(key)
+
+            if value is not None or not os.path.exists(path):
+                return value
+
+            LOGGER.info('Loading %s from %s', key, path)
+            try:
+                with open(path, 'rb') as pickle_file:
+                    value = pickle.load(pickle_file)
+
+                size = os.path.getsize(path)
+                if self.max_disk_size is not None:
+                    # Used recently, so it is pruned last
+                    os.utime(path)
+
+            except FileNotFoundError:
+                # Pruned by another process
+                return None
+
+        self._store(key, value, size)
+        return value
+
+    def delete(self, key):
+        """Forget the value, also removing it from disk."""
+        with self._lock:
+            self._memory.pop(key)
+            self._spilling.pop(key, None)
+            self._pinned.pop(key, None)
+
+        self._remove(key)
+
+    @property
+    def size(self):
+        """Bytes used by the values kept in memory, not counting the ones that cannot be pickled."""
+        return self._memory.size
+
+    def __contains__(self, key):
+        return (
+            key in self._pinned or
+            key in self._memory or
+            key in self._spilling or
+            os.path.exists(self._get_path(key))
+        )
+
+
+DATASET_CACHE = StepCache(DATASET_CACHE_SIZE)
+TABLES_DIR = 'tables'
+_DATASET_LOCKS = KeyLocks()
+
+
+def _get_file_state(path, relative_to):
+    stat = os.stat(path)
+    return os.path.relpath(path, relative_to), stat.st_mtime_ns, stat.st_size
+
+
+def _get_dataset_key(dataset_uri):
+    """Build a key from the path of a local dataset and the state of its files.
+
+    The files in the dataset folder, like ``datasetDoc.json``, and the ones in
+    its ``tables`` folder are checked one by one. The other folders can hold tens
+    of thousands of media files, so only their own modification time is checked,
+    which changes when files are added, removed or renamed inside them.
+
+    Datasets that are not local files are not cached, so None is returned for them.
+    """
+    parsed_uri = urlparse(dataset_uri)
+    if parsed_uri.scheme != 'file':
+        return None
+
+    path = os.path.realpath(unquote(parsed_uri.path))
+    dataset_dir = os.path.dirname(path)
+    files = list()
+    for name in sorted(os.listdir(dataset_dir)):
+        file_path = os.path.join(dataset_dir, name)
+        if name == TABLES_DIR and os.path.isdir(file_path):
+            for root, dirs, filenames in os.walk(file_path):
+                dirs.sort()
+                for filename in sorted(filenames):
+                    files.append(_get_file_state(os.path.join(root, filename), dataset_dir))
+
+        else:
+            files.append(_get_file_state(file_path, dataset_dir))
+
+    return get_digest([path, files])
+
+
+def load_dataset(dataset_uri):
+    """Load a dataset, reusing the one loaded before from the same unchanged files.
+
+    The returned dataset can be shared with other callers, so it must not be modified.
+    """
+    key = _get_dataset_key(dataset_uri)
+    if key is None:
+        return Dataset.load(dataset_uri)
+
+    with _DATASET_LOCKS.hold(key):
+        dataset = DATASET_CACHE.get(key)
+        if dataset is None:
+            LOGGER.info('Loading dataset %s', dataset_uri)
+            dataset = Dataset.load(dataset_uri)
+            DATASET_CACHE.set(key, dataset)
+
+    return dataset
@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+HISTORY_PATH = os.getenv('TA2_HISTORY_PATH')
+NEAREST_DATASETS = 3
+MAX_RECORDS = 10
+
+LOGGER = logging.getLogger(__name__)
+
+_LOCK = threading.Lock()
+
+
+def _to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+
+    raise TypeError('{} is not JSON serializable'.format(type(value).__name__))
+
+
+def get_distance(meta_features, other):
+    """Distance between the meta-features of two datasets.
+
+    Datasets whose modality or task type differ are infinitely far apart,
+    and the numeric features are compared in logarithmic scale.
+    """
+    distance = 0
+    for name in set(meta_features) | set(other):
+        value = meta_features.get(name)
+        other_value = other.get(name)
+        if isinstance(value, str) or isinstance(other_value, str):
+            if value != other_value:
+                return np.inf
+
+        elif value is None or other_value is None:
+            distance += 1
+
+        else:
+            distance += (np.log1p(value) - np.log1p(other_value)) ** 2
+
+    return np.sqrt(distance)
+
+
+class SearchHistory:
+    """Scores of the pipelines found by past searches, stored in a JSON lines file.
+
+    Each record holds the meta-features of the dataset, the template and the
+    hyperparameters of the pipeline, its normalized score and how long it
+    took to score it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def add(self, dataset, meta_features, template, hyperparameters, normalized_score, elapsed):
+        record = {
+            'dataset': dataset,
+            'meta_features': meta_features,
+            'template': template,
+            'hyperparameters': [
+                [block, name, value]
+                for (block, name), value in hyperparameters.items()
+            ],
+            'normalized_score': normalized_score,
+            'elapsed': elapsed,
+        }
+        line = json.dumps(record, default=_to_json)
+
+        with _LOCK:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'a') as history_file:
+                history_file.write(line + '\n')
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return list()
+
+        records = list()
+        with open(self.path) as history_file:
+            for line in history_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Incomplete line left by a search that was killed while writing it
+                    continue
+
+                record['hyperparameters'] = {
+                    (block, name): value
+                    for block, name, value in record['hyperparameters']
+                }
+                records.append(record)
+
+        return records
+
+    def get_nearest(self, meta_features, datasets=NEAREST_DATASETS, max_records=MAX_RECORDS):
+        """Get the best records of each template in the datasets most similar to this one."""
+        dataset_records = defaultdict(list)
+        for record in self.load():
+            dataset_records[record['dataset']].append(record)
+
+        distances = list()
+        for dataset, records in dataset_records.items():
+            distance = get_distance(meta_features, records[-1]['meta_features'])
+            if np.isfinite(distance):
+                distances.append((distance, dataset))
+
+        template_records = defaultdict(list)
+        for _, dataset in sorted(distances)[:datasets]:
+            for record in dataset_records[dataset]:
+                template_records[record['template']].append(record)
+
+        nearest = list()
+        for records in template_records.values():
+            records.sort(key=lambda record: record['normalized_score'], reverse=True)
+            nearest.extend(records[:max_records])
+
+        LOGGER.info('Found %s records in the history of %s similar datasets',
+                    len(nearest), min(len(distances), datasets))
+
+        return nearest
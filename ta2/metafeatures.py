@@ -0,0 +1,85 @@
+import pandas as pd
+from d3m.metadata.base import ALL_ELEMENTS
+
+LEARNING_DATA = 'learningData'
+
+CATEGORICAL = 'https://metadata.datadrivendiscovery.org/types/CategoricalData'
+TEXT = 'http://schema.org/Text'
+
+# Rows used to estimate the missing values
+SAMPLE_ROWS = 10000
+
+
+def get_learning_data(dataset):
+    """Get the id and the main table of the dataset, or ``(None, None)`` if it has no tables."""
+    if LEARNING_DATA in dataset:
+        return LEARNING_DATA, dataset[LEARNING_DATA]
+
+    tables = [
+        (resource_id, resource)
+        for resource_id, resource in dataset.items()
+        if isinstance(resource, pd.DataFrame)
+    ]
+    if tables:
+        return max(tables, key=lambda table: len(table[1]))
+
+    return None, None
+
+
+def _get_semantic_types(dataset, resource_id, columns):
+    metadata = getattr(dataset, 'metadata', None)
+    if metadata is None:
+        return [()] * columns
+
+    return [
+        metadata.query((resource_id, ALL_ELEMENTS, index)).get('semantic_types', ())
+        for index in range(columns)
+    ]
+
+
+def _get_target_index(resource_id, targets):
+    for target in targets or ():
+        if target.get('resource_id', resource_id) == resource_id:
+            return target['column_index']
+
+
+def get_meta_features(dataset, data_modality, task_type, targets=None):
+    """Describe the dataset with a few features that are cheap to compute.
+
+    Besides the shape of the main table, they include the ratio of categorical
+    columns and missing values, the number of distinct values of the target and
+    whether there are text columns. They are used to rank the templates and to
+    find the past searches on the most similar datasets.
+    """
+    meta_features = {
+        'data_modality': data_modality,
+        'task_type': task_type,
+    }
+
+    resource_id, learning_data = get_learning_data(dataset)
+    if learning_data is None:
+        return meta_features
+
+    rows, columns = learning_data.shape
+    meta_features['rows'] = rows
+    meta_features['columns'] = columns
+
+    target_index = _get_target_index(resource_id, targets)
+    semantic_types = _get_semantic_types(dataset, resource_id, columns)
+    features = [
+        types for index, types in enumerate(semantic_types)
+        if index != target_index
+    ]
+    categorical = sum(CATEGORICAL in types for types in features)
+    meta_features['categorical_ratio'] = categorical / len(features) if features else 0.0
+    meta_features['text_columns'] = any(TEXT in types for types in features)
+
+    # The values are not parsed yet, so the missing ones are empty strings
+    sample = learning_data.head(SAMPLE_ROWS)
+    missing = sample.isnull().values | (sample.values == '')
+    meta_features['missing_ratio'] = float(missing.mean()) if missing.size else 0.0
+
+    if target_index is not None:
+        meta_features['target_cardinality'] = int(learning_data.iloc[:, target_index].nunique())
+
+    return meta_features
@@ -4,24 +4,27 @@ import logging
 import os
 import random
 import signal
+import threading
 import warnings
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from datetime import datetime, timedelta
 from enum import Enum
-from multiprocessing import Manager, Process
 
+import d3m
 import numpy as np
-from d3m.container.dataset import Dataset
 from d3m.metadata.base import ArgumentType, Context
 from d3m.metadata.pipeline import Pipeline, PrimitiveStep
 from d3m.metadata.problem import TaskType
-from d3m.runtime import DEFAULT_SCORING_PIPELINE_PATH
-from d3m.runtime import evaluate as d3m_evaluate
-from datamart import DatamartQuery
-from datamart_rest import RESTDatamart
+from d3m.runtime import DEFAULT_SCORING_PIPELINE_PATH, Runtime, prepare_data
+from d3m.runtime import score as d3m_score
 
+from ta2.cache import STEP_CACHE_SIZE, SpillCache, StepCache, get_size, load_dataset
+from ta2.history import HISTORY_PATH, SearchHistory
+from ta2.metafeatures import get_meta_features
+from ta2.ta3.scheduler import get_max_running
 from ta2.tuning import SelectorTuner
-from ta2.utils import dump_pipeline
+from ta2.utils import dump_pipeline, get_dataset_index, get_digest
+from ta2.workers import WorkerPool, share, unshare
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 PIPELINES_DIR = os.path.join(BASE_DIR, 'pipelines')
@@ -32,12 +35,39 @@ DATAMART_URL = os.getenv('DATAMART_URL_NYU', 'https://datamart.d3m.vida-nyu.org'
 
 TUNING_PARAMETER = 'https://metadata.datadrivendiscovery.org/types/TuningParameter'
 
+MAX_CACHED_SPLITS = 2
+
+EVALUATION_CACHE_DIR = os.getenv('TA2_EVALUATION_CACHE_DIR')
+EVALUATION_CACHE_SIZE = int(os.getenv('TA2_EVALUATION_CACHE_SIZE', 100 * 1024 ** 2))
+EVALUATION_CACHE_DISK_SIZE = int(os.getenv('TA2_EVALUATION_CACHE_DISK_SIZE', 1024 ** 3))
+
 SUBPROCESS_PRIMITIVES = [
     'd3m.primitives.natural_language_processing.lda.Fastlvm'
 ]
+# As many as the sessions that can run at the same time, so they do not wait for each other
+SUBPROCESS_WORKERS = int(os.getenv('TA2_SUBPROCESS_WORKERS') or get_max_running())
 
 LOGGER = logging.getLogger(__name__)
 
+STEP_CACHE = StepCache()
+
+
+def _init_step_cache(workers):
+    """Give the step cache of a worker process its part of ``STEP_CACHE_SIZE``.
+
+    Each process fills its own copy of the cache, so the ones of a pool share the
+    budget instead of holding ``STEP_CACHE_SIZE`` each. A fold is sent to any idle
+    worker, so the prefixes cached by one of them are only reused when it gets
+    another candidate of the same template on the same fold.
+    """
+    STEP_CACHE.clear()
+    STEP_CACHE.max_size = STEP_CACHE_SIZE // workers
+
+
+# Long lived processes shared by all the searchers to isolate the
+# primitives that crash. They are only restarted if they die.
+SUBPROCESS_POOL = WorkerPool(SUBPROCESS_WORKERS, _init_step_cache, (SUBPROCESS_WORKERS, ))
+
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
 
@@ -89,6 +119,31 @@ class Templates(Enum):
     # GRAPH_MATCHING_JHU = 'graph_matching_jhu.yml'
 
 
+# Templates that encode the categorical and text columns
+ENCODING_TEMPLATES = (
+    Templates.SINGLE_TABLE_CLASSIFICATION_ENC_XGB,
+    Templates.SINGLE_TABLE_REGRESSION_ENC_XGB,
+)
+
+# Templates that do not impute the missing values
+NO_IMPUTATION_TEMPLATES = (
+    Templates.SINGLE_TABLE_CLASSIFICATION_AR_RF,
+)
+
+# Templates whose estimator does not grow with the number of classes
+MULTICLASS_TEMPLATES = (
+    Templates.SINGLE_TABLE_CLASSIFICATION_AR_RF,
+)
+
+# Templates that synthesize features, which is slow on big tables
+FEATURE_SYNTHESIS_TEMPLATES = (
+    Templates.SINGLE_TABLE_CLASSIFICATION_DFS_ROBUST_XGB,
+)
+
+LARGE_DATASET_CELLS = int(os.getenv('TA2_LARGE_DATASET_CELLS', 10 ** 6))
+MANY_CLASSES = 10
+
+
 def detect_data_modality(dataset_doc_path):
     with open(dataset_doc_path) as f:
         dataset_doc = json.load(f)
@@ -141,35 +196,262 @@ def to_dicts(hyperparameters):
     return params_tree
 
 
+def _copy_step(step, references=None, offset=0):
+    references = references or dict()
+
+    def _reference(data):
+        if data in references:
+            return references[data]
+
+        if offset and data.startswith('steps.'):
+            _, step_id, output = data.split('.', 2)
+            return 'steps.{}.{}'.format(int(step_id) - offset, output)
+
+        return data
+
+    new_step = PrimitiveStep(primitive=step.primitive)
+    for name, argument in step.arguments.items():
+        new_step.add_argument(
+            name=name,
+            argument_type=argument['type'],
+            data_reference=_reference(argument['data'])
+        )
+
+    for output in step.outputs:
+        new_step.add_output(output)
+
+    for name, hyperparam in step.hyperparams.items():
+        new_step.add_hyperparameter(
+            name=name,
+            argument_type=hyperparam['type'],
+            data=hyperparam['data']
+        )
+
+    return new_step
+
+
+def _is_prefix_reference(data, prefix_steps):
+    if data.startswith('inputs.'):
+        return True
+
+    return int(data.split('.')[1]) < prefix_steps
+
+
+def split_pipeline(pipeline, prefix_steps):
+    """Split a pipeline in a prefix with its first steps and a suffix with the rest of them.
+
+    The suffix pipeline inputs are the pipeline inputs and prefix step outputs used
+    by its steps, in the order given by the returned list of references. The prefix
+    pipeline has one output for each one of the step outputs in this list.
+
+    ``None`` is returned if the pipeline cannot be split at the given step.
+    """
+    if not 0 < prefix_steps < len(pipeline.steps):
+        return None
+
+    if not all(isinstance(step, PrimitiveStep) for step in pipeline.steps):
+        return None
+
+    references = list()
+    suffix_steps = pipeline.steps[prefix_steps:]
+    for step in suffix_steps:
+        for hyperparam in step.hyperparams.values():
+            if hyperparam['type'] != ArgumentType.VALUE:
+                # Hyperparameters pointing at other steps are not supported
+                return None
+
+        for argument in step.arguments.values():
+            data = argument['data']
+            if argument['type'] != ArgumentType.CONTAINER or not isinstance(data, str):
+                return None
+
+            if _is_prefix_reference(data, prefix_steps) and data not in references:
+                references.append(data)
+
+    for output in pipeline.outputs:
+        if _is_prefix_reference(output['data'], prefix_steps):
+            return None
+
+    prefix = Pipeline()
+    for input_ in pipeline.inputs:
+        prefix.add_input(name=input_['name'])
+
+    for step in pipeline.steps[:prefix_steps]:
+        prefix.add_step(_copy_step(step))
+
+    suffix = Pipeline()
+    suffix_references = dict()
+    for reference in references:
+        suffix_references[reference] = suffix.add_input(name=reference)
+        if reference.startswith('steps.'):
+            prefix.add_output(name=reference, data_reference=reference)
+
+    for step in suffix_steps:
+        suffix.add_step(_copy_step(step, suffix_references, prefix_steps))
+
+    for output in pipeline.outputs:
+        _, step_id, step_output = output['data'].split('.', 2)
+        data_reference = 'steps.{}.{}'.format(int(step_id) - prefix_steps, step_output)
+        suffix.add_output(name=output['name'], data_reference=data_reference)
+
+    return prefix, references, suffix
+
+
+def _check_success(result):
+    if result.error is not None:
+        cause = result.error.__cause__
+        if isinstance(cause, BaseException):
+            raise cause
+
+        raise result.error
+
+
+def _fit_produce(pipeline, problem, train, test, random_seed, volumes_dir):
+    runtime = Runtime(
+        pipeline=pipeline,
+        problem_description=problem,
+        context=Context.TESTING,
+        random_seed=random_seed,
+        volumes_dir=volumes_dir,
+    )
+
+    fit_results = runtime.fit(inputs=train)
+    _check_success(fit_results)
+
+    produce_results = runtime.produce(inputs=test)
+    _check_success(produce_results)
+
+    return fit_results.values, produce_results.values
+
+
+def _get_suffix_inputs(references, inputs, prefix_values):
+    suffix_inputs = list()
+    prefix_outputs = 0
+    for reference in references:
+        if reference.startswith('inputs.'):
+            suffix_inputs.append(inputs[int(reference.split('.')[1])])
+        else:
+            suffix_inputs.append(prefix_values['outputs.{}'.format(prefix_outputs)])
+            prefix_outputs += 1
+
+    return suffix_inputs
+
+
+def _cached_fit_produce(pipeline, problem, fold_key, train, test, random_seed, volumes_dir):
+    """Fit and produce the pipeline reusing the outputs of its untuned first steps.
+
+    All the candidates of a template share the steps that come before the
+    first tuned one, so their outputs are cached for each fold and only the
+    rest of the pipeline is fitted and produced again.
+    """
+    prefix_steps = getattr(pipeline, 'prefix_steps', 0)
+    parts = split_pipeline(pipeline, prefix_steps) if STEP_CACHE.max_size else None
+    if parts is None:
+        return _fit_produce(pipeline, problem, [train], [test], random_seed, volumes_dir)
+
+    prefix, references, suffix = parts
+    key = get_digest([fold_key, random_seed, prefix.to_json_structure()['steps'], references])
+    prefix_values = STEP_CACHE.get(key)
+    if prefix_values is None:
+        prefix_values = _fit_produce(prefix, problem, [train], [test], random_seed, volumes_dir)
+        STEP_CACHE.set(key, prefix_values)
+    else:
+        LOGGER.info('Reusing the outputs of the first %s steps of %s', prefix_steps, pipeline.id)
+
+    train_values, test_values = prefix_values
+    suffix_train = _get_suffix_inputs(references, [train], train_values)
+    suffix_test = _get_suffix_inputs(references, [test], test_values)
+
+    # The runtime seeds each primitive with the random seed plus its step index, so
+    # the suffix steps get the same seeds that they would get in the whole pipeline.
+    suffix_seed = random_seed + prefix_steps
+    return _fit_produce(suffix, problem, suffix_train, suffix_test, suffix_seed, volumes_dir)
+
+
+def evaluate_fold(pipeline, scoring_pipeline, problem, split, metrics,
+                  random_seed=0, volumes_dir=None):
+    """Fit the pipeline on one fold and score its predictions."""
+    fold_key, train, test, score = split
+    _, predictions = _cached_fit_produce(
+        pipeline, problem, fold_key, train, test, random_seed, volumes_dir)
+
+    scores, _ = d3m_score(
+        scoring_pipeline, problem, predictions['outputs.0'], [score], metrics,
+        context=Context.TESTING, random_seed=random_seed,
+    )
+
+    return scores
+
+
+def evaluate_folds(pipeline, scoring_pipeline, problem, splits, metrics,
+                   random_seed=0, volumes_dir=None):
+    return [
+        evaluate_fold(pipeline, scoring_pipeline, problem, split, metrics, random_seed, volumes_dir)
+        for split in splits
+    ]
+
+
+_WORKER_CONTEXT = dict()
+
+
+def _init_search_worker(searcher, dataset, problem):
+    # The worker is already an isolated process, so there is
+    # no need to spawn yet another one for the crashing primitives.
+    searcher.isolated = True
+
+    # Another thread could have been holding the lock when the worker was forked
+    searcher._lock = threading.Lock()
+    _init_step_cache(searcher.n_workers)
+
+    _WORKER_CONTEXT['searcher'] = searcher
+    _WORKER_CONTEXT['dataset'] = dataset
+    _WORKER_CONTEXT['problem'] = problem
+
+
+SCORE_ATTRIBUTES = ('cv_metric_scores', 'cv_scores', 'score', 'partial', 'aborted', 'elapsed')
+
+
+def _score_in_worker(pipeline, max_folds=None, abort_below=None):
+    searcher = _WORKER_CONTEXT['searcher']
+    searcher.score_pipeline(_WORKER_CONTEXT['dataset'], _WORKER_CONTEXT['problem'], pipeline,
+                            max_folds=max_folds, abort_below=abort_below)
+
+    return {name: getattr(pipeline, name) for name in SCORE_ATTRIBUTES}
+
+
 FILE_COLLECTION = 'https://metadata.datadrivendiscovery.org/types/FilesCollection'
 GRAPH = 'https://metadata.datadrivendiscovery.org/types/Graph'
 EDGE_LIST = 'https://metadata.datadrivendiscovery.org/types/EdgeList'
 
 
-class PipelineSearcher:
+class _Splits:
+    """The splits of a fold configuration and the references that share them with the workers.
 
-    def _find_dataset(self, dataset_id):
-        train = 'TRAIN' in dataset_id
-        for dataset_name in os.scandir(self.input):
-            dataset_root = os.path.join(self.input, dataset_name)
-            if train:
-                dataset_doc_dir = os.path.join(dataset_root, 'TRAIN', 'dataset_TRAIN')
-            else:
-                dataset_doc_dir = os.path.join(dataset_root, dataset_name + '_dataset')
+    They are only shared when a worker process needs them, and they stop
+    being shared once they are evicted from the cache and no evaluation
+    is using them anymore.
+    """
+
+    def __init__(self, splits):
+        self.splits = splits
+        self.shared = None
+        self.users = 0
+        self.evicted = False
 
-            dataset_doc_path = os.path.join(dataset_doc_dir, 'datasetDoc.json')
+    def unshare(self):
+        for shared in self.shared or ():
+            unshare(shared)
 
-            LOGGER.info('Loading datasetDoc from %s', dataset_doc_path)
-            with open(dataset_doc_path, 'r') as dataset_doc_file:
-                dataset_doc = json.load(dataset_doc_file)
 
-            if dataset_doc['about']['datasetID'] == dataset_id:
-                LOGGER.info('Dataset_id %s found!', dataset_id)
-                dataset_path = 'file://' + os.path.abspath(dataset_doc_path)
+class PipelineSearcher:
 
-                return dataset_name, dataset_path
+    def _find_dataset(self, dataset_id):
+        dataset = get_dataset_index(self.input).find(dataset_id)
+        if dataset is None:
+            raise ValueError('Cannot find dataset {}'.format(dataset_id))
 
-        raise ValueError('Cannot find dataset {}'.format(dataset_id))
+        LOGGER.info('Dataset_id %s found!', dataset_id)
+        return dataset
 
     def _get_dataset_details(self, problem):
         dataset_id = problem['inputs'][0]['dataset_id']
@@ -220,7 +502,45 @@ class PipelineSearcher:
         with open(path, 'r') as pipeline_file:
             return loader(string_or_file=pipeline_file)
 
-    def _get_templates(self, data_modality, task_type):
+    @staticmethod
+    def _rank_templates(templates, meta_features):
+        """Sort the templates by how likely they are to win and how cheap they are to run.
+
+        The templates that cannot handle the dataset are discarded, unless that
+        would leave none, and the original order is kept between the others.
+        """
+        rows = meta_features.get('rows')
+        if rows is None:
+            return templates
+
+        cells = rows * meta_features['columns']
+        encode = meta_features.get('categorical_ratio') or meta_features.get('text_columns')
+        many_classes = (
+            meta_features.get('task_type') == TaskType.CLASSIFICATION.name.lower() and
+            meta_features.get('target_cardinality', 0) > MANY_CLASSES
+        )
+
+        ranked = list()
+        for index, template in enumerate(templates):
+            if meta_features.get('missing_ratio') and template in NO_IMPUTATION_TEMPLATES:
+                continue
+
+            penalty = 0
+            if encode and template not in ENCODING_TEMPLATES:
+                penalty += 1
+            if many_classes and template not in MULTICLASS_TEMPLATES:
+                penalty += 1
+            if cells > LARGE_DATASET_CELLS and template in FEATURE_SYNTHESIS_TEMPLATES:
+                penalty += 2
+
+            ranked.append((penalty, index, template))
+
+        if not ranked:
+            return templates
+
+        return [template for _, _, template in sorted(ranked)]
+
+    def _get_templates(self, data_modality, task_type, meta_features=None):
         LOGGER.info("Loading template for data modality %s and task type %s",
                     data_modality, task_type)
 
@@ -298,16 +618,41 @@ class PipelineSearcher:
             elif task_type == TaskType.VERTEX_CLASSIFICATION.name.lower():
                 templates = [Templates.SINGLE_TABLE_CLASSIFICATION_ENC_XGB]
 
+        if meta_features:
+            templates = self._rank_templates(templates, meta_features)
+
         return [template.value for template in templates]
 
     def __init__(self, input_dir='input', output_dir='output', static_dir='static',
-                 dump=False, hard_timeout=False):
+                 dump=False, hard_timeout=False, n_workers=1, fold_workers=1, halving=None,
+                 abort_margin=None, tuner='gp'):
+        if halving is not None and halving < 2:
+            raise ValueError('The halving factor must be at least 2')
+
         self.input = input_dir
         self.output = output_dir
         self.static = static_dir
         self.dump = dump
         self.hard_timeout = hard_timeout
-        self.subprocess = None
+        self.n_workers = n_workers or 1
+        self.fold_workers = fold_workers or 1
+        self.halving = halving
+        self.abort_margin = abort_margin
+        self.tuner = tuner
+        self.isolated = False
+        self._stop = False
+        self._rung_scores = defaultdict(list)
+        self._best_normalized = 0
+        self._fold_pool = None
+        self._fold_pool_users = 0
+        self._searching = False
+        self._splits = OrderedDict()
+
+        # The fold pool and the splits are used by the search and by the ScoreSolution threads
+        self._lock = threading.Lock()
+
+        # Notified every time a new solution is found
+        self.updated = threading.Condition()
 
         self.ranked_dir = os.path.join(self.output, 'pipelines_ranked')
         self.scored_dir = os.path.join(self.output, 'pipelines_scored')
@@ -316,49 +661,255 @@ class PipelineSearcher:
         os.makedirs(self.scored_dir, exist_ok=True)
         os.makedirs(self.searched_dir, exist_ok=True)
 
+        # Scores of past searches, used to warm start the tuning
+        history_path = HISTORY_PATH or os.path.join(self.output, 'search_history.jsonl')
+        self.history = SearchHistory(history_path)
+
+        # Scores of each fold of the pipelines already evaluated, kept on disk
+        evaluation_cache_dir = EVALUATION_CACHE_DIR or os.path.join(self.output, 'evaluation_cache')
+        self.evaluation_cache = SpillCache(evaluation_cache_dir, EVALUATION_CACHE_SIZE, persistent=True,
+                                           max_disk_size=EVALUATION_CACHE_DISK_SIZE)
+
         self.solutions = list()
         self.data_pipeline = self._load_pipeline('kfold_pipeline.yml')
         self.scoring_pipeline = self._load_pipeline(DEFAULT_SCORING_PIPELINE_PATH)
         self.fallback = self._load_pipeline(FALLBACK_PIPELINE)
 
-    @staticmethod
-    def _evaluate(out, pipeline, *args, **kwargs):
-        LOGGER.info('Running d3m.runtime.evalute on pipeline %s', pipeline.id)
-        results = d3m_evaluate(pipeline, *args, **kwargs)
-
-        LOGGER.info('Returning results for %s', pipeline.id)
-        out.extend(results)
-
     def subprocess_evaluate(self, pipeline, *args, **kwargs):
+        """Evaluate the pipeline on one of the processes that isolate the crashing primitives.
+
+        The processes are shared by all the searchers and only started when needed, but
+        they are forked with the splits shared at that time, so they are restarted when
+        they get splits shared after them, like the ones of a new search.
+        """
         LOGGER.info('Evaluating pipeline %s in a subprocess', pipeline.id)
-        with Manager() as manager:
-            output = manager.list()
-            process = Process(
-                target=self._evaluate,
-                args=(output, pipeline, *args),
-                kwargs=kwargs
-            )
-            self.subprocess = process
-            process.daemon = True
-            process.start()
+        return SUBPROCESS_POOL.run(evaluate_folds, pipeline, *args, **kwargs)
+
+    def _parallel_evaluate(self, pipeline, scoring_pipeline, problem, splits, metrics,
+                           random_seed=0, volumes_dir=None):
+        """Evaluate the folds at the same time, each one on a separate worker process."""
+        LOGGER.info('Evaluating the folds of pipeline %s in parallel', pipeline.id)
+        with self._lock:
+            if self._fold_pool is None:
+                self._fold_pool = WorkerPool(self.fold_workers, _init_step_cache, (self.fold_workers, ))
+
+            pool = self._fold_pool
+            self._fold_pool_users += 1
+
+        folds = [
+            (pipeline, scoring_pipeline, problem, split, metrics, random_seed, volumes_dir)
+            for split in splits
+        ]
+        try:
+            return pool.map(evaluate_fold, folds)
+
+        finally:
+            with self._lock:
+                self._fold_pool_users -= 1
+
+            self._release_fold_pool()
+
+    def _release_fold_pool(self):
+        """Terminate the fold pool if no search or evaluation is using it.
 
-            LOGGER.info('Joining process %s', process.pid)
-            process.join()
+        It is kept alive between the candidates of a search, and it is shared by the
+        evaluations that run at the same time, like the ones of a ``ScoreSolution``.
+        """
+        with self._lock:
+            pool = self._fold_pool
+            if pool is None or self._fold_pool_users or self._searching:
+                return
+
+            self._fold_pool = None
+
+        pool.terminate()
+
+    def _get_splits(self, dataset, problem, data_params, random_seed):
+        """Get a key and the train, test and score datasets of each fold.
+
+        The splits are computed only once for each dataset, problem, fold
+        configuration and random seed, and then reused by all the candidates.
+
+        The returned splits are in use until they are given to ``_release_splits``.
+        """
+        dataset_metadata = dataset.metadata.query(())
+        key = (
+            dataset_metadata.get('id'),
+            dataset_metadata.get('digest'),
+            problem.get('id'),
+            tuple(sorted(data_params.items())),
+            random_seed,
+        )
+
+        with self._lock:
+            cached = self._splits.get(key)
+            if cached is not None:
+                self._splits.move_to_end(key)
+                cached.users += 1
+                return cached
+
+        LOGGER.info('Splitting dataset %s', dataset_metadata.get('id'))
+        outputs, data_result = prepare_data(
+            self.data_pipeline,
+            problem,
+            [dataset],
+            data_params,
+            context=Context.TESTING,
+            random_seed=random_seed,
+            volumes_dir=self.static,
+        )
+        data_result.check_success()
+
+        splits_key = get_digest(key)
+        splits = [
+            (get_digest([splits_key, fold]), train, test, score)
+            for fold, (train, test, score) in enumerate(zip(*outputs))
+        ]
 
-            LOGGER.info('Terminating process %s', process.pid)
-            process.terminate()
-            self.subprocess = None
+        released = list()
+        with self._lock:
+            # Another thread could have split the same dataset in the meantime
+            cached = self._splits.get(key)
+            if cached is None:
+                cached = _Splits(splits)
+                self._splits[key] = cached
+                released = self._evict_splits(MAX_CACHED_SPLITS)
 
-            result = tuple(output) if output else None
+            cached.users += 1
 
-        if not result:
-            raise Exception("Evaluate crashed")
+        for evicted in released:
+            evicted.unshare()
 
-        return result
+        return cached
+
+    def _evict_splits(self, max_splits):
+        """Forget the least recently used splits. Must be called with the lock held.
+
+        Returns the evicted splits that are not in use, which can stop being shared.
+        """
+        released = list()
+        while len(self._splits) > max_splits:
+            _, evicted = self._splits.popitem(last=False)
+            evicted.evicted = True
+            if not evicted.users:
+                released.append(evicted)
+
+        return released
+
+    def _get_shared_splits(self, cached):
+        """Share the splits with the worker processes, which get references to them
+        instead of a pickled copy of the datasets on every evaluation.
+
+        The workers started before sharing them are restarted to inherit them, and
+        this includes the ones of the ``SUBPROCESS_POOL``.
+        """
+        with self._lock:
+            if cached.shared is None:
+                cached.shared = [share(split) for split in cached.splits]
+
+            return cached.shared
+
+    def _release_splits(self, cached):
+        with self._lock:
+            cached.users -= 1
+            released = cached.evicted and not cached.users
+
+        if released:
+            cached.unshare()
+
+    def clear_splits(self):
+        """Forget the cached splits and stop sharing them once they are not in use."""
+        with self._lock:
+            released = self._evict_splits(0)
+
+        for evicted in released:
+            evicted.unshare()
+
+    def get_splits_size(self):
+        """Approximate the bytes used by the datasets of the cached splits."""
+        with self._lock:
+            cached_splits = list(self._splits.values())
+
+        return sum(get_size(cached.splits) for cached in cached_splits)
+
+    def close(self):
+        """Release the splits and the fold pool once nothing is using them."""
+        self.clear_splits()
+        self._release_fold_pool()
+
+    @staticmethod
+    def _get_evaluation_key(dataset, problem, pipeline_structure, metrics, data_params, random_seed):
+        """Build a key that identifies the scores of a pipeline regardless of its id.
+
+        The versions of d3m and of the primitives are part of it, since the scores kept
+        on disk may come from an older installation.
+        """
+        dataset_metadata = dataset.metadata.query(())
+        return get_digest([
+            d3m.__version__,
+            [step.get('primitive', dict()).get('version') for step in pipeline_structure['steps']],
+            dataset_metadata.get('id'),
+            dataset_metadata.get('digest'),
+            problem.get('id'),
+            problem.get('inputs'),
+            metrics,
+            data_params,
+            random_seed,
+            pipeline_structure['steps'],
+            pipeline_structure.get('inputs'),
+            pipeline_structure.get('outputs'),
+        ])
+
+    def _evaluate_cached(self, evaluate, pipeline, problem, splits, fold_indexes, evaluation_key,
+                         metrics, random_seed):
+        """Evaluate the given folds, reusing the scores of the ones evaluated before.
+
+        Returns the scores and the seconds that the reused ones took to be evaluated.
+        """
+        keys = [(evaluation_key, fold) for fold in fold_indexes]
+        cached = [
+            self.evaluation_cache.get(key) if self.evaluation_cache is not None else None
+            for key in keys
+        ]
+        scores = [entry[0] if entry is not None else None for entry in cached]
+        reused_elapsed = sum(entry[1] for entry in cached if entry is not None)
+        missing = [index for index, score in enumerate(scores) if score is None]
+        if len(missing) < len(scores):
+            LOGGER.info('Reusing the scores of %s folds of pipeline %s',
+                        len(scores) - len(missing), pipeline.id)
+
+        if missing:
+            start = datetime.now()
+            new_scores = evaluate(
+                pipeline,
+                self.scoring_pipeline,
+                problem,
+                [splits[fold_indexes[index]] for index in missing],
+                metrics,
+                random_seed=random_seed,
+                volumes_dir=self.static,
+            )
+            # The folds may be evaluated at the same time, so they share the time taken
+            elapsed = (datetime.now() - start).total_seconds() / len(missing)
+            for index, score in zip(missing, new_scores):
+                scores[index] = score
+                if self.evaluation_cache is not None:
+                    self.evaluation_cache.set(keys[index], (score, elapsed))
+
+        return scores, reused_elapsed
 
     def score_pipeline(self, dataset, problem, pipeline, metrics=None, random_seed=0,
-                       folds=5, stratified=False, shuffle=False):
+                       folds=5, stratified=False, shuffle=False, max_folds=None,
+                       abort_below=None):
+        """Cross validate the pipeline and store its scores in it.
+
+        If ``max_folds`` is given, only that many folds are scored and the pipeline is
+        left ``partial``. Scoring a partial pipeline again continues from the next fold.
 
+        If ``abort_below`` is given, the remaining folds are not scored as soon as the
+        normalized mean of the folds scored so far falls below it, also leaving the
+        pipeline ``partial``.
+        """
         problem_metrics = problem['problem']['performance_metrics']
         metrics = metrics or problem_metrics
         data_params = {
@@ -366,45 +917,91 @@ class PipelineSearcher:
             'stratified': json.dumps(stratified),
             'shuffle': json.dumps(shuffle),
         }
+        cached_splits = self._get_splits(dataset, problem, data_params, random_seed)
+        try:
+            self._score_folds(dataset, problem, pipeline, metrics, data_params, random_seed,
+                              cached_splits, max_folds, abort_below)
+
+        finally:
+            self._release_splits(cached_splits)
+
+    def _score_folds(self, dataset, problem, pipeline, metrics, data_params, random_seed,
+                     cached_splits, max_folds, abort_below):
+        splits = cached_splits.splits
 
         # Some primitives crash with a core dump that kills everything.
-        # We want to isolate those.
+        # We want to isolate those, unless we are already isolated.
+        pipeline_structure = pipeline.to_json_structure()
         primitives = [
             step['primitive']['python_path']
-            for step in pipeline.to_json_structure()['steps']
+            for step in pipeline_structure['steps']
         ]
-        if any(primitive in SUBPROCESS_PRIMITIVES for primitive in primitives):
+        isolate = any(primitive in SUBPROCESS_PRIMITIVES for primitive in primitives)
+        if self.fold_workers > 1 and not self.isolated:
+            # The fold workers are isolated processes too
+            evaluate = self._parallel_evaluate
+            splits = self._get_shared_splits(cached_splits)
+        elif isolate and not self.isolated:
             evaluate = self.subprocess_evaluate
+            splits = self._get_shared_splits(cached_splits)
         else:
-            evaluate = d3m_evaluate
+            evaluate = evaluate_folds
 
-        all_scores, all_results = evaluate(
-            pipeline,
-            self.data_pipeline,
-            self.scoring_pipeline,
-            problem,
-            [dataset],
-            data_params,
-            metrics,
-            context=Context.TESTING,
-            random_seed=random_seed,
-            data_random_seed=random_seed,
-            scoring_random_seed=random_seed,
-            volumes_dir=self.static,
-        )
+        start = datetime.now()
+        total_folds = len(splits)
+        scored_folds = len(pipeline.cv_scores) if getattr(pipeline, 'partial', False) else 0
+        fold_indexes = list(range(total_folds))[scored_folds:max_folds]
+        previous_scores = pipeline.cv_scores if scored_folds else list()
+        previous_elapsed = pipeline.elapsed if scored_folds else 0
 
-        if not all_scores:
-            failed_result = all_results[-1]
-            message = failed_result.pipeline_run.status['message']
-            LOGGER.error(message)
-            cause = failed_result.error.__cause__
-            if isinstance(cause, BaseException):
-                raise cause
-            else:
-                raise Exception(cause)
+        evaluation_key = self._get_evaluation_key(
+            dataset, problem, pipeline_structure, metrics, data_params, random_seed)
 
-        pipeline.cv_scores = [score.value[0] for score in all_scores]
+        if abort_below is None:
+            chunks = [fold_indexes]
+        else:
+            # Check the score after as many folds as can be scored at the same time
+            chunk_size = self.fold_workers if evaluate == self._parallel_evaluate else 1
+            chunks = [
+                fold_indexes[index:index + chunk_size]
+                for index in range(0, len(fold_indexes), chunk_size)
+            ]
+
+        all_scores = list()
+        reused_elapsed = 0
+        pipeline.aborted = False
+        for chunk in chunks:
+            scores, elapsed = self._evaluate_cached(
+                evaluate, pipeline, problem, splits, chunk, evaluation_key, metrics, random_seed)
+            all_scores.extend(scores)
+            reused_elapsed += elapsed
+
+            if abort_below is not None and chunk is not chunks[-1]:
+                cv_scores = previous_scores + [score.value[0] for score in all_scores]
+                if metrics[0]['metric'].normalize(np.mean(cv_scores)) < abort_below:
+                    LOGGER.info('Aborting pipeline %s after %s folds', pipeline.id, len(cv_scores))
+                    pipeline.aborted = True
+                    break
+
+        # One list of fold scores for each metric, in the same order
+        cv_metric_scores = [
+            list(fold_scores)
+            for fold_scores in zip(*(score.value for score in all_scores))
+        ]
+        if scored_folds:
+            cv_metric_scores = [
+                previous + new
+                for previous, new in zip(pipeline.cv_metric_scores, cv_metric_scores)
+            ]
+
+        pipeline.cv_metric_scores = cv_metric_scores
+        pipeline.cv_scores = pipeline.cv_metric_scores[0]
         pipeline.score = np.mean(pipeline.cv_scores)
+        pipeline.partial = len(pipeline.cv_scores) < total_folds
+        # The reused folds count as long as they took the first time, so the time of
+        # the pipelines found in the cache can still be compared with the rest.
+        elapsed = (datetime.now() - start).total_seconds() + reused_elapsed
+        pipeline.elapsed = previous_elapsed + elapsed
 
     def _save_pipeline(self, pipeline):
         pipeline_dict = pipeline.to_json_structure()
@@ -421,7 +1018,9 @@ class PipelineSearcher:
             pipeline_dict['rank'] = rank
             pipeline_dict['score'] = pipeline.score
             pipeline_dict['normalized_score'] = pipeline.normalized_score
-            self.solutions.append(pipeline_dict)
+            with self.updated:
+                self.solutions.append(pipeline_dict)
+                self.updated.notify_all()
 
     @staticmethod
     def _new_pipeline(pipeline, hyperparams=None):
@@ -469,6 +1068,9 @@ class PipelineSearcher:
         new_pipeline.cv_scores = list()
         new_pipeline.score = None
 
+        # The steps before the first tuned one are the same for all the candidates
+        new_pipeline.prefix_steps = min(int(step) for step in hyperparams) if hyperparams else 0
+
         return new_pipeline
 
     def check_stop(self):
@@ -479,18 +1081,15 @@ class PipelineSearcher:
 
     def stop(self):
         self._stop = True
-        # if self.subprocess:
-        #     LOGGER.info('Terminating subprocess: %s', self.subprocess.pid)
-        #     self.subprocess.terminate()
-        #     self.subprocess = None
 
     def _timeout(self, *args, **kwargs):
         raise KeyboardInterrupt()
 
     def setup_search(self):
         self.solutions = list()
-        self._stop = False
         self.done = False
+        self._rung_scores = defaultdict(list)
+        self._best_normalized = 0
 
         self.start_time = datetime.now()
         self.max_end_time = None
@@ -505,11 +1104,15 @@ class PipelineSearcher:
                     self.timeout, self.hard_timeout, self.max_end_time)
 
     def get_data_augmentation(self, dataset, problem):
-        datamart = RESTDatamart(DATAMART_URL)
         data_augmentation = problem.get('data_augmentation')
         if data_augmentation:
+            # The DataMart clients are only imported by the searches that use them
+            from datamart import DatamartQuery
+            from datamart_rest import RESTDatamart
+
             LOGGER.info("DATA AUGMENTATION: Querying DataMart")
             try:
+                datamart = RESTDatamart(DATAMART_URL)
                 keywords = data_augmentation[0]['keywords']
                 query = DatamartQuery(keywords=keywords)
                 cursor = datamart.search_with_data(query=query, supplied_data=dataset)
@@ -528,6 +1131,148 @@ class PipelineSearcher:
         #     with open(os.path.join(BASE_DIR, 'da.json')) as f:
         #         return json.dumps(json.load(f))
 
+    def _log_proposal(self, iteration, template_name, pipeline, proposal):
+        params = '\n'.join('{}: {}'.format(k, v) for k, v in proposal.items())
+        LOGGER.warn("Scoring pipeline %s - %s: %s\n%s",
+                    iteration + 1, template_name, pipeline.id, params)
+
+    def _get_history(self, meta_features):
+        try:
+            return self.history.get_nearest(meta_features)
+        except Exception:
+            LOGGER.exception("Error loading the search history")
+            return list()
+
+    def _add_to_history(self, dataset_name, meta_features, template_name, proposal, pipeline):
+        try:
+            self.history.add(dataset_name, meta_features, template_name, proposal,
+                             pipeline.normalized_score, pipeline.elapsed)
+        except Exception:
+            LOGGER.exception("Error adding pipeline %s to the search history", pipeline.id)
+
+    def _get_rungs(self, folds=5):
+        """Get the number of folds scored at each rung of the successive halving.
+
+        The last rung, which scores all the folds, is None.
+        """
+        rungs = list()
+        if self.halving:
+            rung_folds = 1
+            while rung_folds < folds:
+                rungs.append(rung_folds)
+                rung_folds *= self.halving
+
+        rungs.append(None)
+        return rungs
+
+    def _promote(self, rung, pipeline, metric):
+        """Decide whether a partially scored pipeline goes on to the next rung.
+
+        Like in the asynchronous successive halving, it is promoted if its score is among
+        the best ``1 / halving`` of all the scores that reached the same rung.
+        """
+        normalized_score = metric.normalize(pipeline.score)
+        rung_scores = self._rung_scores[rung]
+        rung_scores.append(normalized_score)
+
+        promoted = len(rung_scores) // self.halving
+        return promoted > 0 and normalized_score >= sorted(rung_scores, reverse=True)[promoted - 1]
+
+    def _get_abort_below(self, defaults):
+        """Get the normalized score below which a proposal stops being scored.
+
+        Only when ``abort_margin`` is given, and never for the template defaults.
+        """
+        if self.abort_margin is None or defaults:
+            return None
+
+        return self._best_normalized - self.abort_margin
+
+    def _add_rung_scores(self, pipeline, rungs, metric):
+        """Record the scores that a completely scored pipeline had on each rung."""
+        for rung, folds in enumerate(rungs[:-1]):
+            self._rung_scores[rung].append(metric.normalize(np.mean(pipeline.cv_scores[:folds])))
+
+    def _score_proposals(self, dataset, problem, selector_tuner, iterator, metric=None):
+        rungs = self._get_rungs()
+        for iteration in iterator:
+            self.check_stop()
+            template_name, template, proposal, defaults = selector_tuner.propose()
+            pipeline = self._new_pipeline(template, proposal)
+            self._log_proposal(iteration, template_name, pipeline, proposal)
+
+            error = None
+            try:
+                # The defaults are always scored on all the folds
+                rung = len(rungs) - 1 if defaults else 0
+                abort_below = self._get_abort_below(defaults)
+                self.score_pipeline(dataset, problem, pipeline, max_folds=rungs[rung],
+                                    abort_below=abort_below)
+                while pipeline.partial and not pipeline.aborted and self._promote(rung, pipeline, metric):
+                    rung += 1
+                    self.score_pipeline(dataset, problem, pipeline, max_folds=rungs[rung],
+                                        abort_below=abort_below)
+
+                if defaults:
+                    self._add_rung_scores(pipeline, rungs, metric)
+
+            except Exception as ex:
+                error = ex
+
+            yield template_name, pipeline, proposal, defaults, error
+
+    def _parallel_score_proposals(self, pool, selector_tuner, iterator, metric=None):
+        """Keep up to ``n_workers`` proposals being scored at the same time.
+
+        The results are yielded in the order in which they finish. The pipelines
+        promoted by the successive halving are sent back to the workers until they
+        are discarded or completely scored.
+        """
+        rungs = self._get_rungs()
+        iterator = iter(iterator)
+        pending = dict()
+        while True:
+            self.check_stop()
+
+            iterations = list(itertools.islice(iterator, self.n_workers - len(pending)))
+            proposals = selector_tuner.propose_batch(len(iterations)) if iterations else []
+            for iteration, (template_name, template, proposal, defaults) in zip(iterations, proposals):
+                pipeline = self._new_pipeline(template, proposal)
+                self._log_proposal(iteration, template_name, pipeline, proposal)
+
+                # The defaults are always scored on all the folds
+                rung = len(rungs) - 1 if defaults else 0
+                abort_below = self._get_abort_below(defaults)
+                task = pool.submit(_score_in_worker, pipeline, rungs[rung], abort_below)
+                pending[task] = template_name, pipeline, proposal, defaults, rung
+
+            if not pending:
+                break
+
+            # Wake up every second to check whether we need to stop
+            for task in pool.wait(list(pending), timeout=1):
+                template_name, pipeline, proposal, defaults, rung = pending.pop(task)
+
+                error = None
+                try:
+                    for name, value in task.get().items():
+                        setattr(pipeline, name, value)
+
+                    promote = pipeline.partial and not pipeline.aborted
+                    if promote and self._promote(rung, pipeline, metric):
+                        abort_below = self._get_abort_below(defaults)
+                        task = pool.submit(_score_in_worker, pipeline, rungs[rung + 1], abort_below)
+                        pending[task] = template_name, pipeline, proposal, defaults, rung + 1
+                        continue
+
+                    if defaults:
+                        self._add_rung_scores(pipeline, rungs, metric)
+
+                except Exception as ex:
+                    error = ex
+
+                yield template_name, pipeline, proposal, defaults, error
+
     def search(self, problem, timeout=None, budget=None, template_names=None):
 
         self.timeout = timeout
@@ -535,20 +1280,25 @@ class PipelineSearcher:
         best_score = None
         best_normalized = 0
         best_template_name = None
+        selector_tuner = None
         template_names = template_names or list()
         data_modality = None
         task_type = None
         task_subtype = None
         iteration = 0
         errors = list()
+        pool = None
 
         dataset_name, dataset_path = self._get_dataset_details(problem)
-        dataset = Dataset.load(dataset_path)
+        dataset = load_dataset(dataset_path)
         metric = problem['problem']['performance_metrics'][0]['metric']
 
         data_modality = detect_data_modality(dataset_path[7:])
         task_type = problem['problem']['task_type'].name.lower()
         task_subtype = problem['problem']['task_subtype'].name.lower()
+        targets = problem['inputs'][0].get('targets')
+        meta_features = get_meta_features(dataset, data_modality, task_type, targets)
+        LOGGER.info("Dataset meta-features: %s", meta_features)
 
         data_augmentation = self.get_data_augmentation(dataset, problem)
 
@@ -556,8 +1306,12 @@ class PipelineSearcher:
                     dataset_name, data_modality, task_type, task_subtype)
 
         try:
+            self._searching = True
             self.setup_search()
 
+            # Stopped before it started, while it was queued
+            self.check_stop()
+
             self.score_pipeline(dataset, problem, self.fallback)
             self.fallback.normalized_score = metric.normalize(self.fallback.score)
             self._save_pipeline(self.fallback)
@@ -565,31 +1319,37 @@ class PipelineSearcher:
             best_score = self.fallback.score
             best_template_name = FALLBACK_PIPELINE
             best_normalized = self.fallback.normalized_score
+            self._best_normalized = best_normalized
 
             LOGGER.info("Fallback pipeline score: %s - %s",
                         self.fallback.score, self.fallback.normalized_score)
 
             LOGGER.info("Loading the template and the tuner")
             if not template_names:
-                template_names = self._get_templates(data_modality, task_type)
+                template_names = self._get_templates(data_modality, task_type, meta_features)
 
             if budget is not None:
                 iterator = range(budget)
             else:
                 iterator = itertools.count()   # infinite range
 
-            selector_tuner = SelectorTuner(template_names, data_augmentation)
+            history = self._get_history(meta_features)
+            selector_tuner = SelectorTuner(template_names, data_augmentation, self.tuner, history)
 
-            for iteration in iterator:
-                self.check_stop()
-                template_name, template, proposal, defaults = selector_tuner.propose()
-                pipeline = self._new_pipeline(template, proposal)
+            if self.n_workers > 1:
+                # The workers inherit the splits computed while scoring the fallback
+                LOGGER.info("Scoring pipelines using %s workers", self.n_workers)
+                pool = WorkerPool(self.n_workers, _init_search_worker, (self, dataset, problem))
+                scored = self._parallel_score_proposals(pool, selector_tuner, iterator, metric)
+            else:
+                scored = self._score_proposals(dataset, problem, selector_tuner, iterator, metric)
 
-                params = '\n'.join('{}: {}'.format(k, v) for k, v in proposal.items())
-                LOGGER.warn("Scoring pipeline %s - %s: %s\n%s",
-                            iteration + 1, template_name, pipeline.id, params)
+            for iteration, result in enumerate(scored):
+                template_name, pipeline, proposal, defaults, error = result
                 try:
-                    self.score_pipeline(dataset, problem, pipeline)
+                    if error is not None:
+                        raise error
+
                     pipeline.normalized_score = metric.normalize(pipeline.score)
                     # raise Exception("This won't work")
                 except Exception as ex:
@@ -606,12 +1366,28 @@ class PipelineSearcher:
                     pipeline.score = None
                     pipeline.normalized_score = 0.0
 
+                if pipeline.score is not None and pipeline.partial:
+                    # Discarded by the successive halving or aborted, so it is not
+                    # a solution, but the tuner still learns from its partial score.
+                    LOGGER.info("Pipeline %s discarded after %s folds: %s - %s",
+                                pipeline.id, len(pipeline.cv_scores),
+                                pipeline.score, pipeline.normalized_score)
+                    dump_pipeline(pipeline.to_json_structure(), self.searched_dir)
+                    selector_tuner.add(template_name, proposal, pipeline.normalized_score,
+                                       getattr(pipeline, 'elapsed', None))
+                    continue
+
                 try:
                     self._save_pipeline(pipeline)
                 except Exception:
                     LOGGER.exception("Error saving pipeline %s", pipeline.id)
 
-                selector_tuner.add(template_name, proposal, pipeline.normalized_score)
+                selector_tuner.add(template_name, proposal, pipeline.normalized_score,
+                                   getattr(pipeline, 'elapsed', None))
+                if pipeline.score is not None:
+                    self._add_to_history(dataset_name, meta_features, template_name,
+                                         proposal, pipeline)
+
                 LOGGER.info("Pipeline %s score: %s - %s",
                             pipeline.id, pipeline.score, pipeline.normalized_score)
 
@@ -622,6 +1398,7 @@ class PipelineSearcher:
                     best_score = pipeline.score
                     best_normalized = pipeline.normalized_score
                     best_template_name = template_name
+                    self._best_normalized = best_normalized
 
         except KeyboardInterrupt:
             pass
@@ -632,6 +1409,15 @@ class PipelineSearcher:
             if self.timeout and self.hard_timeout:
                 signal.alarm(0)
 
+            if pool is not None:
+                pool.terminate()
+
+            # Released now, or as soon as the running ScoreSolutions finish
+            with self._lock:
+                self._searching = False
+
+            self.close()
+
         self.done = True
         iterations = iteration - len(template_names) + 1
         if iterations <= 0:
@@ -645,5 +1431,6 @@ class PipelineSearcher:
             'task_type': task_type,
             'task_subtype': task_subtype,
             'tuning_iterations': iterations,
-            'error': errors or None
+            'error': errors or None,
+            'template_timings': dict(selector_tuner.elapsed) if selector_tuner else None,
         }
@@ -6,10 +6,9 @@ import threading
 import time
 import uuid
 from collections import defaultdict
-from datetime import datetime
+from datetime import datetime, timedelta
 from urllib.parse import urlparse
 
-from d3m.container.dataset import Dataset
 from d3m.metadata.base import Context
 from d3m.metadata.pipeline import Pipeline
 from d3m.metadata.problem import Problem
@@ -18,7 +17,9 @@ from google.protobuf.timestamp_pb2 import Timestamp
 from ta3ta2_api import core_pb2, core_pb2_grpc, pipeline_pb2, primitive_pb2, problem_pb2, value_pb2
 from ta3ta2_api.utils import decode_performance_metric, decode_problem_description, encode_score
 
-from ta2.search import PipelineSearcher
+from ta2.cache import DATASET_CACHE, SpillCache, load_dataset
+from ta2.ta3.scheduler import SessionScheduler
+from ta2.search import STEP_CACHE, PipelineSearcher
 from ta2.utils import dump_pipeline
 
 
@@ -40,6 +41,22 @@ LOGGER = logging.getLogger(__name__)
 
 VERSION = core_pb2.DESCRIPTOR.GetOptions().Extensions[core_pb2.protocol_version]
 
+# Seconds that the results of the ended score, fit and produce sessions are kept
+SESSION_TTL = int(os.getenv('TA2_SESSION_TTL', 60 * 60))
+
+# Seconds between the sweeps that remove the expired sessions
+SWEEP_INTERVAL = int(os.getenv('TA2_SWEEP_INTERVAL', 60))
+
+
+def _snapshot(entries):
+    """Copy the items of a dict of the DB, which other threads may be changing."""
+    while True:
+        try:
+            return list(entries.items())
+        except RuntimeError:
+            # Changed size while being copied
+            continue
+
 
 """
 CORE SHARED OBJECTS
@@ -669,7 +686,8 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
 
     DB = recursivedict()
 
-    def __init__(self, input_dir, output_dir, static_dir, timeout, debug=False):
+    def __init__(self, input_dir, output_dir, static_dir, timeout, debug=False,
+                 workers=1, fold_workers=1, halving=None, abort_margin=None, tuner='gp'):
 
         super(CoreServicer, self).__init__()
 
@@ -679,6 +697,21 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
         self.ranked_dir = os.path.join(self.output_dir, 'pipelines_ranked')
         self.timeout = timeout
         self.debug = debug
+        self.workers = workers
+        self.fold_workers = fold_workers
+        self.halving = halving
+        self.abort_margin = abort_margin
+        self.tuner = tuner
+
+        # The score, fit and produce sessions are reserved some of the slots,
+        # so they do not wait for the searches to finish
+        self.scheduler = SessionScheduler()
+
+        # Fitted runtimes, spilled to disk when they do not fit in memory
+        self.fitted_solutions = SpillCache(os.path.join(self.output_dir, 'fitted_solutions'))
+
+        self._sweeper = None
+        self._sweeper_lock = threading.Lock()
 
     def _build_problem(self, problem_description):
         # TODO: it might be removed, it's not being used.
@@ -730,6 +763,7 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
 
     def _run_session(self, session, method, *args, **kwargs):
         exception = None
+        session['queued'] = False
         try:
             method(*args, **kwargs)
 
@@ -739,19 +773,32 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
 
         finally:
             LOGGER.info('Ending %s session %s', session['type'], session['id'])
-            session['end'] = datetime.utcnow()
-            session['done'] = True
-            if exception is not None:
-                session['error'] = '{}: {}'.format(exception.__class__.__name__, exception)
+            updated = self._get_condition(session)
+            with updated:
+                session['end'] = datetime.utcnow()
+                session['done'] = True
+                if exception is not None:
+                    session['error'] = '{}: {}'.format(exception.__class__.__name__, exception)
+
+                updated.notify_all()
+
+    @staticmethod
+    def _get_condition(session):
+        """Get the condition notified when the session has something new for the streams."""
+        return session.setdefault('updated', threading.Condition())
 
-    def _start_session(self, session_id, session_type, method, *args, **kwargs):
+    def _start_session(self, session_id, session_type, method, *args, priority=0, **kwargs):
         session = {
             'id': session_id,
             'type': session_type,
-            'start': datetime.utcnow()
+            'start': datetime.utcnow(),
+            'queued': not self.debug,
         }
         session.update(kwargs)
+        self._get_condition(session)
 
+        self._collect_sessions()
+        self._start_sweeper()
         self.DB[session_type + '_sessions'][session_id] = session
 
         args = [session, method] + list(args)
@@ -763,7 +810,99 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
             self._run_session(*args)
 
         else:
-            threading.Thread(target=self._run_session, args=args).start()
+            reserved = session_type != 'search'
+            session['ticket'] = self.scheduler.submit(self._run_session, args, priority, reserved)
+
+    def _cancel_search_session(self, session):
+        """Remove the search session from the queue if it has not started yet."""
+        ticket = session.get('ticket')
+        if ticket is None or not self.scheduler.cancel(ticket):
+            return
+
+        LOGGER.info('Cancelling queued search session %s', session['id'])
+        updated = self._get_condition(session)
+        with updated:
+            session['queued'] = False
+            session['end'] = datetime.utcnow()
+            session['done'] = True
+            updated.notify_all()
+
+    def _end_search_session(self, session):
+        """Stop the search and release its solutions, splits and fitted runtimes.
+
+        Returns the ids of the solutions, whose sessions are not needed anymore.
+        """
+        searcher = session['searcher']
+        searcher.stop()
+        self._cancel_search_session(session)
+
+        solution_ids = [solution['id'] for solution in searcher.solutions]
+        for solution_id in solution_ids:
+            self.DB['solutions'].pop(solution_id, None)
+            self.fitted_solutions.delete(solution_id)
+
+        searcher.close()
+        return solution_ids
+
+    def _collect_sessions(self, solution_ids=()):
+        """Remove the sessions that are not needed anymore.
+
+        These are the score, fit and produce sessions that ended more than ``SESSION_TTL``
+        seconds ago or whose solutions were ended, and the empty entries left by invalid
+        request ids. The search sessions, their solutions and the fitted runtimes are kept
+        until ``EndSearchSolutions``, since the solutions must stay valid until then.
+        """
+        expiration = datetime.utcnow() - timedelta(seconds=SESSION_TTL)
+        solution_ids = set(solution_ids)
+
+        for session_type in ('score', 'fit', 'produce'):
+            sessions = self.DB.get(session_type + '_sessions', dict())
+            for session_id, session in _snapshot(sessions):
+                done = session.get('done')
+                expired = done and session.get('end', expiration) <= expiration
+                ended = done and session_id in solution_ids
+                if not session or expired or ended:
+                    LOGGER.debug('Removing %s session %s', session_type, session_id)
+                    sessions.pop(session_id, None)
+
+    def _start_sweeper(self):
+        """Start removing the expired sessions periodically, and not only when new ones start."""
+        with self._sweeper_lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep, daemon=True)
+                self._sweeper.start()
+
+    def _sweep(self):
+        while True:
+            time.sleep(SWEEP_INTERVAL)
+            try:
+                self._collect_sessions()
+                LOGGER.info('Memory usage: %s', self.get_memory_usage())
+            except Exception:
+                LOGGER.exception('Error removing the expired sessions')
+
+    def get_memory_usage(self):
+        """Approximate the bytes used by the splits of the searches and by the caches.
+
+        The splits hold the train, test and score datasets of each fold, and they are
+        measured by the data of their tables. The rest of the DB only holds references
+        to the cached datasets and small descriptions of the pipelines and sessions.
+        """
+        search_sessions = self.DB.get('search_sessions', dict())
+        searchers = [
+            session.get('searcher')
+            for _, session in _snapshot(search_sessions)
+        ]
+        return {
+            'search_splits': sum(
+                searcher.get_splits_size()
+                for searcher in searchers
+                if searcher is not None
+            ),
+            'fitted_solutions_cache': self.fitted_solutions.size,
+            'dataset_cache': DATASET_CACHE.size,
+            'step_cache': STEP_CACHE.size,
+        }
 
     def SearchSolutions(self, request, context):
         LOGGER.info("\n######## SearchSolutions ########\n%s########", request)
@@ -831,7 +970,6 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
 
         # Ignored:
         # user_agent = request.user_agent
-        # priority = request.priority
         # template = request.template
 
         # Validate input
@@ -848,7 +986,16 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
 
         problem = decode_problem_description(problem_description)
 
-        searcher = PipelineSearcher(self.input_dir, self.output_dir, self.static_dir)
+        searcher = PipelineSearcher(
+            self.input_dir,
+            self.output_dir,
+            self.static_dir,
+            n_workers=self.workers,
+            fold_workers=self.fold_workers,
+            halving=self.halving,
+            abort_margin=self.abort_margin,
+            tuner=self.tuner
+        )
 
         self._start_session(
             search_id,
@@ -858,7 +1005,9 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
             timeout,
             searcher=searcher,
             problem=problem,
-            allowed_value_types=allowed_value_types
+            allowed_value_types=allowed_value_types,
+            updated=searcher.updated,
+            priority=request.priority
         )
 
         return core_pb2.SearchSolutionsResponse(
@@ -871,6 +1020,8 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
             state = 'ERRORED'
         elif session.get('done'):
             state = 'COMPLETED'
+        elif session.get('queued'):
+            state = 'PENDING'
         else:
             state = 'RUNNING'
 
@@ -882,11 +1033,16 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
         )
 
     def _stream(self, session, get_next, close_on_done=False):
+        updated = self._get_condition(session)
         returned = 0
         stop = False
         while not stop:
-            done = session.get('done')
-            response = get_next(session, returned)
+            with updated:
+                done = session.get('done')
+                response = get_next(session, returned)
+                if not (done or response):
+                    # Sleep until the session publishes something new
+                    updated.wait()
 
             if done and (close_on_done or not response):
                 LOGGER.info("Closing stream")
@@ -896,9 +1052,6 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
                 returned += 1
                 yield response
 
-            else:
-                time.sleep(1)
-
     def _get_search_soltuion_results(self, session, returned):
         solutions = session['searcher'].solutions
 
@@ -1035,12 +1188,9 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
         session = self.DB['search_sessions'].pop(search_id, dict())
 
         if session:
-            searcher = session['searcher']
-            searcher.stop()
-
-            # cleanup pipelines
-            for solution in searcher.solutions:
-                self.DB['solutions'].pop(solution['id'], None)
+            # cleanup pipelines and the sessions that used them
+            solution_ids = self._end_search_session(session)
+            self._collect_sessions(solution_ids)
 
             # while not searcher.done:
             #     time.sleep(1)
@@ -1069,6 +1219,7 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
         if session:
             searcher = session['searcher']
             searcher.stop()
+            self._cancel_search_session(session)
 
             # while not searcher.done:
             #     time.sleep(1)
@@ -1185,13 +1336,11 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
         else:
             raise ValueError(method)
 
-    def _score_solution(self, searcher, dataset, problem, metric_pipelines, configuration):
+    def _score_solution(self, searcher, dataset, problem, pipeline, metrics, configuration):
         cv_args = self._get_cv_args(configuration)
 
-        for metric, pipeline in metric_pipelines:
-            metric = decode_performance_metric(metric)
-
-            searcher.score_pipeline(dataset, problem, pipeline, [metric], **cv_args)
+        # All the metrics are computed on the predictions of a single cross validation
+        searcher.score_pipeline(dataset, problem, pipeline, metrics, **cv_args)
 
     def ScoreSolution(self, request, context):
         LOGGER.info("\n######## ScoreSolution ########\n%s########", request)
@@ -1223,18 +1372,16 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
         # Still Ignored
         # users = request.users
 
-        metric_pipelines = []
-        for metric in performance_metrics:
-            pipeline, _ = self._get_pipeline(solution_id)
-            metric_pipelines.append((metric, pipeline))
-
         pipeline, session = self._get_pipeline(solution_id)
 
-        dataset = Dataset.load(inputs[0].dataset_uri)
+        dataset = load_dataset(inputs[0].dataset_uri)
         problem = session['problem']
         searcher = session['searcher']
         allowed_value_types = session['allowed_value_types']
 
+        metrics = [decode_performance_metric(metric) for metric in performance_metrics]
+        metrics = metrics or problem['problem']['performance_metrics']
+
         self._start_session(
             pipeline.id,
             'score',
@@ -1242,9 +1389,11 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
             searcher,
             dataset,
             problem,
-            metric_pipelines,
+            pipeline,
+            metrics,
             configuration,
-            metric_pipelines=metric_pipelines,
+            pipeline=pipeline,
+            metrics=metrics,
             problem=problem,
             allowed_value_types=allowed_value_types,
             configuration=configuration
@@ -1261,12 +1410,12 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
         targets = problem['inputs'][0]['targets']
         dataset_id = problem['inputs'][0]['dataset_id']
 
-        metric_pipelines = session['metric_pipelines']
+        pipeline = session['pipeline']
         metric_fold_scores = []
-        for metric, pipeline in metric_pipelines:
-            for fold, score in enumerate(pipeline.cv_scores):
+        for metric, cv_scores in zip(session['metrics'], pipeline.cv_metric_scores):
+            for fold, score in enumerate(cv_scores):
                 metric_fold_scores.append({
-                    'metric': problem['problem']['performance_metrics'][0],
+                    'metric': metric,
                     'fold': fold,
                     'value': score,
                     'targets': targets,
@@ -1322,6 +1471,7 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
             session = solution.pop('session')
             pipeline = Pipeline.from_json_structure(solution)
             pipeline.cv_scores = list()
+            pipeline.cv_metric_scores = list()
             pipeline.score = solution.get('score')
             pipeline.normalized_score = solution.get('normalized_score')
             solution['session'] = session
@@ -1344,7 +1494,7 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
             csv_path = urlparse(exposed_details.csv_uri).path
             fit_results.values[exposed_name].to_csv(csv_path, index=None)
 
-        self.DB['fitted_solutions'][pipeline.id] = runtime
+        self.fitted_solutions.set(pipeline.id, runtime)
 
     def FitSolution(self, request, context):
         LOGGER.info("\n######## FitSolution ########\n%s########", request)
@@ -1386,7 +1536,7 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
 
         pipeline, session = self._get_pipeline(solution_id)
 
-        dataset = Dataset.load(inputs[0].dataset_uri)
+        dataset = load_dataset(inputs[0].dataset_uri)
         exposed_outputs = self._get_exposed_outputs(pipeline, request)
 
         problem = session['problem']
@@ -1520,10 +1670,9 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
         return solution
 
     def _get_fitted_solution(self, solution_id):
-        fitted_solutions = self.DB['fitted_solutions']
-        runtime = fitted_solutions.get(solution_id)
+        runtime = self.fitted_solutions.get(solution_id)
         if not runtime:
-            LOGGER.error(list(fitted_solutions.keys()))
+            LOGGER.error('Fitted solution %s not found', solution_id)
             raise ValueError('Invalid fitted_solution_id')
 
         return runtime
@@ -1574,7 +1723,7 @@ class CoreServicer(core_pb2_grpc.CoreServicer):
         # users = request.users
 
         runtime = self._get_fitted_solution(fitted_solution_id)
-        dataset = Dataset.load(inputs[0].dataset_uri)
+        dataset = load_dataset(inputs[0].dataset_uri)
 
         produce_id = str(uuid.uuid4())
         exposed_outputs = self._get_exposed_outputs(runtime.pipeline, request, produce_id, True)
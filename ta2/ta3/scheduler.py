@@ -0,0 +1,120 @@
+import heapq
+import itertools
+import os
+import re
+import threading
+
+SESSION_RAM = os.getenv('TA2_SESSION_RAM', '2Gi')
+
+# Slots that only the reserved sessions, like the score, fit and produce ones, can use
+RESERVED_SESSIONS = int(os.getenv('TA2_RESERVED_SESSIONS', 1))
+
+_UNITS = {
+    '': 1024 ** 3,      # plain numbers are GB, like in D3MRAM
+    'k': 1000, 'ki': 1024,
+    'm': 1000 ** 2, 'mi': 1024 ** 2,
+    'g': 1000 ** 3, 'gi': 1024 ** 3,
+    't': 1000 ** 4, 'ti': 1024 ** 4,
+}
+
+
+def parse_memory(value):
+    """Convert a memory amount like ``16``, ``16Gi`` or ``512MB`` to bytes."""
+    match = re.match(r'^\s*([\d.]+)\s*([kmgt]i?)?b?\s*$', str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError('Invalid memory amount: {}'.format(value))
+
+    number, unit = match.groups()
+    return int(float(number) * _UNITS[(unit or '').lower()])
+
+
+def get_max_running():
+    """Get how many sessions can run at the same time.
+
+    ``TA2_MAX_SESSIONS`` sets it explicitly. Otherwise it is the number of
+    CPUs given in ``D3MCPU``, limited by how many sessions of ``TA2_SESSION_RAM``
+    fit in the memory given in ``D3MRAM``.
+    """
+    max_sessions = os.getenv('TA2_MAX_SESSIONS')
+    if max_sessions:
+        return max(int(max_sessions), 1)
+
+    max_running = int(os.getenv('D3MCPU') or os.cpu_count() or 1)
+    ram = os.getenv('D3MRAM')
+    if ram:
+        max_running = min(max_running, parse_memory(ram) // parse_memory(SESSION_RAM))
+
+    return max(max_running, 1)
+
+
+class SessionScheduler:
+    """Run the sessions on a bounded number of threads, highest priority first.
+
+    Sessions with the same priority are started in the order they were submitted.
+
+    ``reserved`` of the slots are kept for the sessions submitted as reserved, which
+    are also started before the rest. At least one slot is left for the rest, so all
+    of them together never run more than ``max_running`` sessions.
+    """
+
+    def __init__(self, max_running=None, reserved=RESERVED_SESSIONS):
+        self.max_running = max_running or get_max_running()
+        self.reserved = max(min(reserved, self.max_running - 1), 0)
+        self.running = 0
+        self.running_unreserved = 0
+        self._queue = list()
+        self._reserved_queue = list()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def submit(self, function, args=(), priority=0, reserved=False):
+        """Queue the function and return a ticket that can be used to cancel it."""
+        with self._lock:
+            ticket = next(self._counter)
+            queue = self._reserved_queue if reserved else self._queue
+            heapq.heappush(queue, (-priority, ticket, function, args))
+            self._start_next()
+
+        return ticket
+
+    def cancel(self, ticket):
+        """Remove a function from the queue and tell whether it had not started yet."""
+        with self._lock:
+            for queue in (self._queue, self._reserved_queue):
+                for index, entry in enumerate(queue):
+                    if entry[1] == ticket:
+                        queue.pop(index)
+                        heapq.heapify(queue)
+                        return True
+
+        return False
+
+    def _start_next(self):
+        while self.running < self.max_running:
+            if self._reserved_queue:
+                reserved = True
+                _, _, function, args = heapq.heappop(self._reserved_queue)
+            elif self._queue and self.running_unreserved < self.max_running - self.reserved:
+                reserved = False
+                _, _, function, args = heapq.heappop(self._queue)
+                self.running_unreserved += 1
+            else:
+                break
+
+            self.running += 1
+            threading.Thread(target=self._run, args=(function, args, reserved)).start()
+
+    def _run(self, function, args, reserved):
+        try:
+            function(*args)
+
+        finally:
+            with self._lock:
+                self.running -= 1
+                if not reserved:
+                    self.running_unreserved -= 1
+
+                self._start_next()
+
+    def __len__(self):
+        return len(self._queue) + len(self._reserved_queue)
@@ -4,24 +4,40 @@ import os
 import time
 from concurrent import futures
 
-import grpc
-from ta3ta2_api import core_pb2_grpc
-
-from ta2.ta3 import core_servicer
-from ta2.utils import logging_setup
+from ta2.utils import get_dataset_index, logging_setup
 
 _ONE_DAY_IN_SECONDS = 60 * 60 * 24
 
 LOGGER = logging.getLogger(__name__)
 
 
-def serve(port, input_dir, output_dir, static_dir, timeout, debug, daemon=False):
+def serve(port, input_dir, output_dir, static_dir, timeout, debug, daemon=False,
+          workers=1, fold_workers=1, halving=None, abort_margin=None, tuner='gp', preload=True, preload_static=False):
+    import grpc
+    from ta3ta2_api import core_pb2_grpc
+
+    from ta2.ta3 import core_servicer
+    from ta2.template import preload_templates
+
+    # Index the input datasets before the first search needs them
+    get_dataset_index(input_dir).refresh()
+
+    if preload:
+        # Import the primitives before the first search, so it does not count against its timeout
+        LOGGER.info("Preloading the templates")
+        preload_templates(static_dir if preload_static else None)
+
     cs = core_servicer.CoreServicer(
         input_dir,
         output_dir,
         static_dir,
         timeout,
-        debug
+        debug,
+        workers,
+        fold_workers,
+        halving,
+        abort_margin,
+        tuner
     )
     server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
 
@@ -45,6 +61,8 @@ def serve(port, input_dir, output_dir, static_dir, timeout, debug, daemon=False)
 
 
 if __name__ == '__main__':
+    from ta2.tuning import TUNERS
+
     parser = argparse.ArgumentParser(description='TA3 API Server')
     parser.add_argument('--port', type=int, default=45042)
     parser.add_argument('-s', '--static', type=str)
@@ -53,7 +71,14 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--output', nargs='?')
     parser.add_argument('-t', '--timeout', type=int, nargs='?')
     parser.add_argument('-l', '--logfile', type=str, nargs='?')
+    parser.add_argument('-w', '--workers', type=int, default=1)
+    parser.add_argument('-fw', '--fold-workers', type=int, default=1)
+    parser.add_argument('-H', '--halving', type=int)
+    parser.add_argument('-am', '--abort-margin', type=float)
+    parser.add_argument('-tu', '--tuner', default='gp', choices=sorted(TUNERS))
     parser.add_argument('--debug', action='store_true')
+    parser.add_argument('--no-preload', action='store_false', dest='preload')
+    parser.add_argument('--preload-static', action='store_true')
 
     args = parser.parse_args()
 
@@ -73,4 +98,7 @@ if __name__ == '__main__':
     logging_setup(args.verbose, args.logfile)
     logging.getLogger("d3m.metadata.pipeline_run").setLevel(logging.ERROR)
 
-    serve(args.port, input_dir, output_dir, static_dir, timeout, debug)
+    serve(args.port, input_dir, output_dir, static_dir, timeout, debug,
+          workers=args.workers, fold_workers=args.fold_workers,
+          halving=args.halving, abort_margin=args.abort_margin, tuner=args.tuner,
+          preload=args.preload, preload_static=args.preload_static)
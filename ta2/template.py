@@ -4,7 +4,10 @@ import logging
 import os
 import warnings
 from collections import defaultdict
+from functools import lru_cache
 
+import d3m
+import pkg_resources
 import yaml
 from btb import HyperParameter
 from d3m import index
@@ -12,13 +15,27 @@ from d3m.metadata.base import ArgumentType
 from d3m.metadata.hyperparams import Union
 from d3m.metadata.pipeline import Pipeline, PrimitiveStep
 
+from ta2.cache import KeyLocks, SpillCache, StepCache
+from ta2.utils import get_digest
+
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 
 TUNING_PARAMETER = 'https://metadata.datadrivendiscovery.org/types/TuningParameter'
 
+TEMPLATE_CACHE_DIR = os.getenv('TA2_TEMPLATE_CACHE_DIR')
+TEMPLATE_CACHE_SIZE = int(os.getenv('TA2_TEMPLATE_CACHE_SIZE', 100 * 1024 ** 2))
+
 LOGGER = logging.getLogger(__name__)
 
+# Compiled templates, also pickled to disk if a directory is given
+if TEMPLATE_CACHE_DIR:
+    TEMPLATE_CACHE = SpillCache(TEMPLATE_CACHE_DIR, TEMPLATE_CACHE_SIZE, persistent=True)
+else:
+    TEMPLATE_CACHE = StepCache(TEMPLATE_CACHE_SIZE)
+
+_TEMPLATE_LOCKS = KeyLocks()
+
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
 DATA_AUGMENTATION = 'd3m.primitives.data_augmentation.datamart_augmentation.Common'
@@ -112,18 +129,51 @@ def get_tunable_hyperparameters(tunables, defaults):
     return dict(tunable_hyperparameters)
 
 
+@lru_cache(maxsize=1)
+def _get_installed_versions():
+    """Get the versions of the packages that install each primitive, without importing them."""
+    return {
+        'd3m.primitives.' + entry_point.name: entry_point.dist.version
+        for entry_point in pkg_resources.iter_entry_points('d3m.primitives')
+    }
+
+
 def load_template(template_name, data_augmentation=None):
-    """load a simplified version of a yaml pipeline, with hyperparameters."""
+    """load a simplified version of a yaml pipeline, with hyperparameters.
+
+    The primitives are resolved and the hyperparameters introspected only the first
+    time, and the compiled template is reused until its yaml file or the installed
+    versions of d3m and its primitives change. The returned pipeline and hyperparameters can be shared with other callers, so
+    they must not be modified.
+    """
 
     if os.path.exists(template_name):
         template_path = template_name
     else:
         template_path = os.path.join(TEMPLATES_DIR, template_name)
 
-    LOGGER.info('Loading template %s', template_path)
     with open(template_path, 'r') as template_file:
-        template = yaml.safe_load(template_file)
+        template_yaml = template_file.read()
 
+    template = yaml.safe_load(template_yaml)
+    primitives = [step['primitive'] for step in template['steps']]
+    if data_augmentation:
+        primitives.append(DATA_AUGMENTATION)
+
+    installed_versions = _get_installed_versions()
+    versions = [installed_versions.get(primitive) for primitive in primitives]
+    key = get_digest([d3m.__version__, versions, template_yaml, data_augmentation])
+    with _TEMPLATE_LOCKS.hold(key):
+        compiled = TEMPLATE_CACHE.get(key)
+        if compiled is None:
+            LOGGER.info('Loading template %s', template_path)
+            compiled = _compile_template(template, data_augmentation)
+            TEMPLATE_CACHE.set(key, compiled)
+
+    return compiled
+
+
+def _compile_template(template, data_augmentation):
     steps = template['steps']
 
     pipeline = Pipeline()
@@ -222,6 +272,60 @@ def load_template(template_name, data_augmentation=None):
     return pipeline, tunable_hyperparameters
 
 
+def _read_volumes(primitive, static_dir):
+    """Read the static files of the primitive so they are in the OS page cache."""
+    for entry in primitive.metadata.query().get('installation', ()):
+        if entry.get('type') not in ('FILE', 'TARBALL') or 'file_digest' not in entry:
+            continue
+
+        path = os.path.join(static_dir, entry['file_digest'])
+        paths = [path]
+        if os.path.isdir(path):
+            paths = [
+                os.path.join(root, filename)
+                for root, _, filenames in os.walk(path)
+                for filename in filenames
+            ]
+
+        for file_path in paths:
+            if os.path.isfile(file_path):
+                LOGGER.info('Reading %s of primitive %s', file_path, primitive.metadata.query()['id'])
+                with open(file_path, 'rb') as volume_file:
+                    while volume_file.read(1024 ** 2):
+                        pass
+
+
+def preload_templates(static_dir=None):
+    """Compile all the templates, which imports all the primitives that they use.
+
+    If ``static_dir`` is given, the static files of the primitives, like the weights
+    of the pretrained models, are also read once. The primitives are not instantiated,
+    because the processes forked afterwards could not use the models loaded here.
+    """
+    template_names = sorted(
+        template_name
+        for template_name in os.listdir(TEMPLATES_DIR)
+        if template_name.endswith('.yml')
+    )
+
+    primitives = set()
+    for template_name in template_names:
+        try:
+            pipeline, _ = load_template(template_name)
+            primitives.update(step.primitive for step in pipeline.steps)
+        except Exception:
+            LOGGER.exception('Error preloading template %s', template_name)
+
+    if static_dir:
+        for primitive in primitives:
+            try:
+                _read_volumes(primitive, static_dir)
+            except Exception:
+                LOGGER.exception('Error reading the static files of primitive %s', primitive)
+
+    LOGGER.info('Preloaded %s templates using %s primitives', len(template_names), len(primitives))
+
+
 def add_tunable_hyperparameters(input_path, output_path):
     _, tunables, defaults = load_template(input_path)
     tunable_hyperparameters = get_tunable_hyperparameters(tunables, defaults)
@@ -1,15 +1,88 @@
+import copy
+import logging
+import random
 from collections import defaultdict
 
+import numpy as np
 from btb import HyperParameter
 from btb.selection import UCB1
 from btb.tuning import GP
+from btb.tuning.tuner import BaseTuner
+from sklearn.ensemble import ExtraTreesRegressor
 
 from ta2.template import load_template
 
+LOGGER = logging.getLogger(__name__)
+
+
+class WindowedGP(GP):
+    """GP tuner that is only fitted on a bounded window of the scored proposals.
+
+    The window holds the best half and the most recent half of the scores, so the
+    cost of fitting and proposing does not grow with the number of iterations.
+    """
+
+    def __init__(self, tunables, gridding=0, r_minimum=2, window=100):
+        super(WindowedGP, self).__init__(tunables, gridding=gridding, r_minimum=r_minimum)
+        self.window = window
+
+    def fit(self, X, y):
+        if len(y) > self.window:
+            best = np.argsort(y)[-(self.window // 2):]
+            recent = np.arange(len(y) - (self.window - len(best)), len(y))
+            indexes = np.union1d(best, recent)
+            X = X[indexes]
+            y = y[indexes]
+
+        super(WindowedGP, self).fit(X, y)
+
+
+class ForestTuner(BaseTuner):
+    """Tuner that uses an ensemble of randomized trees as surrogate model.
+
+    The spread of the predictions of the trees is used as their uncertainty,
+    and the proposal with the highest upper confidence bound is chosen.
+    """
+
+    def __init__(self, tunables, gridding=0, r_minimum=2, n_estimators=50):
+        super(ForestTuner, self).__init__(tunables, gridding=gridding)
+        self.r_minimum = r_minimum
+        self.n_estimators = n_estimators
+        self.model = None
+
+    def fit(self, X, y):
+        super(ForestTuner, self).fit(X, y)
+        if X.shape[0] < self.r_minimum:
+            return
+
+        self.model = ExtraTreesRegressor(n_estimators=self.n_estimators, min_samples_leaf=2)
+        self.model.fit(X, y)
+
+    def predict(self, X):
+        if self.model is None:
+            # Not enough scores yet, so the candidates are chosen at random
+            return np.column_stack((np.random.rand(X.shape[0]), np.zeros(X.shape[0])))
+
+        predictions = np.array([tree.predict(X) for tree in self.model.estimators_])
+        return np.column_stack((predictions.mean(axis=0), predictions.std(axis=0)))
+
+    def _acquire(self, predictions):
+        return np.argmax(predictions[:, 0] + predictions[:, 1])
+
+
+TUNERS = {
+    'gp': GP,
+    'windowed_gp': WindowedGP,
+    'forest': ForestTuner,
+}
+
 
 class SelectorTuner:
 
-    def __init__(self, templates, data_augmentation):
+    def __init__(self, templates, data_augmentation, tuner='gp', history=None):
+        if tuner not in TUNERS:
+            raise ValueError('Unknown tuner {}. Use one of {}'.format(tuner, sorted(TUNERS)))
+
         if data_augmentation:
             data_augmentation_templates = [
                 template + '#DA'
@@ -21,7 +94,13 @@ class SelectorTuner:
         self.templates = dict()
         self.selector = UCB1(templates)
         self.scores = defaultdict(list)
+        self.pending = defaultdict(list)
         self.data_augmentation = data_augmentation
+        self.tuner_class = TUNERS[tuner]
+        self.history = history or list()
+        self.prior_scores = defaultdict(list)
+        self.elapsed = defaultdict(list)
+        self.prior_elapsed = defaultdict(list)
 
     @staticmethod
     def _get_tunables(tunable_hyperparameters):
@@ -44,6 +123,101 @@ class SelectorTuner:
 
         return tunables, defaults
 
+    def _warm_start(self, template_name, tuner, tunables):
+        """Teach the tuner the scores obtained by this template in past searches."""
+        names = {name for name, _ in tunables}
+        for record in self.history:
+            hyperparameters = record['hyperparameters']
+            if record['template'] != template_name or set(hyperparameters) != names:
+                continue
+
+            try:
+                tuner.add(hyperparameters, record['normalized_score'])
+                self.prior_scores[template_name].append(record['normalized_score'])
+                if record.get('elapsed') is not None:
+                    self.prior_elapsed[template_name].append(record['elapsed'])
+            except Exception:
+                # The template has changed since the record was stored
+                LOGGER.debug('Skipping history record of template %s', template_name)
+
+    def _get_selector_scores(self):
+        scores = dict(self.scores)
+        scores.update(self._get_lied_scores())
+        for template_name, prior_scores in self.prior_scores.items():
+            if template_name in scores:
+                scores[template_name] = prior_scores + scores[template_name]
+
+        return scores
+
+    def _get_cost(self, template_name):
+        """Get the mean time that scoring a pipeline of the template takes."""
+        elapsed = self.prior_elapsed.get(template_name, []) + self.elapsed.get(template_name, [])
+        if not elapsed:
+            elapsed = [
+                value
+                for timings in (self.prior_elapsed, self.elapsed)
+                for values in timings.values()
+                for value in values
+            ]
+
+        return np.mean(elapsed) if elapsed else None
+
+    def _select(self, scores):
+        """Select the template that is expected to improve the best score faster.
+
+        The improvement of each template is estimated with the upper confidence
+        bound of its scores, like UCB1 does, and divided by the time it takes to
+        score one of its pipelines. Until the times are known, or if no template
+        is expected to improve, the plain UCB1 selection is used.
+        """
+        costs = {template_name: self._get_cost(template_name) for template_name in scores}
+        if any(cost is None for cost in costs.values()):
+            return self.selector.select(scores)
+
+        total_pulls = sum(len(template_scores) for template_scores in scores.values())
+        best_score = max(max(template_scores) for template_scores in scores.values())
+
+        improvement_rates = dict()
+        for template_name, template_scores in scores.items():
+            bound = np.mean(template_scores) + np.sqrt(2 * np.log(total_pulls) / len(template_scores))
+            improvement_rates[template_name] = (bound - best_score) / max(costs[template_name], 1e-3)
+
+        template_name = max(improvement_rates, key=improvement_rates.get)
+        if improvement_rates[template_name] <= 0:
+            return self.selector.select(scores)
+
+        return template_name
+
+    def _get_lie(self, template_name):
+        """Get the score assumed for the pending proposals of a template.
+
+        This is the constant liar strategy, using the worst score seen so far.
+        """
+        scores = self.scores.get(template_name)
+        if not scores:
+            scores = [score for scores in self.scores.values() for score in scores]
+
+        return min(scores) if scores else 0.0
+
+    def _get_lied_scores(self):
+        return {
+            template_name: self.scores.get(template_name, []) + [self._get_lie(template_name)] * len(pending)
+            for template_name, pending in self.pending.items()
+            if pending
+        }
+
+    def _propose_proposal(self, template_name, tuner):
+        pending = self.pending[template_name]
+        if pending:
+            # Pretend that the pending proposals got the lie as their score,
+            # so the tuner does not propose them again.
+            tuner = copy.deepcopy(tuner)
+            lie = self._get_lie(template_name)
+            for proposal in pending:
+                tuner.add(proposal, lie)
+
+        return tuner.propose(1)
+
     def propose(self):
         if len(self.templates) < len(self.template_names):
             template_name = self.template_names[len(self.templates)]
@@ -55,17 +229,42 @@ class SelectorTuner:
                 template, tunable_hyperparameters = load_template(template_name)
 
             tunables, proposal = self._get_tunables(tunable_hyperparameters)
-            self.templates[template_name] = template, GP(tunables)
+            tuner = self.tuner_class(tunables)
+            self._warm_start(template_name, tuner, tunables)
+            self.templates[template_name] = template, tuner
             default = True
         else:
-            template_name = self.selector.select(self.scores)
+            if self.scores:
+                template_name = self._select(self._get_selector_scores())
+            else:
+                # Nothing has been scored yet, which happens when the
+                # defaults are still being scored in parallel.
+                template_name = random.choice(list(self.templates))
+
             template, tuner = self.templates[template_name]
-            proposal = tuner.propose(1)
+            proposal = self._propose_proposal(template_name, tuner)
             default = False
 
+        self.pending[template_name].append(proposal)
         return template_name, template, proposal, default
 
-    def add(self, template_name, proposal, score):
+    def propose_batch(self, size):
+        """Propose ``size`` different pipelines to be scored at the same time.
+
+        Until their scores are added, the proposals are pending and both the
+        template selection and the tuners assume that they got the worst score
+        seen so far, which makes the following proposals explore elsewhere.
+        """
+        return [self.propose() for _ in range(size)]
+
+    def add(self, template_name, proposal, score, elapsed=None):
         tuner = self.templates[template_name][1]
         tuner.add(proposal, score)
         self.scores[template_name].append(score)
+        if elapsed is not None:
+            self.elapsed[template_name].append(elapsed)
+
+        self.pending[template_name] = [
+            pending for pending in self.pending[template_name]
+            if pending is not proposal
+        ]
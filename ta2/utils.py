@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
 import io
 import json
 import logging
 import os
 import tarfile
+import threading
 import urllib
 
 LOGGER = logging.getLogger(__name__)
@@ -38,6 +40,110 @@ def ensure_downloaded(dataset_name, data_path=DATA_PATH):
         _download(dataset_name, data_path)
 
 
+def get_digest(obj):
+    """Compute a stable digest of any JSON serializable object."""
+    serialized = json.dumps(obj, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+class DatasetIndex:
+    """Index of the datasets found inside an input directory by their datasetID.
+
+    Each datasetDoc.json is parsed only once, and parsed again only if it has
+    been modified. The index is refreshed when a dataset is not found or when
+    the datasetDoc.json of the one found has changed.
+    """
+
+    def __init__(self, input_dir):
+        self.input_dir = input_dir
+        self._docs = dict()
+        self._index = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_doc_paths(dataset_root, dataset_name):
+        return [
+            os.path.join(dataset_root, 'TRAIN', 'dataset_TRAIN', 'datasetDoc.json'),
+            os.path.join(dataset_root, dataset_name + '_dataset', 'datasetDoc.json'),
+        ]
+
+    def _read_doc(self, doc_path, mtime, dataset_name):
+        cached = self._docs.get(doc_path)
+        if cached is not None and cached[0] == mtime:
+            return cached
+
+        LOGGER.info('Loading datasetDoc from %s', doc_path)
+        try:
+            with open(doc_path, 'r') as dataset_doc_file:
+                dataset_id = json.load(dataset_doc_file)['about']['datasetID']
+        except (OSError, ValueError, KeyError) as ex:
+            LOGGER.warn('Invalid datasetDoc %s: %s', doc_path, ex)
+            dataset_id = None
+
+        return mtime, dataset_name, dataset_id
+
+    def refresh(self):
+        """Parse the datasetDoc.json files that are new or have changed."""
+        with self._lock:
+            docs = dict()
+            if os.path.isdir(self.input_dir):
+                for entry in os.scandir(self.input_dir):
+                    if not entry.is_dir():
+                        continue
+
+                    for doc_path in self._get_doc_paths(entry.path, entry.name):
+                        try:
+                            mtime = os.stat(doc_path).st_mtime_ns
+                        except OSError:
+                            continue
+
+                        docs[doc_path] = self._read_doc(doc_path, mtime, entry.name)
+
+            index = dict()
+            for doc_path, (mtime, dataset_name, dataset_id) in sorted(docs.items()):
+                if dataset_id is not None:
+                    index.setdefault(dataset_id, (doc_path, mtime, dataset_name))
+
+            self._docs = docs
+            self._index = index
+
+    def _lookup(self, dataset_id):
+        entry = self._index.get(dataset_id)
+        if entry is not None:
+            doc_path, mtime, dataset_name = entry
+            try:
+                if os.stat(doc_path).st_mtime_ns == mtime:
+                    return dataset_name, 'file://' + os.path.abspath(doc_path)
+
+            except OSError:
+                pass
+
+    def find(self, dataset_id):
+        """Get the name and the URI of the dataset, or None if it cannot be found."""
+        dataset = self._lookup(dataset_id)
+        if dataset is None:
+            self.refresh()
+            dataset = self._lookup(dataset_id)
+
+        return dataset
+
+
+_DATASET_INDEXES = dict()
+_DATASET_INDEXES_LOCK = threading.Lock()
+
+
+def get_dataset_index(input_dir):
+    """Get the index of the given input directory, shared by the whole process."""
+    input_dir = os.path.realpath(input_dir)
+    with _DATASET_INDEXES_LOCK:
+        index = _DATASET_INDEXES.get(input_dir)
+        if index is None:
+            index = DatasetIndex(input_dir)
+            _DATASET_INDEXES[input_dir] = index
+
+        return index
+
+
 def dump_pipeline(pipeline, dump_dir, rank=None):
     if not isinstance(pipeline, dict):
         pipeline = pipeline.to_json_structure()
@@ -0,0 +1,324 @@
+import itertools
+import logging
+import multiprocessing
+import threading
+import weakref
+from multiprocessing.connection import wait
+
+LOGGER = logging.getLogger(__name__)
+
+_SHARED = dict()
+_SHARED_KEYS = itertools.count()
+_SHARED_LOCK = threading.Lock()
+_POOLS = weakref.WeakSet()
+
+
+class WorkerCrashed(Exception):
+    pass
+
+
+class Shared:
+    """Reference to an object shared with the worker processes."""
+
+    def __init__(self, key):
+        self.key = key
+
+    def __repr__(self):
+        return 'Shared({})'.format(self.key)
+
+
+def share(obj):
+    """Share an object with the worker processes without copying or pickling it.
+
+    The returned reference can be passed to the tasks instead of the object.
+    The worker processes inherit the object from the memory of this process
+    when they are started, so the ones that were started before sharing it
+    are restarted before being given a task that uses it.
+    """
+    with _SHARED_LOCK:
+        key = next(_SHARED_KEYS)
+        _SHARED[key] = obj
+
+    return Shared(key)
+
+
+def unshare(shared):
+    """Stop sharing an object and release the worker processes that hold it."""
+    with _SHARED_LOCK:
+        _SHARED.pop(shared.key, None)
+
+    for pool in list(_POOLS):
+        pool._terminate_stale()
+
+
+def _get_shared_keys(value):
+    if isinstance(value, Shared):
+        return {value.key}
+
+    elif isinstance(value, (list, tuple)):
+        return set().union(*(_get_shared_keys(item) for item in value))
+
+    elif isinstance(value, dict):
+        return set().union(*(_get_shared_keys(item) for item in value.values()))
+
+    return set()
+
+
+def _resolve(value):
+    if isinstance(value, Shared):
+        return _SHARED[value.key]
+
+    elif isinstance(value, list):
+        return [_resolve(item) for item in value]
+
+    elif isinstance(value, tuple):
+        return tuple(_resolve(item) for item in value)
+
+    elif isinstance(value, dict):
+        return {key: _resolve(item) for key, item in value.items()}
+
+    return value
+
+
+def _worker_loop(connection, initializer, initargs):
+    global _SHARED_LOCK
+
+    # Another thread could have been holding the lock when this process was
+    # forked, and the pools inherited from the parent process do not belong to it.
+    _SHARED_LOCK = threading.Lock()
+    _POOLS.clear()
+
+    if initializer is not None:
+        initializer(*initargs)
+
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+
+        if task is None:
+            break
+
+        function, args, kwargs = task
+        try:
+            result = (True, function(*_resolve(args), **_resolve(kwargs)))
+        except Exception as ex:
+            result = (False, ex)
+
+        try:
+            connection.send(result)
+        except Exception as ex:
+            # The result or the exception could not be pickled
+            error = Exception('{}: {}'.format(type(ex).__name__, ex))
+            connection.send((False, error))
+
+
+class Worker:
+
+    def __init__(self, initializer=None, initargs=()):
+        self.initializer = initializer
+        self.initargs = initargs
+        self.process = None
+        self.connection = None
+        self.shared_keys = set()
+        self.start()
+
+    def start(self):
+        connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_worker_loop,
+            args=(child_connection, self.initializer, self.initargs)
+        )
+        self.process.daemon = True
+        with _SHARED_LOCK:
+            self.shared_keys = set(_SHARED)
+
+        # Not forked while holding the lock. An object shared in the meantime only
+        # makes the worker restart when it gets it, and one unshared makes it stale.
+        self.process.start()
+
+        child_connection.close()
+        self.connection = connection
+        LOGGER.debug('Worker process %s started', self.process.pid)
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def is_stale(self):
+        return bool(self.shared_keys - set(_SHARED))
+
+    def terminate(self):
+        LOGGER.debug('Terminating worker process %s', self.process.pid)
+        self.process.terminate()
+        self.process.join()
+        self.connection.close()
+
+    def restart(self):
+        self.terminate()
+        self.start()
+
+
+class Task:
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.done = False
+        self.result = None
+        self.error = None
+
+    def get(self):
+        if self.error is not None:
+            raise self.error
+
+        return self.result
+
+
+class WorkerPool:
+    """Pool of long lived processes that survives the crash of any of them.
+
+    Workers are started lazily, one task at a time is sent to each one of them,
+    and a worker that dies while running a task is restarted, making the task
+    fail with a ``WorkerCrashed`` error instead of hanging forever.
+
+    A worker is only free again once the thread that submitted its task waits for
+    it, so a thread never blocks waiting for a free worker while it holds others.
+    """
+
+    def __init__(self, size=1, initializer=None, initargs=()):
+        self.size = size
+        self.initializer = initializer
+        self.initargs = initargs
+        self._workers = list()
+        self._idle = list()
+        self._condition = threading.Condition()
+        _POOLS.add(self)
+
+    def _get_worker(self, block=True):
+        """Get a free worker, or ``None`` if there is none and ``block`` is false."""
+        with self._condition:
+            while not self._idle and len(self._workers) >= self.size:
+                if not block:
+                    return None
+
+                self._condition.wait()
+
+            if self._idle:
+                worker = self._idle.pop()
+                if not worker.is_alive():
+                    LOGGER.warn('Worker process %s died while idle', worker.process.pid)
+                    worker.restart()
+                elif worker.is_stale():
+                    worker.restart()
+
+            else:
+                worker = Worker(self.initializer, self.initargs)
+                self._workers.append(worker)
+
+            return worker
+
+    def _release(self, worker):
+        with self._condition:
+            if worker in self._workers:
+                self._idle.append(worker)
+                self._condition.notify()
+
+    def _terminate_stale(self):
+        with self._condition:
+            for worker in list(self._idle):
+                if worker.is_stale():
+                    worker.terminate()
+                    self._idle.remove(worker)
+                    self._workers.remove(worker)
+                    self._condition.notify()
+
+    def submit(self, function, *args, **kwargs):
+        return self._send(self._get_worker(), function, args, kwargs)
+
+    def _send(self, worker, function, args, kwargs):
+        if not _get_shared_keys((args, kwargs)) <= worker.shared_keys:
+            # Started before the objects were shared
+            worker.restart()
+
+        try:
+            worker.connection.send((function, args, kwargs))
+        except Exception:
+            self._release(worker)
+            raise
+
+        return Task(worker)
+
+    def _collect(self, task):
+        worker = task.worker
+        try:
+            success, value = worker.connection.recv()
+            if success:
+                task.result = value
+            else:
+                task.error = value
+
+        except (EOFError, OSError):
+            exitcode = worker.process.exitcode
+            LOGGER.error('Worker process %s crashed with exit code %s',
+                         worker.process.pid, exitcode)
+            task.error = WorkerCrashed('Worker crashed with exit code {}'.format(exitcode))
+            worker.restart()
+
+        task.done = True
+        self._release(worker)
+
+    def wait(self, tasks, timeout=None):
+        """Wait until any of the given tasks finishes and return the finished ones."""
+        waiting = dict()
+        for task in tasks:
+            if not task.done:
+                waiting[task.worker.connection] = task
+                waiting[task.worker.process.sentinel] = task
+
+        finished = list()
+        for ready in wait(list(waiting), timeout):
+            task = waiting[ready]
+            if not task.done:
+                self._collect(task)
+                finished.append(task)
+
+        return finished
+
+    def map(self, function, arguments):
+        """Run ``function`` once for each tuple in ``arguments`` and return the results in order.
+
+        Other threads may be using the pool too, so the next task is only sent when a
+        worker is free, waiting for the running tasks of this call otherwise.
+        """
+        tasks = list()
+        for args in arguments:
+            running = [task for task in tasks if not task.done]
+            worker = self._get_worker(block=not running)
+            while worker is None:
+                self.wait(running)
+                running = [task for task in running if not task.done]
+                worker = self._get_worker(block=not running)
+
+            tasks.append(self._send(worker, function, args, dict()))
+
+        for task in tasks:
+            while not task.done:
+                self.wait([task])
+
+        return [task.get() for task in tasks]
+
+    def run(self, function, *args, **kwargs):
+        task = self.submit(function, *args, **kwargs)
+        while not task.done:
+            self.wait([task])
+
+        return task.get()
+
+    def terminate(self):
+        with self._condition:
+            for worker in self._workers:
+                worker.terminate()
+
+            self._workers = list()
+            self._idle = list()
+            self._condition.notify_all()
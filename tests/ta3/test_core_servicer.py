@@ -1,4 +1,5 @@
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 from unittest.mock import MagicMock, patch
 
 import pytest
@@ -36,6 +37,11 @@ def test_core_servicer():
     assert instance.static_dir == static_dir
     assert instance.timeout == timeout
     assert not instance.debug
+    assert instance.workers == 1
+    assert instance.fold_workers == 1
+    assert instance.halving is None
+    assert instance.abort_margin is None
+    assert instance.tuner == 'gp'
 
 
 @patch('ta2.ta3.core_servicer.LOGGER.exception')
@@ -87,8 +93,7 @@ def test_core_servicer_run_session(logger_info_mock, logger_exception_mock):
 
 
 @patch('ta2.ta3.core_servicer.LOGGER.info')
-@patch('ta2.ta3.core_servicer.threading.Thread')
-def test_core_servicer_start_session(thread_mock, logger_mock):
+def test_core_servicer_start_session(logger_mock):
     session_id = 'test-id'
     session_type = 'test-type'
     method = MagicMock()
@@ -119,7 +124,9 @@ def test_core_servicer_start_session(thread_mock, logger_mock):
     logger_mock.reset_mock()
 
     instance = CoreServicer('/input', '/output', '/static', 0.5)
-    instance._start_session(session_id, session_type, method, 'first-argument', second='argument')
+    instance.scheduler = MagicMock()
+    instance._start_session(session_id, session_type, method, 'first-argument',
+                            priority=2, second='argument')
 
     assert len(instance.DB) == 1
     assert len(instance.DB[session_type + '_sessions']) == 1
@@ -127,13 +134,21 @@ def test_core_servicer_start_session(thread_mock, logger_mock):
     session = instance.DB[session_type + '_sessions'][session_id]
     expected_args = [session, method] + list(args)
 
-    thread_mock.assert_called_once_with(target=instance._run_session, args=expected_args)
+    # not a search, so it does not wait for them
+    instance.scheduler.submit.assert_called_once_with(instance._run_session, expected_args, 2, True)
     assert logger_mock.call_count == 1
     assert 'id' in session
     assert 'type' in session
     assert 'start' in session
+    assert session['queued']
+    assert session['ticket'] == instance.scheduler.submit.return_value
 
-    # as thread is mocked `_run_session` is not called, therefore
+    # search sessions
+    instance._start_session(session_id, 'search', method)
+    assert instance.scheduler.submit.call_count == 2
+    assert instance.scheduler.submit.call_args[0][3] is False
+
+    # as the scheduler is mocked `_run_session` is not called, therefore
     # `end` and `done` are not in session
 
 
@@ -167,7 +182,15 @@ def test_core_servicer_searchsolutions(searcher_mock, pipeline_searcher_mock, de
 
     decode_mock.assert_called_once_with(problem)
     pipeline_searcher_mock.assert_called_once_with(
-        instance.input_dir, instance.output_dir, instance.static_dir)
+        instance.input_dir,
+        instance.output_dir,
+        instance.static_dir,
+        n_workers=instance.workers,
+        fold_workers=instance.fold_workers,
+        halving=instance.halving,
+        abort_margin=instance.abort_margin,
+        tuner=instance.tuner
+    )
 
     assert instance._start_session.call_count == 1
     assert result == expected_result
@@ -199,6 +222,13 @@ def test_core_servicer_get_progress(progress_state_mock, progress_mock):
     progress_state_mock.assert_called_with('RUNNING')
     assert progress_mock.call_count == 3
 
+    # PENDING
+    session = {'queued': True}
+    instance._get_progress(session)
+
+    progress_state_mock.assert_called_with('PENDING')
+    assert progress_mock.call_count == 4
+
 
 @patch('ta2.ta3.core_servicer.core_pb2.GetSearchSolutionsResultsResponse')
 def test_core_servicer_get_search_soltuion_results(solutions_results_mock):
@@ -252,6 +282,34 @@ def test_core_servicer_getsearchsolutionsresults():
     assert result == expected_result
 
 
+def test_core_servicer_stream():
+    instance = CoreServicer('/input', '/output', '/static', 0.5)
+    session = {'type': 'test-type', 'id': 'test-id', 'results': []}
+
+    def get_next(session, returned):
+        if len(session['results']) > returned:
+            return session['results'][returned]
+
+    stream = instance._stream(session, get_next)
+
+    def publish():
+        updated = instance._get_condition(session)
+        with updated:
+            session['results'].append('first-result')
+            updated.notify_all()
+
+        instance._run_session(session, MagicMock())
+
+    # the stream waits until the result is published instead of polling
+    thread = threading.Timer(0.1, publish)
+    thread.start()
+
+    assert list(stream) == ['first-result']
+    assert session['done']
+
+    thread.join()
+
+
 @patch('ta2.ta3.core_servicer.core_pb2.EndSearchSolutionsResponse')
 def test_core_servicer_endsearchsolutions(end_search_mock):
     instance = CoreServicer('/input', '/output', '/static', 0.5)
@@ -270,17 +328,32 @@ def test_core_servicer_endsearchsolutions(end_search_mock):
     assert result == expected_result
 
     # session with searcher
-    searcher = MagicMock(done=True, solutions={})
+    searcher = MagicMock(done=True, solutions=[{'id': 'solution-id'}])
     searcher.stop = MagicMock()
+    instance.fitted_solutions = MagicMock()
 
     instance.DB['search_sessions'] = {search_id: {'searcher': searcher}}
 
     result = instance.EndSearchSolutions(request, None)
 
     searcher.stop.assert_called_once()
+    searcher.close.assert_called_once_with()
+    instance.fitted_solutions.delete.assert_called_once_with('solution-id')
     assert result == expected_result
     assert end_search_mock.call_count == 2
 
+    # queued session
+    instance.scheduler = MagicMock()
+    instance.scheduler.cancel.return_value = True
+    session = {'id': search_id, 'searcher': searcher, 'ticket': 3, 'queued': True}
+    instance.DB['search_sessions'] = {search_id: session}
+
+    instance.EndSearchSolutions(request, None)
+
+    instance.scheduler.cancel.assert_called_once_with(3)
+    assert session['done']
+    assert not session['queued']
+
 
 @patch('ta2.ta3.core_servicer.core_pb2.StopSearchSolutionsResponse')
 def test_core_servicer_stopsearchsolutions(stop_search_mock):
@@ -311,3 +384,130 @@ def test_core_servicer_stopsearchsolutions(stop_search_mock):
     searcher.stop.assert_called_once()
     assert result == expected_result
     assert stop_search_mock.call_count == 2
+
+
+def test_core_servicer_score_solution():
+    instance = CoreServicer('/input', '/output', '/static', 0.5)
+    searcher = MagicMock()
+    pipeline = MagicMock()
+    metrics = [{'metric': 'first'}, {'metric': 'second'}]
+    configuration = MagicMock()
+
+    with patch.object(instance, '_get_cv_args', return_value={'folds': 3}):
+        instance._score_solution(searcher, 'dataset', 'problem', pipeline, metrics, configuration)
+
+    # a single cross validation for all the metrics
+    searcher.score_pipeline.assert_called_once_with('dataset', 'problem', pipeline, metrics, folds=3)
+
+
+@patch('ta2.ta3.core_servicer.core_pb2.GetScoreSolutionResultsResponse')
+@patch('ta2.ta3.core_servicer.encode_score', new=lambda score, *args: score)
+def test_core_servicer_get_score_solution_results(response_mock):
+    instance = CoreServicer('/input', '/output', '/static', 0.5)
+    pipeline = MagicMock(cv_metric_scores=[[1, 0], [0.5, 0.25]])
+    metrics = [{'metric': 'first'}, {'metric': 'second'}]
+    session = {
+        'problem': {'inputs': [{'targets': 'targets', 'dataset_id': 'dataset-id'}]},
+        'allowed_value_types': [],
+        'configuration': MagicMock(random_seed=0),
+        'pipeline': pipeline,
+        'metrics': metrics,
+        'done': True,
+    }
+
+    with patch.object(instance, '_get_progress'):
+        instance._get_score_solution_results(session, 0)
+
+    scores = response_mock.call_args[1]['scores']
+    assert [(score['metric'], score['fold'], score['value']) for score in scores] == [
+        ({'metric': 'first'}, 0, 1),
+        ({'metric': 'first'}, 1, 0),
+        ({'metric': 'second'}, 0, 0.5),
+        ({'metric': 'second'}, 1, 0.25),
+    ]
+
+
+def test_core_servicer_get_fitted_solution():
+    instance = CoreServicer('/input', '/output', '/static', 0.5)
+    instance.fitted_solutions = MagicMock()
+    instance.fitted_solutions.get.return_value = None
+
+    with pytest.raises(ValueError):
+        instance._get_fitted_solution('test-id')
+
+    instance.fitted_solutions.get.return_value = 'runtime'
+    assert instance._get_fitted_solution('test-id') == 'runtime'
+    instance.fitted_solutions.get.assert_called_with('test-id')
+
+
+def test_core_servicer_collect_sessions():
+    instance = CoreServicer('/input', '/output', '/static', 0.5)
+    now = datetime.utcnow()
+    instance.DB['score_sessions'] = {
+        'expired': {'done': True, 'end': now - timedelta(days=1)},
+        'recent': {'done': True, 'end': now},
+        'running': {'start': now - timedelta(days=1)},
+        'invalid': {},
+    }
+    instance.DB['fit_sessions'] = {
+        'solution-id': {'done': True, 'end': now},
+        'other-id': {'done': True, 'end': now},
+    }
+    searcher = MagicMock(solutions=[{'id': 'old-solution-id'}])
+    instance.DB['search_sessions'] = {
+        'old': {'done': True, 'end': now - timedelta(days=1), 'searcher': searcher},
+    }
+    instance.DB['solutions']['old-solution-id'] = 'solution'
+    instance.fitted_solutions = MagicMock()
+
+    instance._collect_sessions()
+
+    assert set(instance.DB['score_sessions']) == {'recent', 'running'}
+    assert set(instance.DB['fit_sessions']) == {'solution-id', 'other-id'}
+
+    # the searches and their solutions are kept until they are ended
+    assert set(instance.DB['search_sessions']) == {'old'}
+    assert instance.DB['solutions']['old-solution-id'] == 'solution'
+    assert not searcher.close.called
+    assert not instance.fitted_solutions.delete.called
+
+    # ending the solutions
+    instance._collect_sessions(['solution-id', 'running'])
+
+    assert set(instance.DB['score_sessions']) == {'recent', 'running'}
+    assert set(instance.DB['fit_sessions']) == {'other-id'}
+
+    instance.DB.pop('score_sessions')
+    instance.DB.pop('fit_sessions')
+    instance.DB.pop('search_sessions')
+    instance.DB['solutions'].pop('old-solution-id')
+
+
+def test_core_servicer_get_memory_usage():
+    instance = CoreServicer('/input', '/output', '/static', 0.5)
+    searcher = MagicMock()
+    searcher.get_splits_size.return_value = 10
+    instance.DB['search_sessions'] = {
+        'search-id': {'searcher': searcher},
+        'invalid': {},
+    }
+
+    memory_usage = instance.get_memory_usage()
+
+    assert memory_usage['search_splits'] == 10
+    assert memory_usage['fitted_solutions_cache'] == 0
+    assert 'dataset_cache' in memory_usage
+    assert 'step_cache' in memory_usage
+
+    instance.DB.pop('search_sessions')
+
+
+@patch('ta2.ta3.core_servicer.threading.Thread')
+def test_core_servicer_start_sweeper(thread_mock):
+    instance = CoreServicer('/input', '/output', '/static', 0.5)
+
+    instance._start_sweeper()
+    instance._start_sweeper()
+
+    thread_mock.assert_called_once_with(target=instance._sweep, daemon=True)
+    thread_mock.return_value.start.assert_called_once_with()
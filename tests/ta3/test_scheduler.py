@@ -0,0 +1,119 @@
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from ta2.ta3.scheduler import SessionScheduler, get_max_running, parse_memory
+
+
+def test_parse_memory():
+    assert parse_memory('16') == 16 * 1024 ** 3
+    assert parse_memory(16) == 16 * 1024 ** 3
+    assert parse_memory('16Gi') == 16 * 1024 ** 3
+    assert parse_memory('512MB') == 512 * 1000 ** 2
+    assert parse_memory('0.5G') == 500 * 1000 ** 2
+
+    with pytest.raises(ValueError):
+        parse_memory('a lot')
+
+
+@patch.dict('os.environ', {'D3MCPU': '8', 'D3MRAM': '8Gi', 'TA2_MAX_SESSIONS': ''})
+@patch('ta2.ta3.scheduler.SESSION_RAM', new='2Gi')
+def test_get_max_running():
+    # limited by the memory
+    assert get_max_running() == 4
+
+    with patch.dict('os.environ', {'D3MRAM': '1Gi'}):
+        assert get_max_running() == 1
+
+    with patch.dict('os.environ', {'TA2_MAX_SESSIONS': '3'}):
+        assert get_max_running() == 3
+
+
+def test_sessionscheduler():
+    scheduler = SessionScheduler(max_running=1)
+    started = list()
+    release = threading.Event()
+    finished = threading.Semaphore(0)
+
+    def run(name):
+        started.append(name)
+        release.wait()
+        finished.release()
+
+    scheduler.submit(run, ('first', ))
+    scheduler.submit(run, ('low', ), priority=-1)
+    scheduler.submit(run, ('high', ), priority=1)
+    scheduler.submit(run, ('default', ))
+
+    # only one session runs at a time, the rest is queued
+    assert scheduler.running == 1
+    assert len(scheduler) == 3
+
+    release.set()
+    for _ in range(4):
+        assert finished.acquire(timeout=5)
+
+    assert started == ['first', 'high', 'default', 'low']
+
+
+def test_sessionscheduler_cancel():
+    scheduler = SessionScheduler(max_running=1)
+    started = list()
+    release = threading.Event()
+    finished = threading.Semaphore(0)
+
+    def run(name):
+        started.append(name)
+        release.wait()
+        finished.release()
+
+    running = scheduler.submit(run, ('running', ))
+    queued = scheduler.submit(run, ('queued', ))
+    scheduler.submit(run, ('other', ))
+
+    # only the queued sessions can be cancelled
+    assert not scheduler.cancel(running)
+    assert scheduler.cancel(queued)
+    assert not scheduler.cancel(queued)
+    assert len(scheduler) == 1
+
+    release.set()
+    for _ in range(2):
+        assert finished.acquire(timeout=5)
+
+    assert started == ['running', 'other']
+
+
+def test_sessionscheduler_reserved():
+    scheduler = SessionScheduler(max_running=2, reserved=1)
+    started = list()
+    release = threading.Event()
+    finished = threading.Semaphore(0)
+
+    def run(name):
+        started.append(name)
+        release.wait()
+        finished.release()
+
+    scheduler.submit(run, ('search', ))
+    scheduler.submit(run, ('queued-search', ), priority=1)
+    scheduler.submit(run, ('request', ), reserved=True)
+
+    # the searches can only use the slots that are not reserved
+    assert scheduler.running == 2
+    assert started == ['search', 'request']
+
+    # the reserved sessions start first and never go above the limit
+    scheduler.submit(run, ('other-request', ), reserved=True)
+    assert scheduler.running == 2
+    assert len(scheduler) == 2
+
+    release.set()
+    for _ in range(4):
+        assert finished.acquire(timeout=5)
+
+    assert started == ['search', 'request', 'other-request', 'queued-search']
+
+    # at least one slot is left for the rest
+    assert SessionScheduler(max_running=1, reserved=1).reserved == 0
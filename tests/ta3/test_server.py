@@ -3,12 +3,14 @@ from unittest.mock import MagicMock, patch
 from ta2.ta3.server import serve
 
 
+@patch('ta2.template.preload_templates')
 @patch('ta2.ta3.client.LOGGER.info')
 @patch('ta2.ta3.server.time.sleep')
-@patch('ta2.ta3.server.core_pb2_grpc.add_CoreServicer_to_server')
-@patch('ta2.ta3.server.grpc.server')
-@patch('ta2.ta3.server.core_servicer.CoreServicer')
-def test_serve(core_servicer_mock, grpc_server_mock, add_cs_to_server_mock, sleep_mock, logger_mock):
+@patch('ta3ta2_api.core_pb2_grpc.add_CoreServicer_to_server')
+@patch('grpc.server')
+@patch('ta2.ta3.core_servicer.CoreServicer')
+def test_serve(core_servicer_mock, grpc_server_mock, add_cs_to_server_mock, sleep_mock, logger_mock,
+               preload_mock):
     # mocks
     expected_value = MagicMock()
     grpc_server_mock.return_value = expected_value
@@ -23,9 +25,18 @@ def test_serve(core_servicer_mock, grpc_server_mock, add_cs_to_server_mock, slee
 
     # daemon=True
     return_value = serve(port, input_dir, output_dir, static_dir, timeout, debug, daemon=True)
-    core_servicer_mock.assert_called_once_with(input_dir, output_dir, static_dir, timeout, debug)
+    core_servicer_mock.assert_called_once_with(input_dir, output_dir, static_dir, timeout, debug, 1, 1, None, None, 'gp')
 
     assert return_value == expected_value
     assert grpc_server_mock.called
     assert not sleep_mock.called
     assert not logger_mock.called
+    preload_mock.assert_called_once_with(None)
+
+    # preloading the static files too
+    serve(port, input_dir, output_dir, static_dir, timeout, debug, daemon=True, preload_static=True)
+    preload_mock.assert_called_with(static_dir)
+
+    # without preloading
+    serve(port, input_dir, output_dir, static_dir, timeout, debug, daemon=True, preload=False)
+    assert preload_mock.call_count == 2
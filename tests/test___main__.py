@@ -1,7 +1,26 @@
+import subprocess
+import sys
 from unittest.mock import patch
 
+import pytest
+
 from ta2 import __main__
 
+# Modules that must not be imported just to parse the command line arguments
+HEAVY_MODULES = [
+    'btb',
+    'd3m',
+    'datamart_rest',
+    'grpc',
+    'numpy',
+    'pandas',
+    'sklearn',
+    'ta2.search',
+    'ta2.ta3.core_servicer',
+]
+
+MAX_IMPORT_SECONDS = 1
+
 
 @patch('ta2.__main__._server')
 @patch('ta2.__main__.parse_args')
@@ -23,3 +42,18 @@ def test_ta2_test(mock_parse_args, mock__ta2_test):
     # assert
     mock_parse_args.assert_called_once_with('ta2')
     mock__ta2_test.assert_called_once_with(mock_parse_args.return_value)
+
+
+@pytest.mark.parametrize('module', ['ta2.__main__', 'ta2.ta3.server'])
+def test_import_time(module):
+    code = (
+        'import sys, time\n'
+        'start = time.time()\n'
+        'import {}\n'
+        'print(time.time() - start)\n'
+        'print(",".join(name for name in {} if name in sys.modules))\n'
+    ).format(module, HEAVY_MODULES)
+    elapsed, imported = subprocess.check_output([sys.executable, '-c', code]).decode().splitlines()
+
+    assert imported == ''
+    assert float(elapsed) < MAX_IMPORT_SECONDS
@@ -0,0 +1,176 @@
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import pytest
+
+from ta2 import benchmark
+
+
+def test_load_matrix(tmpdir):
+    matrix_path = str(tmpdir.join('matrix.csv'))
+    pd.DataFrame([
+        {'dataset': 'a', 'template': 'a.yml', 'cv_score': 1},
+        {'dataset': 'a', 'template': 'a.yml', 'cv_score': 2},
+        {'dataset': 'b', 'template': None, 'cv_score': 3},
+    ]).to_csv(matrix_path, index=False)
+
+    assert benchmark.load_matrix(matrix_path) == [('a', 'a.yml'), ('b', None)]
+    assert benchmark.load_matrix(matrix_path, ['b']) == [('b', None)]
+
+
+def test_get_template_names(tmpdir):
+    tmpdir.join('existing.yml').write('')
+
+    with patch('ta2.benchmark.TEMPLATES_DIR', str(tmpdir)):
+        assert benchmark.get_template_names('existing.yml') == ['existing.yml']
+        assert benchmark.get_template_names('missing.yml') is None
+        assert benchmark.get_template_names(None) is None
+
+
+def _allocate(size):
+    return {'allocated': len(bytearray(size))}
+
+
+def _fail():
+    raise ValueError('failed')
+
+
+def test_run_isolated():
+    baseline = benchmark.run_isolated(_allocate, 0)['peak_rss_mb']
+    result = benchmark.run_isolated(_allocate, 100 * 1024 ** 2)
+
+    assert result['allocated'] == 100 * 1024 ** 2
+    assert result['peak_rss_mb'] >= baseline + 80
+
+    # measured apart from the ones that ran before
+    assert benchmark.run_isolated(_allocate, 0)['peak_rss_mb'] < baseline + 50
+
+    with pytest.raises(ValueError):
+        benchmark.run_isolated(_fail)
+
+
+def test_get_row():
+    metric = MagicMock()
+    metric.normalize.side_effect = lambda score: score / 2
+    problem = {'problem': {'performance_metrics': [{'metric': metric}]}}
+    result = {
+        'template': 'best.yml',
+        'cv_score': 0.8,
+        'test_score': 0.6,
+        'elapsed_time': timedelta(seconds=30),
+        'tuning_iterations': 5,
+        'peak_rss_mb': 100,
+    }
+
+    row = benchmark.get_row('a', 'a.yml', problem, result)
+
+    assert row == {
+        'dataset': 'a',
+        'template': 'a.yml',
+        'best_template': 'best.yml',
+        'cv_score': 0.8,
+        'test_score': 0.6,
+        'normalized_cv_score': 0.4,
+        'normalized_test_score': 0.3,
+        'elapsed_time': 30,
+        'tuning_iterations': 5,
+        'iterations_per_minute': 10,
+        'peak_rss_mb': 100,
+        'fallback': False,
+        'error': None,
+    }
+
+    # the template was not found
+    assert benchmark.get_row('a', 'a.yml', problem, result, fallback=True)['fallback']
+
+
+def test_compare():
+    baseline = pd.DataFrame([
+        {'dataset': 'a', 'template': 't', 'normalized_cv_score': 0.8, 'elapsed_time': 10.0,
+         'iterations_per_minute': 10.0, 'peak_rss_mb': 100.0, 'error': None},
+        {'dataset': 'b', 'template': 't', 'normalized_cv_score': 0.8, 'elapsed_time': 10.0,
+         'iterations_per_minute': 10.0, 'peak_rss_mb': 100.0, 'error': None},
+        {'dataset': 'c', 'template': 't', 'normalized_cv_score': 0.8, 'elapsed_time': 10.0,
+         'iterations_per_minute': 10.0, 'peak_rss_mb': 100.0, 'error': None},
+        {'dataset': 'e', 'template': 't', 'normalized_cv_score': 0.8, 'elapsed_time': 10.0,
+         'iterations_per_minute': 10.0, 'peak_rss_mb': 100.0, 'error': None},
+    ])
+    report = pd.DataFrame([
+        # within the tolerance
+        {'dataset': 'a', 'template': 't', 'normalized_cv_score': 0.75, 'elapsed_time': 10.5,
+         'iterations_per_minute': 9.5, 'peak_rss_mb': 105.0, 'error': None},
+        # worse on everything
+        {'dataset': 'b', 'template': 't', 'normalized_cv_score': 0.6, 'elapsed_time': 12.0,
+         'iterations_per_minute': 8.0, 'peak_rss_mb': 120.0, 'error': None},
+        # new error
+        {'dataset': 'c', 'template': 't', 'normalized_cv_score': None, 'elapsed_time': 1.0,
+         'iterations_per_minute': None, 'peak_rss_mb': 100.0, 'error': 'ValueError: failed'},
+        # not in the baseline
+        {'dataset': 'd', 'template': 't', 'normalized_cv_score': 0.1, 'elapsed_time': 100.0,
+         'iterations_per_minute': 1.0, 'peak_rss_mb': 1000.0, 'error': None},
+        # searched with the default templates
+        {'dataset': 'e', 'template': 't', 'normalized_cv_score': 0.1, 'elapsed_time': 100.0,
+         'iterations_per_minute': 1.0, 'peak_rss_mb': 1000.0, 'fallback': True, 'error': None},
+    ])
+
+    regressions = benchmark.compare(report, baseline, tolerance=0.1)
+
+    assert regressions[['dataset', 'column']].values.tolist() == [
+        ['b', 'normalized_cv_score'],
+        ['b', 'elapsed_time'],
+        ['b', 'iterations_per_minute'],
+        ['b', 'peak_rss_mb'],
+        ['c', 'error'],
+    ]
+
+
+def test_compare_missing_columns():
+    baseline = pd.DataFrame([
+        {'dataset': 'a', 'template': 't', 'cv_score': 0.8, 'elapsed_time': 10.0},
+    ])
+    report = pd.DataFrame([
+        {'dataset': 'a', 'template': 't', 'cv_score': 0.1, 'normalized_cv_score': 0.1,
+         'elapsed_time': 20.0, 'error': None},
+    ])
+
+    regressions = benchmark.compare(report, baseline)
+
+    assert regressions[['dataset', 'column']].values.tolist() == [['a', 'elapsed_time']]
+
+
+def test_normalize_baseline():
+    metric = MagicMock()
+    metric.normalize.side_effect = lambda score: score / 2
+    baseline = pd.DataFrame([
+        {'dataset': 'a', 'template': 't', 'cv_score': 0.8, 'test_score': None},
+        {'dataset': 'b', 'template': 't', 'cv_score': 0.6, 'test_score': 0.4},
+    ])
+
+    normalized = benchmark.normalize_baseline(baseline, {'a': metric})
+
+    assert normalized.normalized_cv_score[0] == 0.4
+    assert normalized[['normalized_test_score']].isnull().all().all()
+    assert pd.isnull(normalized.normalized_cv_score[1])
+    assert 'normalized_cv_score' not in baseline
+
+    # the normalized scores of the baseline are kept
+    assert benchmark.normalize_baseline(normalized, {'b': metric}).equals(normalized)
+
+
+def test_merge_baseline():
+    baseline = pd.DataFrame([
+        {'dataset': 'a', 'template': 't', 'cv_score': 0.8},
+        {'dataset': 'b', 'template': 't', 'cv_score': 0.8},
+    ])
+    report = pd.DataFrame([
+        {'dataset': 'a', 'template': 't', 'cv_score': 0.1, 'fallback': False},
+        {'dataset': 'b', 'template': 't', 'cv_score': 0.1, 'fallback': True},
+    ])
+
+    merged = benchmark.merge_baseline(report, baseline)
+    assert merged.dataset.tolist() == ['a']
+
+    # nothing to compare if all the templates fell back
+    report['fallback'] = True
+    assert benchmark.merge_baseline(report, baseline).empty
@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+from unittest.mock import patch
+
+import numpy as np
+
+from ta2.cache import _DATASET_LOCKS, DATASET_CACHE, KeyLocks, SpillCache, StepCache, get_size, load_dataset
+
+
+class _Model:
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.model = self
+
+
+def test_get_size():
+    array = np.zeros(10, dtype=np.int64)
+
+    assert get_size(array) == 80
+    assert get_size([array, array]) == 160
+    assert get_size({'a': array}) == 80
+
+    # the attributes of other objects, even with cycles
+    assert get_size(_Model(array)) > 80
+
+
+def test_stepcache():
+    array = np.zeros(10, dtype=np.int64)
+    cache = StepCache(max_size=200)
+
+    assert cache.get('a') is None
+
+    cache.set('a', array)
+    cache.set('b', array)
+    assert cache.size == 160
+    assert cache.get('a') is array
+
+    # b is the least recently used
+    cache.set('c', array)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+    assert cache.size == 160
+
+    # above the maximum size
+    cache.set('d', np.zeros(100, dtype=np.int64))
+    assert 'd' not in cache
+    assert len(cache) == 2
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.size == 0
+
+
+def test_keylocks():
+    locks = KeyLocks()
+    release = threading.Event()
+    entered = list()
+
+    def hold(name):
+        with locks.hold('key'):
+            entered.append(name)
+            release.wait()
+
+    first = threading.Thread(target=hold, args=('first', ))
+    second = threading.Thread(target=hold, args=('second', ))
+    first.start()
+    second.start()
+
+    # the same key is only held once at a time
+    time.sleep(0.1)
+    assert len(entered) == 1
+    assert len(locks) == 1
+
+    with locks.hold('other'):
+        assert len(locks) == 2
+
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    # and forgotten once it is not needed
+    assert sorted(entered) == ['first', 'second']
+    assert len(locks) == 0
+
+
+def test_spillcache(tmp_path):
+    spill_dir = str(tmp_path / 'spill')
+    cache = SpillCache(spill_dir, max_size=1500)
+
+    assert cache.get('a') is None
+    assert 'a' not in cache
+
+    first = np.zeros(100, dtype=np.int64)
+    second = np.ones(100, dtype=np.int64)
+    cache.set('a', first)
+    assert not os.path.exists(spill_dir)
+
+    # only the one evicted from memory is pickled
+    cache.set('b', second)
+    assert len(os.listdir(spill_dir)) == 1
+    assert 'a' in cache
+    assert cache.get('b') is second
+
+    loaded = cache.get('a')
+    assert loaded is not first
+    assert (loaded == first).all()
+    assert cache.get('a') is loaded
+    assert len(os.listdir(spill_dir)) == 2
+
+    # values that cannot be pickled are kept in memory
+    unpicklable = lambda: None  # noqa: E731
+    cache.set('c', unpicklable)
+    cache.set('d', np.zeros(150, dtype=np.int64))
+    assert cache.get('c') is unpicklable
+
+    # deleted from memory and disk
+    cache.delete('a')
+    assert 'a' not in cache
+    assert cache.get('a') is None
+
+
+def test_spillcache_persistent(tmp_path):
+    spill_dir = str(tmp_path / 'spill')
+    cache = SpillCache(spill_dir, max_size=1500, persistent=True)
+
+    value = np.zeros(100, dtype=np.int64)
+    cache.set('a', value)
+
+    # pickled right away, so other caches can load it
+    assert len(os.listdir(spill_dir)) == 1
+    assert cache.get('a') is value
+    assert (SpillCache(spill_dir).get('a') == value).all()
+
+
+def test_spillcache_max_disk_size(tmp_path):
+    spill_dir = str(tmp_path / 'spill')
+    cache = SpillCache(spill_dir, persistent=True, max_disk_size=4000)
+
+    cache.set('a', np.zeros(200, dtype=np.int64))
+    cache.set('b', np.zeros(200, dtype=np.int64))
+    os.utime(cache._get_path('a'), (0, 0))
+    os.utime(cache._get_path('b'), (1, 1))
+
+    # loaded from disk, so used after the other one
+    assert SpillCache(spill_dir, max_disk_size=4000).get('a') is not None
+
+    # the one used least recently is removed
+    cache.set('c', np.zeros(200, dtype=np.int64))
+    assert len(os.listdir(spill_dir)) == 2
+    assert not os.path.exists(cache._get_path('b'))
+
+
+@patch('ta2.cache.Dataset.load')
+def test_load_dataset(load_mock, tmp_path):
+    DATASET_CACHE.clear()
+    load_mock.side_effect = lambda uri: {'uri': uri}
+
+    dataset_doc = tmp_path / 'datasetDoc.json'
+    dataset_doc.write_text('{}')
+    tables = tmp_path / 'tables'
+    tables.mkdir()
+    learning_data = tables / 'learningData.csv'
+    learning_data.write_text('d3mIndex\n0\n')
+    dataset_uri = 'file://' + str(dataset_doc)
+
+    dataset = load_dataset(dataset_uri)
+    assert load_dataset(dataset_uri) is dataset
+    assert load_mock.call_count == 1
+    assert len(_DATASET_LOCKS) == 0
+
+    # the data files changed
+    learning_data.write_text('d3mIndex\n0\n1\n')
+    os.utime(str(learning_data), ns=(0, 0))
+    assert load_dataset(dataset_uri) is not dataset
+    assert load_mock.call_count == 2
+
+    # only the folder of the media files is checked
+    media = tmp_path / 'media'
+    media.mkdir()
+    image = media / 'image.png'
+    image.write_text('image')
+    dataset = load_dataset(dataset_uri)
+    assert load_mock.call_count == 3
+
+    image.write_text('other image')
+    os.utime(str(image), ns=(0, 0))
+    assert load_dataset(dataset_uri) is dataset
+
+    (media / 'new_image.png').write_text('image')
+    os.utime(str(media), ns=(0, 0))
+    assert load_dataset(dataset_uri) is not dataset
+    assert load_mock.call_count == 4
+
+    # not a local file
+    load_dataset('http://example.com/datasetDoc.json')
+    load_dataset('http://example.com/datasetDoc.json')
+    assert load_mock.call_count == 6
+
+    DATASET_CACHE.clear()
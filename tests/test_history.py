@@ -0,0 +1,52 @@
+import numpy as np
+
+from ta2.history import SearchHistory, get_distance
+
+SMALL = {'data_modality': 'single_table', 'task_type': 'classification', 'rows': 100, 'columns': 5}
+BIG = {'data_modality': 'single_table', 'task_type': 'classification', 'rows': 100000, 'columns': 5}
+REGRESSION = {'data_modality': 'single_table', 'task_type': 'regression', 'rows': 100, 'columns': 5}
+
+
+def test_get_distance():
+    assert get_distance(SMALL, SMALL) == 0
+    assert get_distance(SMALL, REGRESSION) == np.inf
+    assert 0 < get_distance(SMALL, dict(SMALL, rows=200)) < get_distance(SMALL, BIG)
+
+
+def test_searchhistory(tmp_path):
+    history = SearchHistory(str(tmp_path / 'history' / 'search_history.jsonl'))
+    assert history.load() == []
+
+    history.add('small', SMALL, 'template', {('0', 'a'): np.int64(1)}, 0.5, 1.5)
+    history.add('small', SMALL, 'template', {('0', 'a'): 2}, 0.7, 2.5)
+    history.add('big', BIG, 'template', {('0', 'a'): 3}, 0.9, 10.0)
+    history.add('regression', REGRESSION, 'template', {('0', 'a'): 4}, 1.0, 1.0)
+
+    records = history.load()
+    assert len(records) == 4
+    assert records[0] == {
+        'dataset': 'small',
+        'meta_features': SMALL,
+        'template': 'template',
+        'hyperparameters': {('0', 'a'): 1},
+        'normalized_score': 0.5,
+        'elapsed': 1.5,
+    }
+
+    # the best records of the nearest dataset, skipping other task types
+    nearest = history.get_nearest(dict(SMALL, rows=150), datasets=1, max_records=1)
+    assert [record['hyperparameters'] for record in nearest] == [{('0', 'a'): 2}]
+
+    nearest = history.get_nearest(SMALL)
+    assert [record['dataset'] for record in nearest] == ['big', 'small', 'small']
+
+
+def test_searchhistory_incomplete_line(tmp_path):
+    path = tmp_path / 'search_history.jsonl'
+    history = SearchHistory(str(path))
+    history.add('small', SMALL, 'template', {}, 0.5, 1.5)
+
+    with open(str(path), 'a') as history_file:
+        history_file.write('{"dataset": "sm')
+
+    assert len(history.load()) == 1
@@ -0,0 +1,50 @@
+from unittest.mock import MagicMock
+
+import pandas as pd
+
+from ta2.metafeatures import CATEGORICAL, TEXT, get_learning_data, get_meta_features
+
+
+def test_get_learning_data():
+    learning_data = pd.DataFrame({'a': [1, 2, 3]})
+    other = pd.DataFrame({'b': [1, 2, 3, 4]})
+
+    assert get_learning_data({'0': other, 'learningData': learning_data}) == ('learningData', learning_data)
+    assert get_learning_data({'0': learning_data, '1': other}) == ('1', other)
+    assert get_learning_data({'0': ['not', 'a', 'table']}) == (None, None)
+
+
+def test_get_meta_features_no_tables():
+    meta_features = get_meta_features({}, 'graph', 'link_prediction')
+
+    assert meta_features == {'data_modality': 'graph', 'task_type': 'link_prediction'}
+
+
+def test_get_meta_features():
+    learning_data = pd.DataFrame({
+        'd3mIndex': ['0', '1', '2', '3'],
+        'color': ['red', '', 'blue', 'red'],
+        'description': ['a', 'b', '', 'd'],
+        'class': ['0', '1', '2', '1'],
+    })
+    semantic_types = [(), (CATEGORICAL, ), (TEXT, ), (CATEGORICAL, )]
+
+    class Dataset(dict):
+        metadata = MagicMock()
+
+    dataset = Dataset(learningData=learning_data)
+    dataset.metadata.query.side_effect = lambda selector: {'semantic_types': semantic_types[selector[2]]}
+    targets = [{'resource_id': 'learningData', 'column_index': 3}]
+
+    meta_features = get_meta_features(dataset, 'single_table', 'classification', targets)
+
+    assert meta_features == {
+        'data_modality': 'single_table',
+        'task_type': 'classification',
+        'rows': 4,
+        'columns': 4,
+        'categorical_ratio': 1 / 3,
+        'text_columns': True,
+        'missing_ratio': 2 / 16,
+        'target_cardinality': 3,
+    }
@@ -1,13 +1,19 @@
 import json
+import time
 from collections import defaultdict
 from datetime import timedelta
 from unittest.mock import MagicMock, call, mock_open, patch
 
 import numpy as np
+import pandas as pd
 import pytest
 from d3m.metadata.base import Context
 
-from ta2.search import PIPELINES_DIR, PipelineSearcher, to_dicts
+from ta2.cache import SpillCache, StepCache
+from ta2.search import (
+    PIPELINES_DIR, PipelineSearcher, Templates, _cached_fit_produce, _init_step_cache,
+    split_pipeline, to_dicts)
+from ta2.workers import Shared
 
 
 def test_to_dicts():
@@ -41,6 +47,33 @@ def test_to_dicts():
     assert result == expected_hyperparams
 
 
+@patch('ta2.search.STEP_CACHE', new=StepCache())
+@patch('ta2.search._fit_produce')
+@patch('ta2.search.split_pipeline')
+def test_cached_fit_produce_random_seed(split_pipeline_mock, fit_produce_mock):
+    prefix = MagicMock()
+    prefix.to_json_structure.return_value = {'steps': []}
+    suffix = MagicMock()
+    split_pipeline_mock.return_value = (prefix, ['steps.1.produce'], suffix)
+    fit_produce_mock.return_value = ({'outputs.0': 'train'}, {'outputs.0': 'test'})
+    pipeline = MagicMock(prefix_steps=2)
+
+    _cached_fit_produce(pipeline, 'problem', 'fold', 'train', 'test', 10, None)
+
+    # the suffix steps keep the seeds of their position in the whole pipeline
+    assert fit_produce_mock.call_args_list == [
+        call(prefix, 'problem', ['train'], ['test'], 10, None),
+        call(suffix, 'problem', ['train'], ['test'], 12, None),
+    ]
+
+
+def test_split_pipeline_out_of_range():
+    pipeline = MagicMock(steps=[MagicMock(), MagicMock()])
+
+    assert split_pipeline(pipeline, 0) is None
+    assert split_pipeline(pipeline, 2) is None
+
+
 @patch('ta2.search.Pipeline.from_yaml')
 @patch('ta2.search.os.makedirs')
 def test_pipelinesearcher_defaults(makedirs_mock, from_yaml_mock):
@@ -56,6 +89,13 @@ def test_pipelinesearcher_defaults(makedirs_mock, from_yaml_mock):
     assert instance.input == 'input'
     assert instance.output == 'output'
     assert not instance.dump
+    assert instance.n_workers == 1
+    assert instance.fold_workers == 1
+    assert instance.halving is None
+    assert instance.abort_margin is None
+    assert instance.tuner == 'gp'
+    assert not instance.isolated
+    assert instance.history.path == 'output/search_history.jsonl'
     assert instance.ranked_dir == 'output/pipelines_ranked'
     assert instance.scored_dir == 'output/pipelines_scored'
     assert instance.searched_dir == 'output/pipelines_searched'
@@ -154,15 +194,21 @@ def test_pipelinesearcher_load_pipeline(json_loader_mock, yaml_loader_mock):
     assert json_loader_mock.call_count == 2
 
 
-@patch('ta2.search.d3m_evaluate')
+@patch('ta2.search.unshare')
+@patch('ta2.search.evaluate_folds')
+@patch('ta2.search.prepare_data')
 @patch('ta2.search.Pipeline.from_yaml', new=MagicMock())
-def test_pipelinesearcher_score_pipeline(evaluate_mock):
+def test_pipelinesearcher_score_pipeline(prepare_data_mock, evaluate_mock, unshare_mock):
     instance = PipelineSearcher()
     expected_scores = [MagicMock(value=[1])]
-    evaluate_mock.return_value = (expected_scores, expected_scores)
+    evaluate_mock.return_value = expected_scores
+
+    folds_outputs = [['train'], ['test'], ['score']]
+    prepare_data_mock.return_value = (folds_outputs, MagicMock())
 
     # parameters
-    dataset = {}
+    dataset = MagicMock()
+    dataset.metadata.query.return_value = {'id': 'dataset-id', 'digest': 'dataset-digest'}
     problem = {'problem': {'performance_metrics': None}}
     pipeline_mock = MagicMock()
     metrics = {'test': 'metric'}
@@ -184,24 +230,30 @@ def test_pipelinesearcher_score_pipeline(evaluate_mock):
         folds=folds, stratified=stratified, shuffle=shuffle
     )
 
-    evaluate_mock.assert_called_with(
-        pipeline_mock,
+    prepare_data_mock.assert_called_once_with(
         instance.data_pipeline,
-        instance.scoring_pipeline,
         problem,
         [dataset],
         data_params,            # folds, stratified, shuffle
-        metrics,                # custom metrics
         context=Context.TESTING,
         random_seed=random_seed,
-        data_random_seed=random_seed,
-        scoring_random_seed=random_seed,
         volumes_dir=instance.static
     )
+    splits = evaluate_mock.call_args[0][3]
+    evaluate_mock.assert_called_with(
+        pipeline_mock,
+        instance.scoring_pipeline,
+        problem,
+        splits,
+        metrics,                # custom metrics
+        random_seed=random_seed,
+        volumes_dir=instance.static
+    )
+    assert [split[1:] for split in splits] == [('train', 'test', 'score')]
 
     assert pipeline_mock.cv_scores == [score.value[0] for score in expected_scores]
 
-    # with problem metrics
+    # with problem metrics, reusing the splits
 
     instance.score_pipeline(
         dataset, problem, pipeline_mock,
@@ -209,23 +261,289 @@ def test_pipelinesearcher_score_pipeline(evaluate_mock):
         folds=folds, stratified=stratified, shuffle=shuffle
     )
 
+    assert prepare_data_mock.call_count == 1
     evaluate_mock.assert_called_with(
         pipeline_mock,
-        instance.data_pipeline,
         instance.scoring_pipeline,
         problem,
-        [dataset],
-        data_params,                               # folds, stratified, shuffle
+        splits,
         problem['problem']['performance_metrics'],  # problem metrics
-        context=Context.TESTING,
         random_seed=random_seed,
-        data_random_seed=random_seed,
-        scoring_random_seed=random_seed,
         volumes_dir=instance.static
     )
 
     assert pipeline_mock.cv_scores == [score.value[0] for score in expected_scores]
 
+    # with a different fold configuration
+    instance.score_pipeline(dataset, problem, pipeline_mock, folds=3)
+
+    assert prepare_data_mock.call_count == 2
+
+    # the least recently used splits are forgotten
+    instance.score_pipeline(dataset, problem, pipeline_mock, folds=4)
+
+    assert prepare_data_mock.call_count == 3
+    assert len(instance._splits) == 2
+
+    # they were never shared, since the folds were evaluated in this process
+    assert not unshare_mock.called
+
+
+@patch('ta2.search.evaluate_folds')
+@patch('ta2.search.prepare_data')
+@patch('ta2.search.Pipeline.from_yaml', new=MagicMock())
+def test_pipelinesearcher_score_pipeline_metrics(prepare_data_mock, evaluate_mock):
+    instance = PipelineSearcher()
+    # one row per metric in the scores of each fold
+    evaluate_mock.return_value = [MagicMock(value=[1, 0.5]), MagicMock(value=[0, 0.25])]
+    prepare_data_mock.return_value = ([['train'] * 2, ['test'] * 2, ['score'] * 2], MagicMock())
+
+    dataset = MagicMock()
+    dataset.metadata.query.return_value = {'id': 'dataset-id', 'digest': 'dataset-digest'}
+    problem = {'problem': {'performance_metrics': None}}
+    pipeline_mock = MagicMock()
+    metrics = [{'metric': 'first'}, {'metric': 'second'}]
+
+    instance.score_pipeline(dataset, problem, pipeline_mock, metrics=metrics)
+
+    assert evaluate_mock.call_count == 1
+    assert evaluate_mock.call_args[0][4] == metrics
+    assert pipeline_mock.cv_metric_scores == [[1, 0], [0.5, 0.25]]
+    assert pipeline_mock.cv_scores == [1, 0]
+    assert pipeline_mock.score == 0.5
+
+
+@patch('ta2.search.evaluate_folds')
+@patch('ta2.search.prepare_data')
+@patch('ta2.search.Pipeline.from_yaml', new=MagicMock())
+def test_pipelinesearcher_score_pipeline_folds(prepare_data_mock, evaluate_mock):
+    instance = PipelineSearcher()
+    evaluate_mock.side_effect = lambda pipeline, scoring, problem, splits, *args, **kwargs: [
+        MagicMock(value=[0.5]) for split in splits
+    ]
+    prepare_data_mock.return_value = ([['train'] * 5, ['test'] * 5, ['score'] * 5], MagicMock())
+
+    dataset = MagicMock()
+    dataset.metadata.query.return_value = {'id': 'dataset-id', 'digest': 'dataset-digest'}
+    metric = MagicMock()
+    metric.normalize.side_effect = lambda score: score
+    problem = {'problem': {'performance_metrics': [{'metric': metric}]}}
+    pipeline = MagicMock(partial=False)
+
+    # only the first folds
+    instance.score_pipeline(dataset, problem, pipeline, max_folds=2)
+
+    assert pipeline.cv_scores == [0.5, 0.5]
+    assert pipeline.partial
+
+    # resumed from the third fold
+    instance.score_pipeline(dataset, problem, pipeline)
+
+    assert len(evaluate_mock.call_args[0][3]) == 3
+    assert pipeline.cv_scores == [0.5] * 5
+    assert not pipeline.partial
+    assert not pipeline.aborted
+
+    # aborted after the first fold
+    pipeline = MagicMock(partial=False)
+    instance.score_pipeline(dataset, problem, pipeline, abort_below=0.6)
+
+    assert pipeline.cv_scores == [0.5]
+    assert pipeline.partial
+    assert pipeline.aborted
+
+
+@patch('ta2.search.evaluate_folds')
+@patch('ta2.search.prepare_data')
+@patch('ta2.search.Pipeline.from_yaml', new=MagicMock())
+def test_pipelinesearcher_score_pipeline_evaluation_cache(prepare_data_mock, evaluate_mock, tmp_path):
+    instance = PipelineSearcher()
+    instance.evaluation_cache = SpillCache(str(tmp_path), persistent=True)
+
+    def evaluate(pipeline, scoring, problem, splits, *args, **kwargs):
+        time.sleep(0.01 * len(splits))
+        return [pd.DataFrame({'metric': ['ACCURACY'], 'value': [0.5]}) for split in splits]
+
+    evaluate_mock.side_effect = evaluate
+    prepare_data_mock.return_value = ([['train'] * 5, ['test'] * 5, ['score'] * 5], MagicMock())
+
+    dataset = MagicMock()
+    dataset.metadata.query.return_value = {'id': 'dataset-id', 'digest': 'dataset-digest'}
+    problem = {'id': 'problem-id', 'problem': {'performance_metrics': None}}
+    metrics = [{'metric': 'ACCURACY'}]
+    structure = {'id': 'pipeline-id', 'steps': [{'primitive': {'python_path': 'a.primitive'}}]}
+    pipeline = MagicMock(partial=False)
+    pipeline.to_json_structure.return_value = structure
+
+    instance.score_pipeline(dataset, problem, pipeline, metrics=metrics, max_folds=2)
+    assert evaluate_mock.call_count == 1
+
+    # the same pipeline with another id only evaluates the folds not scored before
+    other = MagicMock(partial=False)
+    other.to_json_structure.return_value = dict(structure, id='other-id')
+    instance.score_pipeline(dataset, problem, other, metrics=metrics)
+
+    assert evaluate_mock.call_count == 2
+    assert len(evaluate_mock.call_args[0][3]) == 3
+    assert other.cv_scores == [0.5] * 5
+
+    # the scores are kept on disk, with the time that they took
+    instance.evaluation_cache = SpillCache(str(tmp_path), persistent=True)
+    instance.score_pipeline(dataset, problem, other, metrics=metrics)
+
+    assert evaluate_mock.call_count == 2
+    assert other.cv_scores == [0.5] * 5
+    assert other.elapsed >= 0.05
+
+    # another metric
+    instance.score_pipeline(dataset, problem, other, metrics=[{'metric': 'F1'}])
+
+    assert evaluate_mock.call_count == 3
+
+    # another version of the primitive
+    newer = MagicMock(partial=False)
+    newer.to_json_structure.return_value = {
+        'id': 'newer-id',
+        'steps': [{'primitive': {'python_path': 'a.primitive', 'version': '2.0'}}],
+    }
+    instance.score_pipeline(dataset, problem, newer, metrics=metrics)
+
+    assert evaluate_mock.call_count == 4
+
+
+@patch('ta2.search.STEP_CACHE_SIZE', new=1000)
+@patch('ta2.search.STEP_CACHE', new_callable=StepCache)
+def test_init_step_cache(step_cache):
+    step_cache.set('inherited', 'value', 10)
+
+    _init_step_cache(4)
+
+    # each worker only gets its part of the budget
+    assert step_cache.max_size == 250
+    assert 'inherited' not in step_cache
+
+
+@patch('ta2.search.unshare', new=MagicMock())
+@patch('ta2.search.share', new=lambda split: ('shared', ) + split)
+@patch('ta2.search.WorkerPool')
+@patch('ta2.search.prepare_data')
+@patch('ta2.search.evaluate_folds')
+@patch('ta2.search.Pipeline.from_yaml', new=MagicMock())
+def test_pipelinesearcher_score_pipeline_fold_workers(evaluate_mock, prepare_data_mock, pool_mock):
+    instance = PipelineSearcher(fold_workers=3)
+    expected_scores = [MagicMock(value=[1]), MagicMock(value=[0])]
+
+    folds = [['train-1', 'train-2'], ['test-1', 'test-2'], ['score-1', 'score-2']]
+    prepare_data_mock.return_value = (folds, MagicMock())
+    pool_mock.return_value.map.return_value = expected_scores
+
+    dataset = MagicMock()
+    dataset.metadata.query.return_value = {'id': 'dataset-id', 'digest': 'dataset-digest'}
+    problem = {'problem': {'performance_metrics': None}}
+    pipeline_mock = MagicMock()
+    metrics = {'test': 'metric'}
+
+    instance.score_pipeline(dataset, problem, pipeline_mock, metrics=metrics)
+
+    assert not evaluate_mock.called
+    pool_mock.assert_called_once_with(3, _init_step_cache, (3, ))
+
+    # the workers get references to the shared splits
+    (function, arguments), _ = pool_mock.return_value.map.call_args
+    assert [args[3][2:] for args in arguments] == [
+        ('train-1', 'test-1', 'score-1'),
+        ('train-2', 'test-2', 'score-2'),
+    ]
+    assert all(args[3][0] == 'shared' for args in arguments)
+    assert arguments[0][3][1] != arguments[1][3][1]     # fold keys
+    assert pipeline_mock.cv_scores == [1, 0]
+    assert pipeline_mock.score == 0.5
+
+    # nothing else uses the pool
+    pool_mock.return_value.terminate.assert_called_once_with()
+
+    # kept between the candidates of a search
+    instance.evaluation_cache = None
+    instance._searching = True
+    instance.score_pipeline(dataset, problem, pipeline_mock, metrics=metrics)
+    assert pool_mock.call_count == 2
+    assert pool_mock.return_value.terminate.call_count == 1
+
+    instance._searching = False
+    instance.close()
+    assert pool_mock.return_value.terminate.call_count == 2
+
+
+@patch('ta2.search.unshare')
+@patch('ta2.search.share', new=lambda split: split)
+@patch('ta2.search.prepare_data')
+@patch('ta2.search.Pipeline.from_yaml', new=MagicMock())
+def test_pipelinesearcher_splits_in_use(prepare_data_mock, unshare_mock):
+    instance = PipelineSearcher()
+    prepare_data_mock.return_value = ([['train'], ['test'], ['score']], MagicMock())
+
+    dataset = MagicMock()
+    dataset.metadata.query.return_value = {'id': 'dataset-id', 'digest': 'dataset-digest'}
+    problem = {'id': 'problem-id'}
+
+    in_use = instance._get_splits(dataset, problem, {'folds': 1}, 0)
+    released = instance._get_splits(dataset, problem, {'folds': 2}, 0)
+
+    # only shared when a worker process needs them
+    assert in_use.shared is None
+    instance._get_shared_splits(in_use)
+    instance._get_shared_splits(released)
+    assert len(in_use.shared) == 1
+
+    instance._release_splits(released)
+
+    # evicted, but only the ones not in use stop being shared
+    instance.clear_splits()
+    assert unshare_mock.call_count == 1
+    assert not instance._splits
+
+    instance._release_splits(in_use)
+    assert unshare_mock.call_count == 2
+
+
+@patch('ta2.search.SUBPROCESS_POOL')
+@patch('ta2.search.prepare_data')
+@patch('ta2.search.evaluate_folds')
+@patch('ta2.search.Pipeline.from_yaml', new=MagicMock())
+def test_pipelinesearcher_score_pipeline_subprocess(evaluate_mock, prepare_data_mock, pool_mock):
+    instance = PipelineSearcher()
+    pool_mock.run.return_value = [MagicMock(value=[1])]
+    evaluate_mock.return_value = [MagicMock(value=[0])]
+    prepare_data_mock.return_value = ([['train'], ['test'], ['score']], MagicMock())
+
+    dataset = MagicMock()
+    dataset.metadata.query.return_value = {'id': 'dataset-id', 'digest': 'dataset-digest'}
+    problem = {'problem': {'performance_metrics': None}}
+    pipeline_mock = MagicMock()
+    pipeline_mock.to_json_structure.return_value = {
+        'steps': [
+            {'primitive': {'python_path': 'd3m.primitives.natural_language_processing.lda.Fastlvm'}}
+        ]
+    }
+
+    instance.score_pipeline(dataset, problem, pipeline_mock)
+
+    assert not evaluate_mock.called
+    (function, pipeline, _, _, splits, _), _ = pool_mock.run.call_args
+    assert function == evaluate_mock
+    assert pipeline == pipeline_mock
+    assert all(isinstance(split, Shared) for split in splits)
+    assert pipeline_mock.cv_scores == [1]
+
+    # already isolated, evaluating again
+    instance.isolated = True
+    instance.evaluation_cache = None
+    instance.score_pipeline(dataset, problem, pipeline_mock)
+
+    assert evaluate_mock.call_count == 1
+    assert pool_mock.run.call_count == 1
+    assert pipeline_mock.cv_scores == [0]
+
 
 @patch('ta2.search.datetime')
 @patch('ta2.search.Pipeline.from_yaml', new=MagicMock())
@@ -255,10 +573,29 @@ def test_pipelinesearcher_check_stop(datetime_mock):
 
 
 @patch('ta2.search.Pipeline.from_yaml', new=MagicMock())
+@patch('ta2.search.get_meta_features', new=MagicMock(return_value={}))
+@patch('ta2.search.detect_data_modality', new=MagicMock(return_value='single_table'))
+@patch('ta2.search.load_dataset', new=MagicMock())
+@patch('ta2.search.Pipeline.from_yaml', new=MagicMock())
+def test_pipelinesearcher_search_stopped_before_start():
+    instance = PipelineSearcher()
+    instance._get_dataset_details = MagicMock(return_value=('dataset', 'file:///datasetDoc.json'))
+    instance.get_data_augmentation = MagicMock(return_value=None)
+    instance.score_pipeline = MagicMock()
+
+    # stopped while it was queued
+    instance.stop()
+    result = instance.search(MagicMock(), timeout=10)
+
+    assert not instance.score_pipeline.called
+    assert result['pipeline'] is None
+    assert instance.done
+
+
 def test_pipelinesearcher_stop():
     instance = PipelineSearcher()
 
-    assert not hasattr(instance, '_stop')
+    assert instance._stop is False
 
     # setting _stop
     instance.stop()
@@ -270,7 +607,7 @@ def test_pipelinesearcher_setup_search():
     instance = PipelineSearcher()
 
     assert hasattr(instance, 'solutions')
-    assert not hasattr(instance, '_stop')
+    assert instance._stop is False
     assert not hasattr(instance, 'done')
     assert not hasattr(instance, 'start_time')
     assert not hasattr(instance, 'timeout')
@@ -293,3 +630,169 @@ def test_pipelinesearcher_setup_search():
 
     assert instance.timeout == 0.5
     assert instance.max_end_time == instance.start_time + timedelta(seconds=0.5)
+
+    # a stop requested before the search started is kept
+    instance.stop()
+    instance.setup_search()
+
+    assert instance._stop is True
+
+
+@patch('ta2.search.Pipeline.from_yaml', new=MagicMock())
+def test_pipelinesearcher_parallel_score_proposals():
+    instance = PipelineSearcher(n_workers=2)
+    instance._stop = False       # normally, setted in `PipelineSearcher.setup_search`
+    instance.timeout = None      # normally, setted in `PipelineSearcher.setup_search`
+    instance._new_pipeline = MagicMock(side_effect=lambda template, proposal: MagicMock())
+
+    selector_tuner = MagicMock()
+    selector_tuner.propose_batch.side_effect = lambda size: [('template', MagicMock(), {}, False)] * size
+
+    tasks = [MagicMock(), MagicMock(), MagicMock()]
+    tasks[0].get.return_value = {'cv_scores': [0.5], 'score': 0.5, 'partial': False}
+    tasks[1].get.side_effect = IndexError
+    tasks[2].get.return_value = {'cv_scores': [0.8], 'score': 0.8, 'partial': False}
+
+    pool = MagicMock()
+    pool.submit.side_effect = tasks
+    pool.wait.side_effect = [[tasks[1]], [tasks[2], tasks[0]]]
+
+    results = list(instance._parallel_score_proposals(pool, selector_tuner, range(3)))
+
+    assert pool.submit.call_count == 3
+    assert pool.wait.call_count == 2
+    assert [args[0] for args, _ in selector_tuner.propose_batch.call_args_list] == [2, 1]
+    assert [result[1].score for result in results[1:]] == [0.8, 0.5]
+    assert isinstance(results[0][4], IndexError)
+    assert results[1][4] is None
+    assert results[2][4] is None
+
+
+@patch('ta2.search.Pipeline.from_yaml', new=MagicMock())
+def test_pipelinesearcher_get_rungs():
+    assert PipelineSearcher()._get_rungs() == [None]
+    assert PipelineSearcher(halving=3)._get_rungs() == [1, 3, None]
+    assert PipelineSearcher(halving=2)._get_rungs(folds=4) == [1, 2, None]
+
+    with pytest.raises(ValueError):
+        PipelineSearcher(halving=1)
+
+
+@patch('ta2.search.Pipeline.from_yaml', new=MagicMock())
+def test_pipelinesearcher_promote():
+    instance = PipelineSearcher(halving=2)
+    metric = MagicMock()
+    metric.normalize.side_effect = lambda score: score
+
+    # not enough scores in the rung yet
+    assert not instance._promote(0, MagicMock(score=0.9), metric)
+
+    # among the best half
+    assert instance._promote(0, MagicMock(score=0.5), metric) is False
+    assert instance._promote(0, MagicMock(score=0.7), metric) is False
+    assert instance._promote(0, MagicMock(score=0.95), metric)
+
+    assert instance._rung_scores[0] == [0.9, 0.5, 0.7, 0.95]
+
+
+@patch('ta2.search.Pipeline.from_yaml', new=MagicMock())
+def test_pipelinesearcher_score_proposals_halving():
+    instance = PipelineSearcher(halving=3)
+    instance._stop = False       # normally, setted in `PipelineSearcher.setup_search`
+    instance.timeout = None      # normally, setted in `PipelineSearcher.setup_search`
+    instance._new_pipeline = MagicMock(side_effect=lambda template, proposal: MagicMock())
+
+    metric = MagicMock()
+    metric.normalize.side_effect = lambda score: score
+
+    scores = iter([
+        [0.5, 0.5, 0.5, 0.5, 0.5],  # defaults
+        [0.1],                      # worse than the defaults on the first fold
+        [0.9],                      # promoted
+        [0.9, 0.9, 0.2],            # discarded
+    ])
+
+    def score_pipeline(dataset, problem, pipeline, max_folds=None, abort_below=None):
+        pipeline.cv_scores = next(scores)
+        pipeline.score = np.mean(pipeline.cv_scores)
+        pipeline.partial = len(pipeline.cv_scores) < 5
+        pipeline.aborted = False
+
+    instance.score_pipeline = MagicMock(side_effect=score_pipeline)
+
+    selector_tuner = MagicMock()
+    selector_tuner.propose.side_effect = [
+        ('template', MagicMock(), {}, True),
+        ('template', MagicMock(), {}, False),
+        ('template', MagicMock(), {}, False),
+    ]
+
+    results = list(instance._score_proposals('dataset', 'problem', selector_tuner, range(3), metric))
+
+    max_folds = [kwargs['max_folds'] for _, kwargs in instance.score_pipeline.call_args_list]
+    assert max_folds == [None, 1, 1, 3]
+    assert [result[1].partial for result in results] == [False, True, True]
+    assert [result[4] for result in results] == [None, None, None]
+
+
+def test_pipelinesearcher_rank_templates():
+    templates = [
+        Templates.SINGLE_TABLE_CLASSIFICATION_ENC_XGB,
+        Templates.SINGLE_TABLE_CLASSIFICATION_AR_RF,
+        Templates.SINGLE_TABLE_CLASSIFICATION_DFS_ROBUST_XGB,
+    ]
+    meta_features = {
+        'task_type': 'classification',
+        'rows': 100,
+        'columns': 10,
+        'categorical_ratio': 0.0,
+        'text_columns': False,
+        'missing_ratio': 0.0,
+        'target_cardinality': 2,
+    }
+
+    # unknown shape
+    assert PipelineSearcher._rank_templates(templates, {}) == templates
+
+    # nothing to change
+    assert PipelineSearcher._rank_templates(templates, meta_features) == templates
+
+    # many classes
+    ranked = PipelineSearcher._rank_templates(templates, dict(meta_features, target_cardinality=50))
+    assert ranked == [templates[1], templates[0], templates[2]]
+
+    # categorical columns
+    ranked = PipelineSearcher._rank_templates(
+        templates, dict(meta_features, target_cardinality=50, categorical_ratio=0.5))
+    assert ranked == [templates[0], templates[1], templates[2]]
+
+    # big table
+    ranked = PipelineSearcher._rank_templates(templates, dict(meta_features, rows=10 ** 6))
+    assert ranked == [templates[0], templates[1], templates[2]]
+    ranked = PipelineSearcher._rank_templates(templates[::-1], dict(meta_features, rows=10 ** 6))
+    assert ranked == [templates[1], templates[0], templates[2]]
+
+    # missing values
+    ranked = PipelineSearcher._rank_templates(templates, dict(meta_features, missing_ratio=0.1))
+    assert ranked == [templates[0], templates[2]]
+
+    # never left without templates
+    ranked = PipelineSearcher._rank_templates(templates[1:2], dict(meta_features, missing_ratio=0.1))
+    assert ranked == templates[1:2]
+
+
+@patch('ta2.search.Pipeline.from_yaml')
+@patch('ta2.search.os.makedirs')
+def test_pipelinesearcher_get_templates(makedirs_mock, from_yaml_mock):
+    instance = PipelineSearcher()
+    meta_features = {'task_type': 'regression', 'rows': 100, 'columns': 10, 'categorical_ratio': 0.5}
+
+    templates = instance._get_templates('single_table', 'regression')
+    assert templates == [
+        Templates.SINGLE_TABLE_REGRESSION_XGB.value,
+        Templates.SINGLE_TABLE_REGRESSION_SC_XGB.value,
+        Templates.SINGLE_TABLE_REGRESSION_ENC_XGB.value,
+    ]
+
+    templates = instance._get_templates('single_table', 'regression', meta_features)
+    assert templates[0] == Templates.SINGLE_TABLE_REGRESSION_ENC_XGB.value
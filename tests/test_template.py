@@ -0,0 +1,102 @@
+import os
+from unittest.mock import MagicMock, call, patch
+
+from ta2.cache import StepCache
+from ta2.template import _read_volumes, load_template, preload_templates
+
+TEMPLATE = """
+steps:
+- primitive: d3m.primitives.test.Primitive
+  hyperparams:
+    param:
+      data: 1
+tunable_hyperparameters:
+  '0':
+    param:
+      type: int
+      range: [1, 10]
+      default: 1
+"""
+
+
+@patch('ta2.template._get_installed_versions')
+@patch('ta2.template.TEMPLATE_CACHE', new_callable=StepCache)
+@patch('ta2.template.PrimitiveStep')
+@patch('ta2.template.Pipeline')
+@patch('ta2.template.index.get_primitive')
+def test_load_template(get_primitive_mock, pipeline_mock, step_mock, cache, versions_mock, tmp_path):
+    versions_mock.return_value = {'d3m.primitives.test.Primitive': '1.0'}
+    template_path = tmp_path / 'template.yml'
+    template_path.write_text(TEMPLATE)
+
+    pipeline, tunable_hyperparameters = load_template(str(template_path))
+
+    assert pipeline == pipeline_mock.return_value
+    assert tunable_hyperparameters == {'0': {'param': {'type': 'int', 'range': [1, 10], 'default': 1}}}
+    get_primitive_mock.assert_called_once_with('d3m.primitives.test.Primitive')
+
+    # compiled only once
+    assert load_template(str(template_path)) == (pipeline, tunable_hyperparameters)
+    assert get_primitive_mock.call_count == 1
+
+    # the data augmentation variant is compiled separately
+    _, tunable_hyperparameters = load_template(str(template_path), 'data-augmentation')
+    assert list(tunable_hyperparameters) == ['1']
+    assert get_primitive_mock.call_count == 3
+
+    # and compiled again when the template changes
+    template_path.write_text(TEMPLATE.replace('data: 1', 'data: 2'))
+    load_template(str(template_path))
+    assert get_primitive_mock.call_count == 4
+
+    # and when its primitives are upgraded
+    versions_mock.return_value = {'d3m.primitives.test.Primitive': '2.0'}
+    load_template(str(template_path))
+    assert get_primitive_mock.call_count == 5
+
+
+@patch('ta2.template._read_volumes')
+@patch('ta2.template.load_template')
+def test_preload_templates(load_template_mock, read_volumes_mock, tmp_path):
+    for filename in ['a.yml', 'b.yml', 'README.md']:
+        (tmp_path / filename).write_text('')
+
+    primitive = MagicMock()
+    pipeline = MagicMock(steps=[MagicMock(primitive=primitive)] * 2)
+    load_template_mock.side_effect = [(pipeline, {}), Exception('missing primitive')]
+
+    with patch('ta2.template.TEMPLATES_DIR', str(tmp_path)):
+        preload_templates()
+
+        assert load_template_mock.call_args_list == [call('a.yml'), call('b.yml')]
+        assert not read_volumes_mock.called
+
+        load_template_mock.side_effect = [(pipeline, {}), (pipeline, {})]
+        preload_templates('static')
+
+        read_volumes_mock.assert_called_once_with(primitive, 'static')
+
+
+def test_read_volumes(tmp_path):
+    (tmp_path / 'file-digest').write_bytes(b'weights')
+    (tmp_path / 'tarball-digest').mkdir()
+    (tmp_path / 'tarball-digest' / 'model.h5').write_bytes(b'weights')
+
+    primitive = MagicMock()
+    primitive.metadata.query.return_value = {
+        'id': 'primitive-id',
+        'installation': [
+            {'type': 'PIP', 'package': 'primitive'},
+            {'type': 'FILE', 'key': 'weights', 'file_digest': 'file-digest'},
+            {'type': 'TARBALL', 'key': 'model', 'file_digest': 'tarball-digest'},
+            {'type': 'FILE', 'key': 'missing', 'file_digest': 'missing-digest'},
+        ]
+    }
+
+    with patch('ta2.template.open', create=True, side_effect=open) as open_mock:
+        _read_volumes(primitive, str(tmp_path))
+
+    assert open_mock.call_args_list == [
+        call(os.path.join(str(tmp_path), 'file-digest'), 'rb'),
+        call(os.path.join(str(tmp_path), 'tarball-digest', 'model.h5'), 'rb'),
+    ]
@@ -0,0 +1,161 @@
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+from btb import HyperParameter
+
+from ta2 import __main__
+from ta2.tuning import TUNERS, ForestTuner, SelectorTuner, WindowedGP
+
+
+class DummyTuner:
+
+    def __init__(self):
+        self.scored = list()
+
+    def add(self, proposal, score):
+        self.scored.append(proposal['value'])
+
+    def propose(self, num_proposals):
+        # The first value that has not been scored yet
+        return {'value': min(set(range(10)) - set(self.scored))}
+
+
+@patch.dict('ta2.tuning.TUNERS', {'gp': lambda tunables: DummyTuner()})
+@patch('ta2.tuning.SelectorTuner._get_tunables', new=staticmethod(lambda params: ([], {'value': 0})))
+@patch('ta2.tuning.load_template', new=lambda name: (MagicMock(), {}))
+def test_selectortuner_propose_batch():
+    selector_tuner = SelectorTuner(['template'], False)
+
+    # defaults
+    template_name, _, proposal, defaults = selector_tuner.propose()
+    assert defaults
+    selector_tuner.add(template_name, proposal, 0.5)
+
+    # the pending proposals are not proposed again
+    proposals = selector_tuner.propose_batch(3)
+    assert [proposal['value'] for _, _, proposal, _ in proposals] == [1, 2, 3]
+    assert not any(defaults for _, _, _, defaults in proposals)
+    assert len(selector_tuner.pending['template']) == 3
+
+    # a scored proposal is not pending anymore
+    selector_tuner.add('template', proposals[0][2], 0.7)
+    assert len(selector_tuner.pending['template']) == 2
+    assert selector_tuner.scores['template'] == [0.5, 0.7]
+
+    # the tuner itself does not keep the lies
+    assert selector_tuner.templates['template'][1].scored == [0, 1]
+
+
+def test_selectortuner_get_lie():
+    selector_tuner = SelectorTuner(['a', 'b', 'c'], False)
+
+    assert selector_tuner._get_lie('a') == 0.0
+
+    selector_tuner.scores['a'] = [0.5, 0.2]
+    selector_tuner.scores['b'] = [0.9]
+
+    assert selector_tuner._get_lie('a') == 0.2
+    assert selector_tuner._get_lie('b') == 0.9
+    assert selector_tuner._get_lie('c') == 0.2
+
+
+def test_selectortuner_unknown_tuner():
+    with pytest.raises(ValueError):
+        SelectorTuner(['template'], False, 'unknown')
+
+
+@patch('ta2.tuning.GP.fit')
+def test_windowedgp_fit(fit_mock):
+    tunables = [('x', HyperParameter('float', [0, 1]))]
+    tuner = WindowedGP(tunables, window=4)
+
+    X = np.arange(10).reshape(-1, 1)
+    y = np.array([9, 8, 0, 0, 0, 0, 0, 0, 1, 2])
+    tuner.fit(X, y)
+
+    # the two best and the two most recent scores
+    window_X, window_y = fit_mock.call_args[0]
+    assert list(window_X[:, 0]) == [0, 1, 8, 9]
+    assert list(window_y) == [9, 8, 1, 2]
+
+
+def test_foresttuner_propose():
+    tunables = [('x', HyperParameter('float', [0, 1]))]
+    tuner = ForestTuner(tunables, n_estimators=5)
+
+    # random proposals until there are enough scores
+    proposal = tuner.propose()
+    assert 0 <= proposal['x'] <= 1
+
+    for x in [0.1, 0.2, 0.8, 0.9]:
+        tuner.add({'x': x}, x)
+
+    assert tuner.model is not None
+    predictions = tuner.predict(np.array([[0.1], [0.9]]))
+    assert predictions.shape == (2, 2)
+    assert predictions[0, 0] < predictions[1, 0]
+
+
+@patch.dict('ta2.tuning.TUNERS', {'gp': lambda tunables: DummyTuner()})
+@patch('ta2.tuning.SelectorTuner._get_tunables',
+       new=staticmethod(lambda params: ([('value', None)], {'value': 0})))
+@patch('ta2.tuning.load_template', new=lambda name: (MagicMock(), {}))
+def test_selectortuner_warm_start():
+    history = [
+        {'template': 'a', 'hyperparameters': {'value': 5}, 'normalized_score': 0.9},
+        {'template': 'a', 'hyperparameters': {'other': 1}, 'normalized_score': 0.8},
+        {'template': 'c', 'hyperparameters': {'value': 6}, 'normalized_score': 0.7},
+    ]
+    selector_tuner = SelectorTuner(['a', 'b'], False, history=history)
+
+    _, _, proposal_a, _ = selector_tuner.propose()
+    _, _, proposal_b, _ = selector_tuner.propose()
+
+    # only the records with the same template and hyperparameters are used
+    assert selector_tuner.templates['a'][1].scored == [5]
+    assert selector_tuner.templates['b'][1].scored == []
+    assert selector_tuner.prior_scores == {'a': [0.9]}
+
+    # the prior scores are added to the ones of this search, or to the lies
+    selector_tuner.add('b', proposal_b, 0.5)
+    assert selector_tuner._get_selector_scores() == {'a': [0.9, 0.5], 'b': [0.5]}
+
+    selector_tuner.add('a', proposal_a, 0.6)
+    assert selector_tuner._get_selector_scores() == {'a': [0.9, 0.6], 'b': [0.5]}
+
+
+def test_selectortuner_get_cost():
+    selector_tuner = SelectorTuner(['a', 'b', 'c'], False)
+
+    assert selector_tuner._get_cost('a') is None
+
+    selector_tuner.prior_elapsed['a'] = [1.0]
+    selector_tuner.elapsed['a'] = [3.0]
+    selector_tuner.elapsed['b'] = [8.0]
+
+    assert selector_tuner._get_cost('a') == 2.0
+    assert selector_tuner._get_cost('b') == 8.0
+    assert selector_tuner._get_cost('c') == 4.0
+
+
+def test_selectortuner_select():
+    selector_tuner = SelectorTuner(['fast', 'slow'], False)
+    selector_tuner.selector = MagicMock()
+    scores = {'fast': [0.5, 0.6], 'slow': [0.6, 0.7]}
+
+    # without timings, UCB1 decides
+    assert selector_tuner._select(scores) == selector_tuner.selector.select.return_value
+
+    # similar scores, but one is much cheaper
+    selector_tuner.elapsed['fast'] = [1.0, 1.0]
+    selector_tuner.elapsed['slow'] = [10.0, 10.0]
+    assert selector_tuner._select(scores) == 'fast'
+
+    # similar costs
+    selector_tuner.elapsed['fast'] = [10.0, 10.0]
+    assert selector_tuner._select(scores) == 'slow'
+
+
+def test_tuners_cli_choices():
+    assert sorted(__main__.TUNERS) == sorted(TUNERS)
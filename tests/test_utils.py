@@ -0,0 +1,51 @@
+import json
+import os
+
+from ta2.utils import DatasetIndex, get_dataset_index, get_digest
+
+
+def test_get_digest():
+    assert get_digest({'a': 1, 'b': [1, 2]}) == get_digest({'b': [1, 2], 'a': 1})
+    assert get_digest({'a': 1}) != get_digest({'a': 2})
+
+
+def _write_doc(dataset_doc_dir, dataset_id):
+    dataset_doc_dir.mkdir(parents=True, exist_ok=True)
+    dataset_doc_path = dataset_doc_dir / 'datasetDoc.json'
+    dataset_doc_path.write_text(json.dumps({'about': {'datasetID': dataset_id}}))
+    return dataset_doc_path
+
+
+def test_datasetindex(tmp_path):
+    train_doc = _write_doc(tmp_path / 'dataset-1' / 'TRAIN' / 'dataset_TRAIN', 'dataset-1_dataset_TRAIN')
+    full_doc = _write_doc(tmp_path / 'dataset-1' / 'dataset-1_dataset', 'dataset-1_dataset')
+    (tmp_path / 'not-a-dataset').mkdir()
+    (tmp_path / 'README.md').write_text('')
+
+    index = DatasetIndex(str(tmp_path))
+
+    assert index.find('dataset-1_dataset_TRAIN') == ('dataset-1', 'file://' + str(train_doc))
+    assert index.find('dataset-1_dataset') == ('dataset-1', 'file://' + str(full_doc))
+    assert index.find('dataset-2_dataset_TRAIN') is None
+
+    # a new dataset is found without parsing the known ones again
+    new_doc = _write_doc(tmp_path / 'dataset-2' / 'TRAIN' / 'dataset_TRAIN', 'dataset-2_dataset_TRAIN')
+    train_doc.write_text('invalid json')
+    os.utime(str(train_doc), ns=(os.stat(str(train_doc)).st_atime_ns, index._docs[str(train_doc)][0]))
+
+    assert index.find('dataset-2_dataset_TRAIN') == ('dataset-2', 'file://' + str(new_doc))
+    assert index.find('dataset-1_dataset_TRAIN') == ('dataset-1', 'file://' + str(train_doc))
+
+    # a modified datasetDoc is parsed again
+    train_doc.write_text(json.dumps({'about': {'datasetID': 'renamed'}}))
+    os.utime(str(train_doc), ns=(0, 0))
+
+    assert index.find('dataset-1_dataset_TRAIN') is None
+    assert index.find('renamed') == ('dataset-1', 'file://' + str(train_doc))
+
+
+def test_get_dataset_index(tmp_path):
+    index = get_dataset_index(str(tmp_path))
+
+    assert get_dataset_index(str(tmp_path / '.')) is index
+    assert get_dataset_index(str(tmp_path / 'other')) is not index
@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+
+import pytest
+
+from ta2.workers import WorkerCrashed, WorkerPool, share, unshare
+
+_INITIALIZED = dict()
+
+
+def _initialize(value):
+    _INITIALIZED['value'] = value
+
+
+def _get_initialized():
+    return _INITIALIZED.get('value')
+
+
+def _add(a, b=0):
+    return a + b
+
+
+def _fail():
+    raise IndexError('test-error')
+
+
+def _crash():
+    os._exit(1)
+
+
+def _get_pid(*args):
+    return os.getpid()
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def _sum(values):
+    return sum(values)
+
+
+def _share_and_unshare(value):
+    unshare(share(value))
+    return value
+
+
+def test_workerpool_run():
+    pool = WorkerPool(2)
+    try:
+        assert pool.run(_add, 1, b=2) == 3
+
+        with pytest.raises(IndexError):
+            pool.run(_fail)
+
+        # the worker is reused after an error
+        assert pool.run(_add, 3) == 3
+        assert len(pool._workers) == 1
+
+    finally:
+        pool.terminate()
+
+
+def test_workerpool_crash():
+    pool = WorkerPool(1)
+    try:
+        with pytest.raises(WorkerCrashed):
+            pool.run(_crash)
+
+        # the crashed worker has been restarted
+        assert pool.run(_add, 1, 2) == 3
+
+    finally:
+        pool.terminate()
+
+
+def test_workerpool_initializer():
+    pool = WorkerPool(1, _initialize, ('test-value', ))
+    try:
+        assert pool.run(_get_initialized) == 'test-value'
+
+    finally:
+        pool.terminate()
+
+
+def test_workerpool_map():
+    pool = WorkerPool(2)
+    try:
+        arguments = [(i, i) for i in range(5)]
+        assert pool.map(_add, arguments) == [0, 2, 4, 6, 8]
+        assert len(pool._workers) == 2
+
+    finally:
+        pool.terminate()
+
+
+def test_workerpool_map_threads():
+    pool = WorkerPool(4)
+    try:
+        results = dict()
+
+        def map_sleep(name):
+            results[name] = pool.map(_sleep, [(0.2, )] * 5)
+
+        # each thread can take half of the workers, and neither waits for more
+        threads = [threading.Thread(target=map_sleep, args=(name, )) for name in ('a', 'b')]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join(10)
+
+        assert not any(thread.is_alive() for thread in threads)
+        assert results == {'a': [0.2] * 5, 'b': [0.2] * 5}
+
+    finally:
+        pool.terminate()
+
+
+def test_workerpool_wait():
+    pool = WorkerPool(2)
+    try:
+        tasks = [pool.submit(_add, 1, 1), pool.submit(_crash)]
+
+        finished = list()
+        while len(finished) < len(tasks):
+            finished.extend(pool.wait(tasks, timeout=1))
+
+        assert tasks[0].get() == 2
+        with pytest.raises(WorkerCrashed):
+            tasks[1].get()
+
+    finally:
+        pool.terminate()
+
+
+def test_workerpool_share():
+    pool = WorkerPool(1)
+    try:
+        pid = pool.run(_get_pid)
+
+        # the worker was started before the object was shared
+        shared = share([1, 2, 3])
+        assert pool.run(_sum, shared) == 6
+
+        restarted_pid = pool.run(_get_pid)
+        assert restarted_pid != pid
+
+        # the worker is not restarted again while the object is shared
+        assert pool.run(_add, [0], b=shared) == [0, 1, 2, 3]
+        assert pool.map(_sum, [(shared, ), (shared, )]) == [6, 6]
+        assert pool.run(_get_pid) == restarted_pid
+
+        # idle workers holding objects that are not shared anymore are released
+        unshare(shared)
+        assert len(pool._workers) == 0
+
+    finally:
+        pool.terminate()
+
+
+def test_workerpool_share_in_worker():
+    pool = WorkerPool(1)
+    try:
+        shared = share([1, 2, 3])
+        task = pool.submit(_share_and_unshare, shared)
+
+        # the worker does not inherit a lock that is held forever
+        assert pool.wait([task], timeout=5) == [task]
+        assert task.get() == [1, 2, 3]
+
+    finally:
+        unshare(shared)
+        pool.terminate()